@@ -0,0 +1,75 @@
+import numpy as np
+
+
+class AudioRingBuffer:
+    def __init__(self, capacity, channels, dtype=np.float32):
+        """
+        Preallocated ring buffer of audio frames for one producer and one consumer thread.
+        Positions only grow and each is advanced by one side, so no lock is needed.
+        :param capacity: Size in frames (samples per channel)
+        :param channels: Number of channels
+        :param dtype: Sample type
+        """
+        self.capacity = capacity
+        self.channels = channels
+        self.buffer = np.zeros((capacity, channels), dtype=dtype)
+        self._write_pos = 0  # Всего записано кадров (меняет только писатель)
+        self._read_pos = 0  # Всего прочитано кадров (меняет только читатель)
+        self.overflows = 0  # Кадры, отброшенные из-за переполнения
+
+    def available(self):
+        """Number of frames ready to be read"""
+        return self._write_pos - self._read_pos
+
+    def write(self, block):
+        """
+        Copy a block into the buffer without allocating. Frames that do not fit are dropped.
+        :param block: Array (frames, channels)
+        :return: Number of frames written
+        """
+        n = len(block)
+        free = self.capacity - (self._write_pos - self._read_pos)
+        if n > free:
+            self.overflows += n - free
+            n = free
+        if n <= 0:
+            return 0
+        start = self._write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        self.buffer[start:start + first] = block[:first]
+        if first < n:
+            self.buffer[:n - first] = block[first:n]
+        # Позицию двигаем после копирования: читатель не увидит недописанных кадров
+        self._write_pos += n
+        return n
+
+    def read(self, out):
+        """
+        Move up to len(out) frames into out
+        :param out: Preallocated array (frames, channels)
+        :return: Number of frames read
+        """
+        n = min(len(out), self._write_pos - self._read_pos)
+        if n <= 0:
+            return 0
+        start = self._read_pos % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self.buffer[start:start + first]
+        if first < n:
+            out[first:n] = self.buffer[:n - first]
+        self._read_pos += n
+        return n
+
+    def skip(self, frames):
+        """
+        Drop up to frames unread frames from the reader side
+        :return: Number of frames dropped
+        """
+        n = min(frames, self._write_pos - self._read_pos)
+        if n > 0:
+            self._read_pos += n
+        return max(n, 0)
+
+    def clear(self):
+        """Drop unread frames. Only call while no writer is active."""
+        self._read_pos = self._write_pos
@@ -1,54 +1,141 @@
 import sounddevice as sd
 import soundfile as sf
 import numpy as np
-import queue
+import os
+import shutil
+import tempfile
 import threading
+from audio_engine import DeviceInput
 
 class AudioCapture:
-    def __init__(self):
+    def __init__(self, device=None, buffer_seconds=2.0):
+        """
+        Record one input device straight to a WAV file
+        :param device: sounddevice device id or name, None for the default input
+        :param buffer_seconds: Audio held in memory between the device callback and the file writer
+        """
         self.is_capturing = False
+        self.device = device
         self.sample_rate = 44100
         self.channels = 2
-        self.audio_queue = queue.Queue()
-        self.recording_thread = None
-        self.audio_data = []
+        self.buffer_seconds = buffer_seconds
+        self.input = None
+        self.writer_thread = None
+        self.capture_file = None
+        self.frames_written = 0
+        self.error = None
+        self._temp_file = False
+        self._sound_file = None
+        self._file_lock = threading.Lock()
+        self._stop_event = threading.Event()
 
-    def start_capture(self):
-        """Start capturing audio"""
-        if not self.is_capturing:
-            self.is_capturing = True
-            self.audio_data = []
-            self.recording_thread = threading.Thread(target=self._capture_audio)
-            self.recording_thread.start()
+    def start_capture(self, filename=None):
+        """
+        Start capturing audio. Audio is written to disk while capturing.
+        :param filename: WAV file to write to, None for a temporary file picked up by save_audio
+        """
+        if self.is_capturing:
+            return
+        # Несохранённый временный файл прошлого захвата больше не нужен
+        self._remove_temp_file()
+        self.frames_written = 0
+        self.error = None
+        try:
+            # Тот же вход, что и в микшере; очередь не урезается, пока в ней меньше buffer_seconds
+            self.input = DeviceInput('capture', device=self.device, latency=self.buffer_seconds)
+        except Exception as e:
+            print(f"Audio capture error: {str(e)}")
+            self.error = e
+            return
+        self.sample_rate = self.input.sample_rate
+        self.channels = self.input.channels
+        if filename is None:
+            fd, filename = tempfile.mkstemp(prefix='rtp_audio_', suffix='.wav')
+            os.close(fd)
+            self._temp_file = True
+        self.capture_file = filename
+        self._sound_file = sf.SoundFile(filename, 'w', samplerate=self.sample_rate,
+                                        channels=self.channels, subtype='PCM_16')
+        try:
+            self.input.start()
+        except Exception as e:
+            print(f"Audio capture error: {str(e)}")
+            self.error = e
+            self.input = None
+            self._sound_file.close()
+            return
+        self._stop_event.clear()
+        self.is_capturing = True
+        self.writer_thread = threading.Thread(target=self._write_audio, daemon=True, name="audio-writer")
+        self.writer_thread.start()
 
     def stop_capture(self):
-        """Stop capturing audio"""
+        """Stop capturing audio and finish the file"""
         self.is_capturing = False
-        if self.recording_thread:
-            self.recording_thread.join()
+        if self.input is not None:
+            self.input.stop()
+        self._stop_event.set()
+        if self.writer_thread:
+            self.writer_thread.join()
+            self.writer_thread = None
+        self.input = None
 
-    def _capture_audio(self):
-        """Internal method to capture audio"""
-        def callback(indata, frames, time, status):
-            if status:
-                print(status)
-            if self.is_capturing:
-                self.audio_data.append(indata.copy())
+    @property
+    def dropped(self):
+        """Frames lost because the writer fell more than buffer_seconds behind the device"""
+        if self.input is None:
+            return 0
+        return self.input.dropped + self.input.ring.overflows
 
-        with sd.InputStream(samplerate=self.sample_rate,
-                          channels=self.channels,
-                          callback=callback):
-            while self.is_capturing:
-                sd.sleep(100)
+    def _write_audio(self):
+        """Internal method that drains the device input into the open sound file"""
+        audio_input = self.input
+        # Пишем кусками по ~100 мс, чтобы не дёргать диск на каждый блок
+        chunk = np.empty((self.sample_rate // 10, self.channels), dtype=np.float32)
+        try:
+            while True:
+                stopping = self._stop_event.wait(0.05)
+                while True:
+                    n = audio_input.pull(chunk)
+                    if n == 0:
+                        break
+                    with self._file_lock:
+                        self._sound_file.write(chunk[:n])
+                    self.frames_written += n
+                if stopping:
+                    break
+        except Exception as e:
+            print(f"Audio write error: {str(e)}")
+            self.error = e
+        finally:
+            with self._file_lock:
+                self._sound_file.close()
 
     def save_audio(self, filename):
         """
-        Save captured audio to file
-        :param filename: Output filename
+        Save captured audio to file. The audio is already on disk,
+        so this only moves (or, while still capturing, copies) the capture file.
+        :param filename: Output filename (WAV)
         """
-        if self.audio_data:
-            audio_data = np.concatenate(self.audio_data, axis=0)
-            sf.write(filename, audio_data, self.sample_rate)
+        if self.capture_file is None or os.path.abspath(filename) == os.path.abspath(self.capture_file):
+            return
+        if self.is_capturing:
+            with self._file_lock:
+                # Обновляем заголовок WAV, чтобы копия была корректным файлом
+                self._sound_file.flush()
+                shutil.copyfile(self.capture_file, filename)
+            return
+        if self._temp_file:
+            shutil.move(self.capture_file, filename)
+            self.capture_file = filename
+            self._temp_file = False
+        else:
+            shutil.copyfile(self.capture_file, filename)
+
+    def _remove_temp_file(self):
+        if self._temp_file and self.capture_file and os.path.exists(self.capture_file):
+            os.remove(self.capture_file)
+        self._temp_file = False
 
     def get_available_devices(self):
         """
@@ -61,4 +148,4 @@ class AudioCapture:
             'name': device['name'],
             'channels': device['max_input_channels'],
             'sample_rate': device['default_samplerate']
-        } for i, device in enumerate(devices) if device['max_input_channels'] > 0] 
\ No newline at end of file
+        } for i, device in enumerate(devices) if device['max_input_channels'] > 0]
@@ -0,0 +1,453 @@
+import threading
+import time
+import numpy as np
+from audio_buffer import AudioRingBuffer
+from audio_meter import MeterBank
+from frame_pool import FramePool
+from master_clock import MasterClock
+from stats import registry, stage_timer
+
+_mix_timer = stage_timer('audio_mix')
+
+
+class _LinearResampler:
+    def __init__(self, src_rate, dst_rate, channels, block):
+        """
+        Streaming linear-interpolation resampler producing fixed-size blocks
+        :param src_rate: Input sample rate
+        :param dst_rate: Output sample rate
+        :param channels: Number of channels
+        :param block: Output block size in frames
+        """
+        self.ratio = src_rate / dst_rate
+        self._steps = np.arange(block, dtype=np.float64) * self.ratio
+        self._pos = np.empty(block, dtype=np.float64)
+        self._idx = np.empty(block, dtype=np.intp)
+        self._frac = np.empty((block, 1), dtype=np.float32)
+        self._a = np.empty((block, channels), dtype=np.float32)
+        self._b = np.empty((block, channels), dtype=np.float32)
+        # Входные кадры: в начале — перенесённые с прошлого блока, затем новые
+        self._in = np.zeros((int(np.ceil(block * self.ratio)) + 3, channels), dtype=np.float32)
+        self._keep = 0
+        self._phase = 0.0
+
+    def process(self, pull, out):
+        """
+        Fill out with resampled audio
+        :param pull: Callable filling a (frames, channels) array with input audio and returning the count
+        :param out: Array (block, channels) to fill
+        """
+        n = len(out)
+        pos = self._pos[:n]
+        np.add(self._steps[:n], self._phase, out=pos)
+        last = pos[-1]
+        need = int(last) + 2
+        if need > self._keep:
+            got = pull(self._in[self._keep:need])
+            if self._keep + got < need:
+                self._in[self._keep + got:need] = 0
+        idx = self._idx[:n]
+        frac = self._frac[:n]
+        np.copyto(idx, pos, casting='unsafe')
+        np.subtract(pos, idx, out=frac[:, 0], casting='unsafe')
+        a, b = self._a[:n], self._b[:n]
+        np.take(self._in, idx, axis=0, out=a)
+        np.take(self._in[1:], idx, axis=0, out=b)
+        # out = a + (b - a) * frac
+        np.subtract(b, a, out=b)
+        np.multiply(b, frac, out=b)
+        np.add(a, b, out=out)
+        next_pos = last + self.ratio
+        k = min(int(next_pos), need - 1)
+        self._keep = need - k
+        self._in[:self._keep] = self._in[k:need]
+        self._phase = next_pos - k
+
+
+class AudioInput:
+    def __init__(self, name, channels=2, gain=1.0, muted=False):
+        """
+        Source of audio for the mixer; the mixer pulls one block at a time
+        :param name: Unique input name
+        :param channels: Channels delivered by the input
+        :param gain: Linear gain
+        :param muted: Exclude from the mix
+        """
+        self.name = name
+        self.channels = channels
+        self.sample_rate = 48000
+        self.gain = gain
+        self.muted = muted
+        self.underruns = 0  # Кадры, которых не хватило к моменту смешивания
+        self._block = None
+        self._resampler = None
+
+    def start(self):
+        """Open the underlying device or file"""
+        pass
+
+    def stop(self):
+        """Close the underlying device or file"""
+        pass
+
+    def pull(self, out):
+        """
+        Fill out with audio at self.sample_rate
+        :param out: Array (frames, channels)
+        :return: Number of frames written
+        """
+        raise NotImplementedError
+
+    def prepare(self, sample_rate, block_size):
+        """Allocate buffers for the mixer's rate and block size"""
+        self._block = np.zeros((block_size, self.channels), dtype=np.float32)
+        self._resampler = None
+        if self.sample_rate != sample_rate:
+            self._resampler = _LinearResampler(self.sample_rate, sample_rate, self.channels, block_size)
+
+    def read_block(self):
+        """
+        Get the next block at the mixer's rate
+        :return: Array (block_size, channels); valid until the next call
+        """
+        if self._resampler is not None:
+            self._resampler.process(self._pull_counted, self._block)
+        else:
+            got = self._pull_counted(self._block)
+            if got < len(self._block):
+                self._block[got:] = 0
+        return self._block
+
+    def _pull_counted(self, out):
+        got = self.pull(out)
+        self.underruns += len(out) - got
+        return got
+
+
+class DeviceInput(AudioInput):
+    def __init__(self, name, device=None, channels=None, sample_rate=None, latency=0.02, **kwargs):
+        """
+        Audio input device (microphone, line in, loopback)
+        :param device: sounddevice device id or name, None for the default input
+        :param channels: Channels to open, None for up to two the device has
+        :param sample_rate: Device rate, None for the device default
+        :param latency: Seconds of audio left queued after a block is read; older audio is dropped,
+                        so the input stays about one block behind the device
+        """
+        import sounddevice as sd
+        info = sd.query_devices(device, 'input')
+        if channels is None:
+            channels = max(1, min(2, int(info['max_input_channels'])))
+        super().__init__(name, channels=channels, **kwargs)
+        self.device = device
+        self.latency = latency
+        self.dropped = 0  # Кадры, отброшенные, чтобы задержка не росла
+        self.stream = None
+        self._sd = sd
+        if sample_rate is None:
+            sample_rate = int(info['default_samplerate'])
+        self.sample_rate = sample_rate
+        # Не меньше секунды и с запасом над latency, чтобы урезание очереди опережало переполнение
+        self.ring = AudioRingBuffer(int(sample_rate * max(1.0, 2 * latency)), channels)
+
+    def start(self):
+        ring = self.ring
+
+        def callback(indata, frames, time, status):
+            ring.write(indata)
+
+        self.ring.clear()
+        self.stream = self._sd.InputStream(device=self.device, channels=self.channels,
+                                           samplerate=self.sample_rate, dtype='float32',
+                                           callback=callback)
+        self.stream.start()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def pull(self, out):
+        # Часы устройства и микшера немного расходятся — не даём очереди расти:
+        # каждый кадр в очереди задерживает звук относительно метки времени блока
+        excess = self.ring.available() - len(out) - int(self.latency * self.sample_rate)
+        if excess > 0:
+            self.dropped += self.ring.skip(excess)
+        return self.ring.read(out)
+
+
+class FileInput(AudioInput):
+    def __init__(self, name, path, loop=True, **kwargs):
+        """
+        Audio file played into the mix, e.g. music or a test stand-in for a device
+        :param path: Any file soundfile can read
+        :param loop: Start over at the end of the file
+        """
+        import soundfile as sf
+        self._file = sf.SoundFile(path)
+        super().__init__(name, channels=self._file.channels, **kwargs)
+        self.path = path
+        self.loop = loop
+        self.sample_rate = self._file.samplerate
+
+    def stop(self):
+        self._file.close()
+
+    def pull(self, out):
+        got = 0
+        while got < len(out):
+            n = len(self._file.read(len(out) - got, dtype='float32', out=out[got:]))
+            got += n
+            if n == 0:
+                if not self.loop:
+                    break
+                self._file.seek(0)
+        return got
+
+
+class SyntheticInput(AudioInput):
+    def __init__(self, name, frequency=440.0, amplitude=0.2, sample_rate=48000, channels=2, **kwargs):
+        """
+        Sine tone, for tests and benchmarks without audio hardware
+        :param frequency: Tone frequency in Hz
+        :param amplitude: Peak amplitude, 0..1
+        """
+        super().__init__(name, channels=channels, **kwargs)
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.sample_rate = sample_rate
+        self._position = 0
+        self._phase = None
+
+    def pull(self, out):
+        n = len(out)
+        if self._phase is None or len(self._phase) < n:
+            self._phase = np.empty(n, dtype=np.float64)
+        phase = self._phase[:n]
+        # Фаза от абсолютного номера сэмпла: тон не зависит от размера блоков
+        np.add(np.arange(n, dtype=np.float64), self._position, out=phase)
+        np.multiply(phase, 2 * np.pi * self.frequency / self.sample_rate, out=phase)
+        np.sin(phase, out=phase)
+        np.multiply(phase, self.amplitude, out=phase)
+        out[:n] = phase[:, None]
+        self._position += n
+        return n
+
+
+def find_loopback_device():
+    """
+    Find an input device that records what the system plays
+    :return: Device id or None
+    """
+    try:
+        import sounddevice as sd
+        devices = sd.query_devices()
+    except Exception:
+        return None
+    for i, device in enumerate(devices):
+        name = device['name'].lower()
+        if device['max_input_channels'] > 0 and \
+                ('stereo mix' in name or 'loopback' in name or 'monitor' in name):
+            return i
+    return None
+
+
+class AudioEngine:
+    def __init__(self, sample_rate=48000, channels=2, block_size=1024, clock=None):
+        """
+        Mixer that pulls every input once per block, applies gain and mute and publishes the mix
+        :param sample_rate: Rate of the mix; inputs at other rates are resampled
+        :param channels: Channels of the mix
+        :param block_size: Frames per block
+        :param clock: Shared MasterClock the block timestamps are on
+        """
+        self.clock = clock or MasterClock()
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_size = block_size
+        self.master_gain = 1.0
+        self.is_running = False
+        self.start_time = None
+        self.samples_mixed = 0
+        self.late_blocks = 0
+        self.resyncs = 0
+        self._inputs = []
+        # Измерители всех входов (после усиления) и общей шины; пересоздаются вместе со списком входов
+        self._meters = self._make_meters(self._inputs)
+        self._outputs = []
+        self._pool = FramePool((block_size, channels), dtype=np.float32, max_free=16)
+        self._thread = None
+        self._stop_event = threading.Event()
+        registry.register('audio', self.get_stats)
+
+    @property
+    def inputs(self):
+        return list(self._inputs)
+
+    def get_input(self, name):
+        for inp in self._inputs:
+            if inp.name == name:
+                return inp
+        return None
+
+    def add_input(self, audio_input):
+        """
+        Add an input to the mix and start it
+        :param audio_input: AudioInput with a unique name
+        """
+        if self.get_input(audio_input.name) is not None:
+            raise ValueError(f"Audio input already exists: {audio_input.name}")
+        audio_input.prepare(self.sample_rate, self.block_size)
+        audio_input.start()
+        self._set_inputs(self._inputs + [audio_input])
+
+    def remove_input(self, name):
+        """Stop an input and remove it from the mix"""
+        audio_input = self.get_input(name)
+        if audio_input is None:
+            return
+        self._set_inputs([inp for inp in self._inputs if inp is not audio_input])
+        audio_input.stop()
+
+    def _make_meters(self, inputs):
+        """Meter bank of the inputs followed by the master bus, paired with the inputs it measures"""
+        layout = [inp.channels for inp in inputs] + [self.channels]
+        return inputs, MeterBank(layout, self.sample_rate, self.block_size)
+
+    def _set_inputs(self, inputs):
+        # Поток микшера берёт входы вместе с их измерителями одной ссылкой
+        self._meters = self._make_meters(inputs)
+        self._inputs = inputs
+
+    def set_gain(self, name, gain):
+        """
+        Set the linear gain of an input
+        :param name: Input name
+        :param gain: Linear gain, 1.0 for unity
+        """
+        self.get_input(name).gain = gain
+
+    def set_muted(self, name, muted):
+        self.get_input(name).muted = muted
+
+    def get_stats(self):
+        """
+        Get the mixer counters
+        :return: Dictionary with blocks mixed late, resyncs and per-input underruns
+        """
+        return {
+            'blocks': self.samples_mixed // self.block_size,
+            'late_blocks': self.late_blocks,
+            'resyncs': self.resyncs,
+            'underruns': {inp.name: inp.underruns for inp in self._inputs},
+            'dropped': {inp.name: inp.dropped for inp in self._inputs if hasattr(inp, 'dropped')}
+        }
+
+    def get_levels(self):
+        """
+        Get the latest meter readings without waiting for the mixer thread
+        :return: Dictionary of input name (and 'master') to MeterSnapshot
+        """
+        inputs, meters = self._meters
+        snapshots = meters.snapshots
+        levels = {inp.name: snapshot for inp, snapshot in zip(inputs, snapshots)}
+        levels['master'] = snapshots[-1]
+        return levels
+
+    def add_output(self, callback):
+        """
+        Register a consumer of mixed blocks. Called on the mixer thread, must not block.
+        :param callback: Callable taking (FrameBuffer of (block_size, channels) float32, pts in seconds
+                         on the master clock); it must retain() the buffer to keep it
+        """
+        if callback not in self._outputs:
+            self._outputs = self._outputs + [callback]
+
+    def remove_output(self, callback):
+        self._outputs = [cb for cb in self._outputs if cb != callback]
+
+    def start(self):
+        """Start the mixer thread"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self._stop_event.clear()
+        self.start_time = self.clock.now()
+        self.samples_mixed = 0
+        self._thread = threading.Thread(target=self._mix_loop, daemon=True, name="audio-mixer")
+        self._thread.start()
+
+    def stop(self):
+        """Stop the mixer thread and all inputs"""
+        self.is_running = False
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        for inp in self._inputs:
+            inp.stop()
+        self._set_inputs([])
+
+    def mix_block(self):
+        """
+        Mix one block from all inputs and hand it to the outputs
+        :return: Presentation time of the block
+        """
+        if self.start_time is None:
+            self.start_time = self.clock.now()
+        started = time.perf_counter()
+        buf = self._pool.acquire()
+        mix = buf.array
+        mix.fill(0)
+        inputs, meters = self._meters
+        blocks = []
+        for inp in inputs:
+            # Читаем и заглушённые входы, иначе их очередь будет копиться
+            block = inp.read_block()
+            if inp.gain != 1.0:
+                np.multiply(block, inp.gain, out=block)
+            blocks.append(block)
+            if inp.muted:
+                continue
+            if block.shape[1] == self.channels or block.shape[1] == 1:
+                # Моно-вход раздаётся на все каналы
+                np.add(mix, block, out=mix)
+            else:
+                c = min(block.shape[1], self.channels)
+                np.add(mix[:, :c], block[:, :c], out=mix[:, :c])
+        if self.master_gain != 1.0:
+            np.multiply(mix, self.master_gain, out=mix)
+        np.clip(mix, -1.0, 1.0, out=mix)
+        blocks.append(mix)
+        meters.process(blocks)
+        pts = self.start_time + self.samples_mixed / self.sample_rate
+        self.samples_mixed += self.block_size
+        _mix_timer.record(time.perf_counter() - started)
+        for output in self._outputs:
+            try:
+                output(buf, pts)
+            except Exception as e:
+                print(f"Audio output error: {str(e)}")
+        buf.release()
+        return pts
+
+    def _mix_loop(self):
+        """Internal method that mixes one block per block period on the master clock"""
+        period = self.block_size / self.sample_rate
+        while not self._stop_event.is_set():
+            next_time = self.start_time + self.samples_mixed / self.sample_rate
+            if self.clock.wait_until(next_time, self._stop_event):
+                break
+            lag = self.clock.now() - next_time
+            if lag > period:
+                self.late_blocks += 1
+            if lag > 0.5:
+                # Поток стоял (сон системы, отладчик) — не догоняем всё разом, а пропускаем
+                # блоки: метки времени остаются на часах, выход заполнит паузу тишиной
+                self.resyncs += 1
+                self.samples_mixed += int(lag / period) * self.block_size
+            try:
+                self.mix_block()
+            except Exception as e:
+                print(f"Audio mix error: {str(e)}")
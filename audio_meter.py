@@ -0,0 +1,212 @@
+import math
+from collections import namedtuple
+import numpy as np
+
+# Снимок показаний: кортежи по каналам (линейные значения) и громкость в LUFS
+MeterSnapshot = namedtuple('MeterSnapshot', ['peak', 'peak_hold', 'rms', 'loudness'])
+
+SILENCE_DB = -100.0
+
+
+def to_db(value):
+    """
+    Convert a linear level to dBFS
+    :param value: Linear level, 1.0 for full scale
+    :return: Level in dB, SILENCE_DB for silence
+    """
+    if value <= 0.0:
+        return SILENCE_DB
+    return max(20.0 * math.log10(value), SILENCE_DB)
+
+
+def _k_weighting_gain(sample_rate, n):
+    """
+    Squared magnitude of the ITU-R BS.1770 K-weighting filter (high shelf + high pass)
+    at the rfft bins of an n-frame block
+    """
+    w = np.fft.rfftfreq(n, 1.0 / sample_rate) * 2 * np.pi / sample_rate
+    z1 = np.exp(-1j * w)
+    z2 = z1 * z1
+    # Полка +4 дБ выше ~1.7 кГц
+    k = math.tan(math.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = ((vh + vb * k / q + k * k) / a0 + 2 * (k * k - vh) / a0 * z1 + (vh - vb * k / q + k * k) / a0 * z2) / \
+        (1 + 2 * (k * k - 1) / a0 * z1 + (1 - k / q + k * k) / a0 * z2)
+    # Срез ниже ~38 Гц
+    k = math.tan(math.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    high_pass = (1 - 2 * z1 + z2) / (1 + 2 * (k * k - 1) / a0 * z1 + (1 - k / q + k * k) / a0 * z2)
+    return np.abs(shelf * high_pass) ** 2
+
+
+class MeterBank:
+    def __init__(self, layout, sample_rate, block_size, window=3.0, hold_time=1.5, decay_db=20.0,
+                 publish_interval=0.05, turns=6):
+        """
+        Per-channel peak, RMS and short-term loudness of several streams (e.g. every mixer input
+        and the master bus), measured together block by block.
+        All streams share one channel-major buffer, so a block costs one copy per stream and a
+        handful of numpy calls for the whole bank. Readings are published every publish_interval
+        as immutable MeterSnapshots that other threads read without locking.
+        Loudness follows BS.1770 K-weighting applied in the frequency domain, without gating — close
+        to a loudness meter's short-term value, not a certified one. Each FFT spans the last two
+        blocks (finer low-frequency bins); to keep its cost low and flat the streams are split in
+        groups that take turns block by block, so a stream is analysed on every turns-th block.
+        :param layout: Channel count of each stream, in the order process() gets their blocks
+        :param sample_rate: Sample rate of the blocks
+        :param block_size: Frames per block
+        :param window: Loudness window in seconds (3 s is EBU short-term)
+        :param hold_time: Seconds a peak is held before it starts to fall
+        :param decay_db: Fall rate of the held peak in dB per second
+        :param publish_interval: Seconds between snapshots; peak and RMS cover the whole interval
+        :param turns: Number of stream groups taking turns for the loudness FFT
+        """
+        self.layout = tuple(layout)
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        channels = sum(self.layout)
+        # Строки буфера упорядочены по группам: каналы одной группы идут подряд
+        turns = max(1, min(turns, len(self.layout)))
+        groups = [list(range(len(self.layout)))[g::turns] for g in range(turns)]
+        self._rows = [None] * len(self.layout)
+        self._groups = []
+        row = 0
+        for members in groups:
+            first = row
+            starts = []
+            for i in members:
+                self._rows[i] = (row, row + self.layout[i])
+                starts.append(row - first)
+                row += self.layout[i]
+            self._groups.append((members, first, row, np.array(starts, dtype=np.intp)))
+        # Блоки копируются по каналам подряд: редукции по строкам в разы быстрее, чем по столбцам.
+        # Хранятся два последних блока: БПФ по ним; порядок половин не важен — сдвиг по кругу
+        # меняет только фазу спектра, не мощность
+        self._history = np.zeros((channels, 2 * block_size), dtype=np.float32)
+        self._half = 0
+        self._partial = np.empty((channels, block_size), dtype=np.float32)
+        self._block_max = np.empty(channels, dtype=np.float32)
+        self._block_min = np.empty(channels, dtype=np.float32)
+        self._square_sum = np.empty(channels, dtype=np.float32)
+        # Накопители до следующей публикации
+        self._peak = np.zeros(channels, dtype=np.float32)
+        self._squares = np.zeros(channels, dtype=np.float64)
+        self._frames = 0
+        self._publish_blocks = max(1, int(round(publish_interval * sample_rate / block_size)))
+        self._blocks = 0
+        publish_period = self._publish_blocks * block_size / sample_rate
+        self._hold = np.zeros(channels, dtype=np.float32)
+        self._hold_age = np.zeros(channels, dtype=np.intp)
+        self._hold_publishes = int(hold_time / publish_period)
+        self._decay = np.float32(10 ** (-decay_db * publish_period / 20))
+        # Вес бинов rfft: K-фильтр и равенство Парсеваля (бины кроме DC и Найквиста встречаются дважды)
+        segment = 2 * block_size
+        weights = _k_weighting_gain(sample_rate, segment)
+        weights[1:(segment + 1) // 2] *= 2
+        # Спектр читается как пары (re, im) — вес повторяем для обеих половин.
+        # БПФ считается в float64: в numpy оно в 2-3 раза быстрее, чем во float32
+        self._weights = np.repeat(weights / segment ** 2, 2)
+        self._spectrum_input = np.empty((channels, segment), dtype=np.float64)
+        self._power = np.empty((channels, len(self._weights)), dtype=np.float64)
+        window_blocks = max(1, int(round(window * sample_rate / block_size / turns)))
+        self._energy = [np.zeros((len(members), window_blocks), dtype=np.float64) for members, *_ in self._groups]
+        # Скользящие суммы окна: не пересчитываем среднее по всему окну на каждом блоке
+        self._energy_sum = [np.zeros(len(members), dtype=np.float64) for members, *_ in self._groups]
+        self._energy_pos = [0] * turns
+        self._energy_count = [0] * turns
+        self._turn = 0
+        self._loudness = [-math.inf] * len(self.layout)
+        self.snapshots = tuple(MeterSnapshot((0.0,) * n, (0.0,) * n, (0.0,) * n, -math.inf)
+                               for n in self.layout)
+
+    def process(self, blocks):
+        """
+        Measure one block of every stream
+        :param blocks: Arrays (frames, channels) of float32 samples in layout order,
+                       all with the same number of frames, at most block_size
+        """
+        n = len(blocks[0])
+        full = n == self.block_size
+        if full:
+            samples = self._history[:, self._half * n:(self._half + 1) * n]
+        else:
+            samples = self._partial[:, :n]
+        for (start, stop), block in zip(self._rows, blocks):
+            np.copyto(samples[start:stop], block.T)
+        # Дальше — несколько вызовов на все потоки сразу
+        np.einsum('ij,ij->i', samples, samples, out=self._square_sum)
+        self._squares += self._square_sum
+        samples.max(axis=1, out=self._block_max)
+        samples.min(axis=1, out=self._block_min)
+        np.subtract(0.0, self._block_min, out=self._block_min)  # без -0.0 в тишине
+        np.maximum(self._block_max, self._block_min, out=self._block_max)
+        np.maximum(self._peak, self._block_max, out=self._peak)
+        self._frames += n
+        if full:
+            self._half ^= 1
+            self._add_energy(self._turn)
+            self._turn = (self._turn + 1) % len(self._groups)
+        self._blocks += 1
+        if self._blocks >= self._publish_blocks:
+            self._publish()
+
+    def _add_energy(self, group):
+        """K-weighted energy of the last two blocks for one group of streams, channels summed with weight 1 (BS.1770 for L/R)"""
+        members, first, last, starts = self._groups[group]
+        rows = self._spectrum_input[first:last]
+        np.copyto(rows, self._history[first:last])
+        spectrum = np.fft.rfft(rows)
+        pairs = spectrum.view(np.float64)
+        power = self._power[first:last]
+        np.multiply(pairs, pairs, out=power)
+        energy = self._energy[group]
+        total = self._energy_sum[group]
+        pos = self._energy_pos[group]
+        total -= energy[:, pos]
+        energy[:, pos] = np.add.reduceat(power @ self._weights, starts)
+        total += energy[:, pos]
+        self._energy_pos[group] = (pos + 1) % energy.shape[1]
+        count = self._energy_count[group] = min(self._energy_count[group] + 1, energy.shape[1])
+        for i, e in zip(members, total.tolist()):
+            # Сумма может уйти чуть ниже нуля из-за округления
+            self._loudness[i] = -0.691 + 10 * math.log10(e / count) if e > 1e-12 * count else -math.inf
+
+    def _publish(self):
+        # Удержание пика: держим hold_time, потом плавно опускаем
+        rising = self._peak >= self._hold
+        self._hold_age += 1
+        self._hold_age[rising] = 0
+        self._hold[rising] = self._peak[rising]
+        self._hold[self._hold_age > self._hold_publishes] *= self._decay
+        peak = self._peak.tolist()
+        hold = self._hold.tolist()
+        rms = np.sqrt(self._squares / max(self._frames, 1)).tolist()
+        # Одно присваивание ссылки — читатели видят либо старые, либо новые снимки целиком
+        self.snapshots = tuple(MeterSnapshot(tuple(peak[a:b]), tuple(hold[a:b]), tuple(rms[a:b]), loudness)
+                               for (a, b), loudness in zip(self._rows, self._loudness))
+        self._peak.fill(0)
+        self._squares.fill(0)
+        self._frames = 0
+        self._blocks = 0
+
+    def reset(self):
+        """Forget the held peaks and the loudness history"""
+        self._peak.fill(0)
+        self._squares.fill(0)
+        self._frames = 0
+        self._blocks = 0
+        self._hold.fill(0)
+        self._hold_age.fill(0)
+        for energy, total in zip(self._energy, self._energy_sum):
+            energy.fill(0)
+            total.fill(0)
+        self._energy_pos = [0] * len(self._groups)
+        self._energy_count = [0] * len(self._groups)
+        self._history.fill(0)
+        self._loudness = [-math.inf] * len(self.layout)
+        self.snapshots = tuple(MeterSnapshot((0.0,) * n, (0.0,) * n, (0.0,) * n, -math.inf)
+                               for n in self.layout)
@@ -0,0 +1,438 @@
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw
+from scene_manager import SceneManager
+from video_settings import VideoSettings
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CANVASES = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+}
+LAYER_COUNTS = [1, 2, 4, 8, 16, 32]
+SOURCE_KINDS = ['screen', 'image', 'video', 'mixed']
+# Модули, которые заметно удлиняют запуск; в отчёте о холодном старте видно, какие из них загрузились
+HEAVY_MODULES = ['PyQt6', 'cv2', 'PIL', 'imageio', 'sounddevice', 'soundfile', 'pyautogui',
+                 'screen_capture', 'video_decoder']
+STARTUP_LAYERS = 4
+# Сколько байт на кадр может оставаться в памяти после кадра: декодер и композитор
+# переиспользуют буферы, так что больше — значит, кадры снова выделяются заново
+RETAINED_BYTES_LIMIT = {'video': 64 * 1024}
+
+# Выполняется в чистом интерпретаторе: импорт, загрузка конфига и первый кадр
+_STARTUP_SCRIPT = """
+import json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+from scene_manager import SceneManager
+imported = time.perf_counter()
+manager = SceneManager(config_path=sys.argv[2])
+loaded = time.perf_counter()
+manager.render_scene(manager.current_scene.id).release()
+rendered = time.perf_counter()
+print(json.dumps({'import_s': imported - started, 'load_s': loaded - imported,
+                  'first_frame_s': rendered - loaded,
+                  'modules': [m for m in json.loads(sys.argv[3]) if m in sys.modules]}))
+sys.stdout.flush()
+# Потоки захвата не ждём
+os._exit(0)
+"""
+
+
+def make_assets(directory):
+    """
+    Generate the files used by image and video sources
+    :param directory: Directory to write into
+    :return: Dictionary of asset name to path
+    """
+    w, h = 960, 540
+    # Непрозрачная испытательная таблица: градиент и сетка
+    x = np.linspace(0, 255, w, dtype=np.float32)
+    y = np.linspace(0, 255, h, dtype=np.float32)[:, None]
+    pattern = np.dstack([np.broadcast_to(x, (h, w)), np.broadcast_to(y, (h, w)),
+                         np.broadcast_to(255 - x, (h, w))]).astype(np.uint8)
+    pattern[::60] = 255
+    pattern[:, ::60] = 255
+    assets = {'image': os.path.join(directory, 'pattern.png'),
+              'overlay': os.path.join(directory, 'overlay.png'),
+              'video': os.path.join(directory, 'clip.gif')}
+    Image.fromarray(pattern).save(assets['image'])
+    # Оверлей с мягкой прозрачностью, как у логотипов и рамок
+    overlay = Image.new('RGBA', (512, 512), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    for r in range(256, 0, -8):
+        draw.ellipse((256 - r, 256 - r, 256 + r, 256 + r), fill=(255, 128, 0, 255 - r))
+    overlay.save(assets['overlay'])
+    # Короткий анимированный ролик: квадрат бежит по таблице
+    frames = []
+    small = Image.fromarray(pattern).resize((480, 270))
+    for i in range(30):
+        frame = small.copy()
+        ImageDraw.Draw(frame).rectangle((i * 14, 100, i * 14 + 60, 160), fill=(255, 255, 255))
+        frames.append(frame)
+    frames[0].save(assets['video'], save_all=True, append_images=frames[1:], duration=33, loop=0)
+    return assets
+
+
+def _source_for(kind, index, assets, size):
+    """Source type and properties of layer index for a benchmark kind"""
+    if kind == 'mixed':
+        kind = ['screen', 'image', 'overlay', 'video'][index % 4]
+    elif kind == 'image' and index % 2:
+        kind = 'overlay'
+    if kind == 'screen':
+        w, h = size
+        return 'screen', {'backend': 'synthetic', 'fps': 30,
+                          'backend_options': {'width': w, 'height': h, 'fps': 30}}
+    if kind == 'overlay':
+        return 'image', {'file': assets['overlay']}
+    return kind, {'file': assets[kind]}
+
+
+def build_scene(manager, kind, layers, assets):
+    """
+    Add a scene with a full-canvas background and layers - 1 overlapping tiles
+    :return: Created scene
+    """
+    width, height = manager.video_settings.base_size
+    scene = manager.create_scene(f'{kind} x{layers}')
+    source_type, properties = _source_for(kind, 0, assets, (width, height))
+    manager.add_source(scene.id, source_type, 'layer0', properties)
+    tiles = layers - 1
+    cols = max(1, math.ceil(math.sqrt(tiles)))
+    rows = max(1, math.ceil(tiles / cols))
+    # Плитки на четверть больше ячейки сетки, чтобы слои перекрывались
+    tile_w, tile_h = int(width / cols * 1.25) // 2 * 2, int(height / rows * 1.25) // 2 * 2
+    for i in range(tiles):
+        source_type, properties = _source_for(kind, i + 1, assets, (tile_w, tile_h))
+        source = manager.add_source(scene.id, source_type, f'layer{i + 1}', properties)
+        source.position = ((i % cols) * width // cols, (i // cols) * height // rows)
+        source.size = (tile_w, tile_h)
+    return scene
+
+
+def _wait_ready(manager, scene, timeout=5.0):
+    """Render until capture and decoder threads have delivered their first frames"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        manager.render_scene(scene.id).release()
+        ready = all((s.decoder is None or s.decoder.seq > 0) and
+                    (s.capture is None or s.capture.slot.seq > 0) for s in scene.sources)
+        if ready:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def _paced(count, fps):
+    """Yield count times, on a grid of 1/fps seconds (back to back if fps is 0)"""
+    next_time = time.perf_counter()
+    for i in range(count):
+        if fps:
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_time += 1.0 / fps
+        yield i
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(canvas, layers, kind, assets, frames=90, warmup=10, alloc_frames=20, workers=0, fps=30):
+    """
+    Compose one scene repeatedly and measure it.
+    Frames are started on an fps grid, as the render engine does, so capture and video
+    sources change between frames at their real rate; fps=0 renders back to back.
+    :param canvas: Key of CANVASES
+    :param layers: Number of layers
+    :param kind: 'screen', 'image', 'video' or 'mixed'
+    :param assets: Paths from make_assets
+    :param frames: Timed frames
+    :param warmup: Untimed frames rendered first
+    :param alloc_frames: Frames rendered under tracemalloc after timing, 0 to skip
+    :param workers: SceneManager worker threads
+    :param fps: Rate frames are started at, 0 for no pacing
+    :return: Dictionary with the results; 'fps' is the rate the frame times would sustain
+    :raises AssertionError: If a kind in RETAINED_BYTES_LIMIT keeps more memory per frame than allowed
+    """
+    width, height = CANVASES[canvas]
+    settings = VideoSettings(base_width=width, base_height=height, output_width=width, output_height=height)
+    manager = SceneManager(workers=workers, video_settings=settings, config_path=None)
+    scene = build_scene(manager, kind, layers, assets)
+    try:
+        ready = _wait_ready(manager, scene)
+        for _ in range(warmup):
+            manager.render_scene(scene.id).release()
+        times = np.empty(frames, dtype=np.float64)
+        for i, _ in enumerate(_paced(frames, fps)):
+            t0 = time.perf_counter()
+            buf = manager.render_scene(scene.id)
+            times[i] = time.perf_counter() - t0
+            buf.release()
+        alloc_peak = alloc_retained = None
+        # reset_peak появился в Python 3.9; без него пик за кадр не измерить
+        if alloc_frames > 0 and hasattr(tracemalloc, 'reset_peak'):
+            # Отдельный проход: tracemalloc сильно замедляет Python-код
+            tracemalloc.start()
+            # Сначала несколько кадров под трассировкой: объекты, живые в любой момент
+            # (кадр в работе у каждого декодера), попадут и в base, и в current
+            for _ in _paced(3, fps):
+                manager.render_scene(scene.id).release()
+            base, _ = tracemalloc.get_traced_memory()
+            peaks = []
+            for _ in _paced(alloc_frames, fps):
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+                manager.render_scene(scene.id).release()
+                _, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - before)
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            alloc_peak = int(np.median(peaks))
+            alloc_retained = max(0, current - base) // alloc_frames
+            limit = RETAINED_BYTES_LIMIT.get(kind)
+            if limit is not None and alloc_retained > limit:
+                raise AssertionError(f"{canvas} {kind} x{layers}: {alloc_retained} bytes kept per frame, "
+                                     f"limit {limit}; frames are allocated instead of reused")
+        ms = times * 1000.0
+        return {
+            'canvas': canvas,
+            'width': width,
+            'height': height,
+            'layers': layers,
+            'sources': kind,
+            'workers': workers,
+            'ready': ready,
+            'frames': frames,
+            'target_fps': fps,
+            'fps': 1000.0 / ms.mean(),
+            # Доля кадрового интервала, которую занимает рендер
+            'budget_used': float(ms.mean() * fps / 1000.0) if fps else None,
+            'frame_ms': {
+                'mean': float(ms.mean()),
+                'p50': float(np.percentile(ms, 50)),
+                'p95': float(np.percentile(ms, 95)),
+                'p99': float(np.percentile(ms, 99)),
+                'max': float(ms.max()),
+            },
+            # Пиковый объём временных выделений за кадр и то, что осталось после кадра
+            'alloc_peak_bytes_per_frame': alloc_peak,
+            'alloc_retained_bytes_per_frame': alloc_retained,
+            'peak_rss_mb': _peak_rss_mb(),
+        }
+    finally:
+        for source in list(scene.sources):
+            manager.remove_source(scene.id, source.id)
+        manager.set_workers(0)
+
+
+def write_startup_config(kind, assets, path):
+    """
+    Save a scene collection with STARTUP_LAYERS sources of a benchmark kind, as the main window would
+    :param path: Config file to write
+    """
+    width, height = VideoSettings().base_size
+    sources = []
+    for i in range(STARTUP_LAYERS):
+        source_type, properties = _source_for(kind, i, assets, (width, height))
+        sources.append({'id': f'{source_type}_layer{i}', 'name': f'layer{i}', 'type': source_type,
+                        'properties': properties, 'visible': True, 'position': (0, 0),
+                        'size': (width, height), 'opacity': 1.0})
+    data = {'scenes': [{'id': 'startup', 'name': kind, 'active': True, 'sources': sources}],
+            'current_scene_id': 'startup'}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def measure_startup(kind, assets, directory, runs=3):
+    """
+    Cold start of a profile: a fresh interpreter imports SceneManager, loads the config
+    and renders the first frame. The median of runs is reported.
+    :return: Dictionary with times in ms and the heavy modules that got imported
+    """
+    path = os.path.join(directory, f'startup_{kind}.json')
+    write_startup_config(kind, assets, path)
+    command = [sys.executable, '-c', _STARTUP_SCRIPT, os.path.dirname(os.path.abspath(__file__)),
+               path, json.dumps(HEAVY_MODULES)]
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+        sample = json.loads(result.stdout)
+        sample['total_s'] = time.perf_counter() - started
+        samples.append(sample)
+
+    def median_ms(key):
+        return float(np.median([sample[key] for sample in samples]) * 1000.0)
+
+    return {
+        'sources': kind,
+        'runs': runs,
+        # Весь процесс, вместе с запуском интерпретатора
+        'total_ms': median_ms('total_s'),
+        'import_ms': median_ms('import_s'),
+        'load_ms': median_ms('load_s'),
+        'first_frame_ms': median_ms('first_frame_s'),
+        'heavy_modules': samples[-1]['modules'],
+    }
+
+
+def _run_isolated(canvas, layers, kind, args):
+    """Run one case in a fresh interpreter, so peak RSS belongs to that case alone"""
+    command = [sys.executable, os.path.abspath(__file__), '--canvases', canvas, '--layers', str(layers),
+               '--sources', kind, '--frames', str(args.frames), '--warmup', str(args.warmup),
+               '--fps', str(args.fps),
+               '--alloc-frames', str(args.alloc_frames), '--workers', str(args.workers),
+               '--startup-runs', '0', '--output', '-', '--quiet']
+    result = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+    return json.loads(result.stdout)['results'][0]
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'cv2_threads': cv2.getNumThreads(),
+    }
+
+
+def _case_key(result):
+    return (result['canvas'], result['layers'], result['sources'], result['workers'], result['target_fps'])
+
+
+def compare(results, baseline_path, startup=()):
+    """
+    Print the fps change of every case and the cold start change of every profile against a previous run
+    :param results: Results of this run
+    :param baseline_path: JSON file written by an earlier run
+    :param startup: Cold start results of this run
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    baseline = {_case_key(r): r for r in report['results']}
+    baseline_startup = {r['sources']: r for r in report.get('startup', [])}
+    if startup:
+        print(f"{'cold start':<28}{'ms':>10}{'baseline':>10}{'change':>9}")
+        for result in startup:
+            old = baseline_startup.get(result['sources'])
+            if old is None:
+                print(f"{result['sources']:<28}{result['total_ms']:>10.0f}{'-':>10}{'-':>9}")
+                continue
+            change = (result['total_ms'] / old['total_ms'] - 1.0) * 100.0
+            print(f"{result['sources']:<28}{result['total_ms']:>10.0f}{old['total_ms']:>10.0f}{change:>+8.1f}%")
+    print(f"{'case':<28}{'fps':>10}{'baseline':>10}{'change':>9}")
+    for result in results:
+        old = baseline.get(_case_key(result))
+        name = f"{result['canvas']} {result['sources']} x{result['layers']}"
+        if old is None:
+            print(f"{name:<28}{result['fps']:>10.1f}{'-':>10}{'-':>9}")
+            continue
+        change = (result['fps'] / old['fps'] - 1.0) * 100.0
+        print(f"{name:<28}{result['fps']:>10.1f}{old['fps']:>10.1f}{change:>+8.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless compositor benchmark')
+    parser.add_argument('--canvases', default=','.join(CANVASES),
+                        help='Comma separated canvas sizes: ' + ', '.join(CANVASES))
+    parser.add_argument('--layers', default=','.join(map(str, LAYER_COUNTS)),
+                        help='Comma separated layer counts')
+    parser.add_argument('--sources', default=','.join(SOURCE_KINDS),
+                        help='Comma separated source kinds: ' + ', '.join(SOURCE_KINDS))
+    parser.add_argument('--frames', type=int, default=90, help='Timed frames per case')
+    parser.add_argument('--fps', type=int, default=30, help='Rate frames are started at, 0 for back to back')
+    parser.add_argument('--warmup', type=int, default=10, help='Untimed frames per case')
+    parser.add_argument('--alloc-frames', type=int, default=20,
+                        help='Frames traced for allocations per case, 0 to skip')
+    parser.add_argument('--workers', type=int, default=0, help='SceneManager worker threads')
+    parser.add_argument('--startup-runs', type=int, default=3,
+                        help='Cold start runs per source kind, 0 to skip')
+    parser.add_argument('--isolate', action='store_true',
+                        help='Run every case in its own process for per-case peak RSS')
+    parser.add_argument('--output', help="Write JSON results to this file ('-' for stdout)")
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare fps with')
+    parser.add_argument('--quiet', action='store_true', help='Do not print progress')
+    args = parser.parse_args(argv)
+    canvases = [c.strip() for c in args.canvases.split(',') if c.strip()]
+    for canvas in canvases:
+        if canvas not in CANVASES:
+            parser.error(f"Unknown canvas: {canvas}")
+    kinds = [k.strip() for k in args.sources.split(',') if k.strip()]
+    for kind in kinds:
+        if kind not in SOURCE_KINDS:
+            parser.error(f"Unknown source kind: {kind}")
+    layer_counts = [int(n) for n in args.layers.split(',') if n.strip()]
+
+    results = []
+    startup = []
+    with tempfile.TemporaryDirectory(prefix='rtp_bench_') as directory:
+        assets = make_assets(directory)
+        if args.startup_runs > 0:
+            for kind in kinds:
+                result = measure_startup(kind, assets, directory, runs=args.startup_runs)
+                startup.append(result)
+                if not args.quiet:
+                    print(f"{'start':>6} {kind:<7} {result['total_ms']:8.0f} ms  import {result['import_ms']:6.0f}  "
+                          f"load {result['load_ms']:6.0f}  first frame {result['first_frame_ms']:6.0f} ms  "
+                          f"[{', '.join(result['heavy_modules'])}]",
+                          file=sys.stderr if args.output == '-' else sys.stdout)
+        for canvas in canvases:
+            for kind in kinds:
+                for layers in layer_counts:
+                    if args.isolate:
+                        result = _run_isolated(canvas, layers, kind, args)
+                    else:
+                        result = run_case(canvas, layers, kind, assets, frames=args.frames, warmup=args.warmup,
+                                          alloc_frames=args.alloc_frames, workers=args.workers, fps=args.fps)
+                    results.append(result)
+                    if not args.quiet:
+                        t = result['frame_ms']
+                        print(f"{canvas:>6} {kind:<7} x{layers:<3} {result['fps']:8.1f} fps  "
+                              f"p50 {t['p50']:7.2f}  p95 {t['p95']:7.2f}  p99 {t['p99']:7.2f} ms",
+                              file=sys.stderr if args.output == '-' else sys.stdout)
+    report = {'meta': _metadata(), 'startup': startup, 'results': results}
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+    elif args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare, startup)
+    return report
+
+
+if __name__ == '__main__':
+    main()
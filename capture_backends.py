@@ -0,0 +1,321 @@
+import os
+import sys
+import ctypes
+import ctypes.util
+import threading
+import cv2
+import numpy as np
+
+
+class CaptureBackend:
+    """Base class for screen grabbing backends"""
+    name = None
+
+    @classmethod
+    def is_available(cls):
+        """
+        Check whether the backend can run on this machine
+        :return: True if the backend can be created
+        """
+        return True
+
+    def screen_size(self):
+        """
+        Get the size of the captured screen
+        :return: Tuple of (width, height)
+        """
+        raise NotImplementedError
+
+    def grab(self, region=None, out=None):
+        """
+        Grab a frame
+        :param region: Tuple of (left, top, right, bottom), None for full screen
+        :param out: Optional preallocated BGR array of the region size to fill
+        :return: numpy array (h, w, 3) in BGR, or None if nothing could be grabbed
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release backend resources"""
+        pass
+
+
+class PILGrabBackend(CaptureBackend):
+    """ImageGrab-based backend (Windows, macOS, X11 through Pillow)"""
+    name = 'pil'
+
+    @classmethod
+    def is_available(cls):
+        try:
+            from PIL import ImageGrab  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def __init__(self):
+        from PIL import ImageGrab
+        self._grab = ImageGrab.grab
+
+    def screen_size(self):
+        return self._grab().size
+
+    def grab(self, region=None, out=None):
+        try:
+            screenshot = self._grab(bbox=region) if region else self._grab()
+        except Exception:
+            return None
+        frame = np.asarray(screenshot)
+        if out is not None and out.shape[:2] != frame.shape[:2]:
+            out = None
+        if frame.ndim == 3 and frame.shape[2] == 4:
+            return cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR, dst=out)
+        return cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=out)
+
+
+_ALL_PLANES = ctypes.c_ulong(-1).value
+
+
+class _XImage(ctypes.Structure):
+    _fields_ = [
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('xoffset', ctypes.c_int),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_void_p),
+        ('byte_order', ctypes.c_int),
+        ('bitmap_unit', ctypes.c_int),
+        ('bitmap_bit_order', ctypes.c_int),
+        ('bitmap_pad', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('bits_per_pixel', ctypes.c_int),
+        ('red_mask', ctypes.c_ulong),
+        ('green_mask', ctypes.c_ulong),
+        ('blue_mask', ctypes.c_ulong),
+        ('obdata', ctypes.c_void_p),
+        # struct funcs: create_image, destroy_image, get_pixel, put_pixel, sub_image, add_pixel
+        ('f_create_image', ctypes.c_void_p),
+        ('f_destroy_image', ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p)),
+        ('f_get_pixel', ctypes.c_void_p),
+        ('f_put_pixel', ctypes.c_void_p),
+        ('f_sub_image', ctypes.c_void_p),
+        ('f_add_pixel', ctypes.c_void_p),
+    ]
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ('shmseg', ctypes.c_ulong),
+        ('shmid', ctypes.c_int),
+        ('shmaddr', ctypes.c_void_p),
+        ('readOnly', ctypes.c_int),
+    ]
+
+
+class _ShmImage:
+    """One XShm image of a fixed size with a NumPy view over its shared memory"""
+
+    def __init__(self, backend, width, height):
+        x11, xext, libc = backend._x11, backend._xext, backend._libc
+        self._backend = backend
+        self.info = _XShmSegmentInfo()
+        self.image = xext.XShmCreateImage(backend._display, backend._visual, backend._depth,
+                                          2,  # ZPixmap
+                                          None, ctypes.byref(self.info), width, height)
+        if not self.image:
+            raise RuntimeError("XShmCreateImage failed")
+        img = self.image.contents
+        if img.bits_per_pixel != 32:
+            img.f_destroy_image(ctypes.cast(self.image, ctypes.c_void_p))
+            raise RuntimeError(f"Unsupported X11 pixel format: {img.bits_per_pixel} bpp")
+        size = img.bytes_per_line * img.height
+        self.info.shmid = libc.shmget(0, size, 0o1000 | 0o600)  # IPC_PRIVATE, IPC_CREAT
+        if self.info.shmid < 0:
+            img.f_destroy_image(ctypes.cast(self.image, ctypes.c_void_p))
+            raise RuntimeError("shmget failed")
+        self.info.shmaddr = libc.shmat(self.info.shmid, None, 0)
+        if self.info.shmaddr in (None, ctypes.c_void_p(-1).value):
+            libc.shmctl(self.info.shmid, 0, None)
+            img.f_destroy_image(ctypes.cast(self.image, ctypes.c_void_p))
+            raise RuntimeError("shmat failed")
+        img.data = self.info.shmaddr
+        self.info.readOnly = 0
+        xext.XShmAttach(backend._display, ctypes.byref(self.info))
+        x11.XSync(backend._display, 0)
+        # Сегмент удалится сам, когда отсоединятся и мы, и X-сервер
+        libc.shmctl(self.info.shmid, 0, None)  # IPC_RMID
+        raw = (ctypes.c_uint8 * size).from_address(self.info.shmaddr)
+        rows = np.ctypeslib.as_array(raw).reshape(img.height, img.bytes_per_line)
+        self.bgra = rows[:, :width * 4].reshape(img.height, width, 4)
+
+    def close(self):
+        b = self._backend
+        b._xext.XShmDetach(b._display, ctypes.byref(self.info))
+        self.image.contents.f_destroy_image(ctypes.cast(self.image, ctypes.c_void_p))
+        b._libc.shmdt(ctypes.c_void_p(self.info.shmaddr))
+        self.bgra = None
+
+
+class X11ShmBackend(CaptureBackend):
+    """X11 MIT-SHM backend: the server copies pixels straight into shared memory"""
+    name = 'x11shm'
+
+    @classmethod
+    def is_available(cls):
+        if not sys.platform.startswith('linux') or not os.environ.get('DISPLAY'):
+            return False
+        return bool(ctypes.util.find_library('X11') and ctypes.util.find_library('Xext'))
+
+    def __init__(self, display=None):
+        self._x11 = ctypes.CDLL(ctypes.util.find_library('X11'))
+        self._xext = ctypes.CDLL(ctypes.util.find_library('Xext'))
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._declare()
+        self._display = self._x11.XOpenDisplay(display.encode() if display else None)
+        if not self._display:
+            raise RuntimeError("Cannot open X display")
+        if not self._xext.XShmQueryExtension(self._display):
+            self._x11.XCloseDisplay(self._display)
+            raise RuntimeError("X server has no MIT-SHM extension")
+        screen = self._x11.XDefaultScreen(self._display)
+        self._root = self._x11.XRootWindow(self._display, screen)
+        self._visual = self._x11.XDefaultVisual(self._display, screen)
+        self._depth = self._x11.XDefaultDepth(self._display, screen)
+        self._size = (self._x11.XDisplayWidth(self._display, screen),
+                      self._x11.XDisplayHeight(self._display, screen))
+        self._images = {}  # (w, h) -> _ShmImage
+        # Xlib не потокобезопасен без XInitThreads, поэтому сериализуем вызовы
+        self._lock = threading.Lock()
+
+    def _declare(self):
+        x11, xext, libc = self._x11, self._xext, self._libc
+        vp, ul = ctypes.c_void_p, ctypes.c_ulong
+        x11.XOpenDisplay.restype = vp
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XCloseDisplay.argtypes = [vp]
+        x11.XDefaultScreen.argtypes = [vp]
+        x11.XRootWindow.restype = ul
+        x11.XRootWindow.argtypes = [vp, ctypes.c_int]
+        x11.XDefaultVisual.restype = vp
+        x11.XDefaultVisual.argtypes = [vp, ctypes.c_int]
+        x11.XDefaultDepth.argtypes = [vp, ctypes.c_int]
+        x11.XDisplayWidth.argtypes = [vp, ctypes.c_int]
+        x11.XDisplayHeight.argtypes = [vp, ctypes.c_int]
+        x11.XSync.argtypes = [vp, ctypes.c_int]
+        xext.XShmQueryExtension.argtypes = [vp]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmCreateImage.argtypes = [vp, vp, ctypes.c_uint, ctypes.c_int, vp,
+                                         ctypes.POINTER(_XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint]
+        xext.XShmAttach.argtypes = [vp, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [vp, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [vp, ul, ctypes.POINTER(_XImage), ctypes.c_int, ctypes.c_int, ul]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = vp
+        libc.shmat.argtypes = [ctypes.c_int, vp, ctypes.c_int]
+        libc.shmdt.argtypes = [vp]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, vp]
+
+    def screen_size(self):
+        return self._size
+
+    def grab(self, region=None, out=None):
+        sw, sh = self._size
+        left, top, right, bottom = region if region else (0, 0, sw, sh)
+        left, top = max(0, int(left)), max(0, int(top))
+        right, bottom = min(sw, int(right)), min(sh, int(bottom))
+        w, h = right - left, bottom - top
+        if w <= 0 or h <= 0:
+            return None
+        with self._lock:
+            shm = self._images.get((w, h))
+            if shm is None:
+                shm = self._images[(w, h)] = _ShmImage(self, w, h)
+            if not self._xext.XShmGetImage(self._display, self._root, shm.image, left, top, _ALL_PLANES):
+                return None
+            if out is None or out.shape != (h, w, 3):
+                out = np.empty((h, w, 3), dtype=np.uint8)
+            return cv2.cvtColor(shm.bgra, cv2.COLOR_BGRA2BGR, dst=out)
+
+    def close(self):
+        with self._lock:
+            for shm in self._images.values():
+                shm.close()
+            self._images = {}
+            if self._display:
+                self._x11.XCloseDisplay(self._display)
+                self._display = None
+
+
+class SyntheticBackend(CaptureBackend):
+    """Deterministic moving test pattern for headless benchmarks"""
+    name = 'synthetic'
+
+    def __init__(self, width=1920, height=1080, fps=30):
+        self.width = int(width)
+        self.height = int(height)
+        self.fps = fps
+        self.frame_index = 0
+        # Цветные полосы считаем один раз, дальше только копируем
+        colors = np.array([[255, 255, 255], [0, 255, 255], [255, 255, 0], [0, 255, 0],
+                           [255, 0, 255], [0, 0, 255], [255, 0, 0], [0, 0, 0]], dtype=np.uint8)
+        bar = (np.arange(self.width) * len(colors)) // self.width
+        self._pattern = np.ascontiguousarray(np.broadcast_to(colors[bar], (self.height, self.width, 3)))
+        self._box = max(8, self.height // 8)
+
+    def screen_size(self):
+        return (self.width, self.height)
+
+    def grab(self, region=None, out=None):
+        left, top, right, bottom = region if region else (0, 0, self.width, self.height)
+        left, top = max(0, int(left)), max(0, int(top))
+        right, bottom = min(self.width, int(right)), min(self.height, int(bottom))
+        w, h = right - left, bottom - top
+        if w <= 0 or h <= 0:
+            return None
+        if out is None or out.shape != (h, w, 3):
+            out = np.empty((h, w, 3), dtype=np.uint8)
+        out[:] = self._pattern[top:bottom, left:right]
+        # Квадрат проходит ширину экрана за 4 секунды и зависит только от номера кадра
+        t = self.frame_index / self.fps
+        bx = int((t / 4.0) % 1.0 * (self.width - self._box))
+        by = (self.height - self._box) // 2
+        x0, y0 = max(bx - left, 0), max(by - top, 0)
+        x1, y1 = min(bx + self._box - left, w), min(by + self._box - top, h)
+        if x0 < x1 and y0 < y1:
+            out[y0:y1, x0:x1] = (self.frame_index * 7) % 256
+        self.frame_index += 1
+        return out
+
+
+BACKENDS = {
+    PILGrabBackend.name: PILGrabBackend,
+    X11ShmBackend.name: X11ShmBackend,
+    SyntheticBackend.name: SyntheticBackend,
+}
+
+
+def create_backend(name=None, **options):
+    """
+    Create a capture backend
+    :param name: Backend name ('pil', 'x11shm', 'synthetic'), None to pick one automatically.
+                 The RTP_CAPTURE_BACKEND environment variable overrides the automatic choice.
+                 The synthetic test pattern is only used when asked for by name.
+    :param options: Backend specific options (e.g. width/height/fps for 'synthetic')
+    :return: CaptureBackend instance
+    :raises RuntimeError: If no real capture backend is available
+    """
+    name = name or os.environ.get('RTP_CAPTURE_BACKEND')
+    if name:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown capture backend: {name}")
+        return BACKENDS[name](**options)
+    if X11ShmBackend.is_available():
+        try:
+            return X11ShmBackend()
+        except (OSError, RuntimeError):
+            pass
+    if PILGrabBackend.is_available() and sys.platform in ('win32', 'darwin'):
+        return PILGrabBackend()
+    if PILGrabBackend.is_available() and os.environ.get('DISPLAY'):
+        return PILGrabBackend()
+    raise RuntimeError("No screen capture backend available")
@@ -0,0 +1,423 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Optional
+import cv2
+import numpy as np
+from frame_pool import FramePool, FrameBuffer
+from video_settings import VideoSettings
+
+
+@dataclass(eq=False)
+class Layer:
+    key: int  # id() объекта источника
+    frame: np.ndarray  # Кадр, уже масштабированный до размера вставки: BGR или BGRA с предумноженной альфой
+    x: int = 0
+    y: int = 0
+    version: int = 0  # Номер кадра источника: тот же буфер с новым содержимым получает новый номер
+    opacity: float = 1.0  # Прозрачность всего слоя, 0..1
+
+    @property
+    def rect(self) -> tuple:
+        h, w = self.frame.shape[:2]
+        return (self.x, self.y, self.x + w, self.y + h)
+
+
+def layer_frame_shape(image: np.ndarray) -> tuple:
+    """
+    Shape of the frame to_layer_frame makes from an image, to preallocate its output
+    :param image: uint8 image array
+    :return: (h, w, 3) for BGR or (h, w, 4) for premultiplied BGRA
+    """
+    image = np.asarray(image)
+    h, w = image.shape[:2]
+    if image.ndim == 3 and image.shape[2] == 4 and image[..., 3].min() < 255:
+        return (h, w, 4)
+    return (h, w, 3)
+
+
+def to_layer_frame(image: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """
+    Convert a decoded RGB/RGBA/grayscale image (PIL, imageio) to the layer format
+    :param image: uint8 image array
+    :param out: Array of layer_frame_shape(image) to convert into, None to allocate
+    :return: BGR frame, or premultiplied BGRA if the image has any transparency
+    """
+    image = np.asarray(image)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR, dst=out)
+    if image.shape[2] == 4:
+        if image[..., 3].min() == 255:
+            return cv2.cvtColor(image, cv2.COLOR_RGBA2BGR, dst=out)
+        # Предумножаем один раз при загрузке, а не при каждом смешивании
+        out = cv2.cvtColor(image, cv2.COLOR_RGBA2mRGBA, dst=out)
+        return cv2.cvtColor(out, cv2.COLOR_RGBA2BGRA, dst=out)
+    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR, dst=out)
+
+
+@dataclass(eq=False)
+class _Surface:
+    """
+    Premultiplied pixels ready to blend over the canvas: dst = rgb + dst * inv / 255.
+    A dynamic layer or several static layers flattened into one buffer.
+    """
+    rect: tuple  # (x0, y0, x1, y1) on the canvas
+    rgb: np.ndarray  # BGR, premultiplied by alpha and opacity; may be a view of the layer frame
+    inv: object  # 255 - alpha: uint8 array (h, w, 1) broadcast over the channels, or an int if uniform (0 = opaque)
+    key: Optional[int] = None  # Ключ слоя; None для сплющенных статических слоёв
+
+    @property
+    def opaque(self) -> bool:
+        return isinstance(self.inv, int) and self.inv == 0
+
+
+# Высота полосы, на которую разворачивается одноканальная альфа: буфер полосы остаётся в кэше
+_STRIP = 32
+
+
+def _scratch_buffer(width: int) -> np.ndarray:
+    """Strip buffer for _mul255, flat so that a strip of any width is a contiguous view"""
+    return np.empty(_STRIP * width * 3, dtype=np.uint8)
+
+
+def _mul255(a: np.ndarray, b, out: np.ndarray, scratch: np.ndarray = None, add: np.ndarray = None):
+    """
+    out = a * b / 255 (+ add), rounded to nearest.
+    cv2.multiply with scale 1/255 gives the exactly rounded result for every uint8 pair.
+    :param a: uint8 array
+    :param b: uint8 array shaped like a or (h, w, 1), or an int
+    :param out: uint8 array shaped like a, may be a itself
+    :param scratch: Buffer from _scratch_buffer() for at least a's width, None to allocate
+    :param add: Optional uint8 array shaped like a; a * b / 255 + add must not exceed 255
+    """
+    h, w, c = a.shape
+    if isinstance(b, int) or b.shape[2] == c:
+        if isinstance(b, int):
+            # Умножение на число: convertScaleAbs тоже точен и в разы быстрее cv2.multiply со скаляром
+            cv2.convertScaleAbs(a, dst=out, alpha=b / 255)
+        else:
+            cv2.multiply(a, b, dst=out, scale=1 / 255)
+        if add is not None:
+            cv2.add(out, add, dst=out)
+        return
+    if scratch is None:
+        scratch = _scratch_buffer(w)
+    for y0 in range(0, h, _STRIP):
+        y1 = min(y0 + _STRIP, h)
+        # Одноканальную 255 - альфа разворачиваем на все каналы только для полосы:
+        # умножение с трансляцией по последней оси в numpy в разы медленнее
+        factor = cv2.cvtColor(b[y0:y1, :, 0], cv2.COLOR_GRAY2BGR,
+                              dst=scratch[:(y1 - y0) * w * c].reshape(y1 - y0, w, c))
+        cv2.multiply(a[y0:y1], factor, dst=out[y0:y1], scale=1 / 255)
+        if add is not None:
+            cv2.add(out[y0:y1], add[y0:y1], dst=out[y0:y1])
+
+
+def _intersect(a: tuple, b: tuple) -> Optional[tuple]:
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[2], b[2]), min(a[3], b[3])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+
+def _union(a: tuple, b: tuple) -> tuple:
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def _area(r: tuple) -> int:
+    return (r[2] - r[0]) * (r[3] - r[1])
+
+
+def _layer_alpha(layer: Layer) -> int:
+    """Layer opacity as an 8-bit value"""
+    return min(255, max(0, int(round(layer.opacity * 255))))
+
+
+class Compositor:
+    def __init__(self, video_settings: VideoSettings = None):
+        """
+        Layer-flattening compositor for one scene.
+        Static layers between dynamic ones are pre-flattened, and only the regions
+        covered by changed layers are re-blended on each frame.
+        Output frames come from a buffer pool; a recycled buffer is brought up to date
+        by redrawing only what changed since the frame it last held.
+        Layers with alpha are blended as premultiplied BGRA in integer arithmetic.
+        :param video_settings: Video settings; the canvas is base_size at creation,
+                               a new compositor is needed when it changes
+        """
+        width, height = (video_settings or VideoSettings()).base_size
+        self.width = width
+        self.height = height
+        self.pool = FramePool((height, width, 3))
+        self.frame_number = 0
+        self._history = deque(maxlen=16)  # (номер кадра, грязные области) последних кадров
+        self._base = np.zeros((height, width, 3), dtype=np.uint8)
+        self._scratch = _scratch_buffer(width)
+        self._plan = []  # _Surface в порядке z: сплющенные статические и динамические слои
+        self._flat_buffers = {}  # (h, w) -> [(rgb, inv)] буферы сплющенных групп текущего плана
+        self._plan_key = None
+        self._signatures = {}  # key -> (frame, x, y, version, opacity) прошлого кадра
+        self._contents = {}  # key -> ((frame, version, alpha), rgb, inv) подготовленного слоя
+        self._buffers = {}  # key -> {'rgb': ..., 'inv': ...} буферы предумножения слоя, переиспользуются
+        self._rects = {}  # key -> rect прошлого кадра
+        self._changed_last = set()
+        self.last_dirty_area = 0
+
+    def invalidate(self):
+        """Forget all cached layers and redraw everything on the next frame"""
+        self._plan_key = None
+        self._signatures = {}
+        self._contents = {}
+        self._buffers = {}
+        self._rects = {}
+        self._changed_last = set()
+        self._history.clear()
+
+    def compose(self, layers: List[Layer]) -> FrameBuffer:
+        """
+        Composite layers (bottom to top) into a pooled frame
+        :param layers: Visible layers in z-order
+        :return: FrameBuffer with one reference owned by the caller (must be released)
+        """
+        canvas_rect = (0, 0, self.width, self.height)
+        # Полностью прозрачные слои не рисуем вовсе
+        layers = [layer for layer in layers if _layer_alpha(layer) > 0]
+        signatures = {}
+        changed = set()
+        for layer in layers:
+            sig = (layer.frame, layer.x, layer.y, layer.version, layer.opacity)
+            prev = self._signatures.get(layer.key)
+            # Содержимое сравниваем по идентичности массива: кэшированные кадры не меняются
+            if prev is None or prev[0] is not sig[0] or prev[1:] != sig[1:]:
+                changed.add(layer.key)
+            signatures[layer.key] = sig
+        # Слой, менявшийся в этом или прошлом кадре, считаем динамическим,
+        # чтобы перетаскивание не пересобирало статические слои на каждом кадре
+        dynamic = changed | (self._changed_last & signatures.keys())
+        self._changed_last = changed
+        surfaces = [self._surface(layer) for layer in layers]
+        self._contents = {key: self._contents[key] for key in signatures}
+        self._buffers = {key: self._buffers[key] for key in signatures if key in self._buffers}
+
+        plan_key = tuple(
+            (layer.key, 'dynamic') if layer.key in dynamic
+            else (layer.key, id(layer.frame), layer.x, layer.y, layer.version, layer.opacity)
+            for layer in layers
+        )
+        dirty = []
+        if plan_key != self._plan_key:
+            self._build_plan(surfaces, dynamic)
+            self._plan_key = plan_key
+            dirty.append(canvas_rect)
+        else:
+            by_key = {surface.key: surface for surface in surfaces}
+            self._plan = [by_key[item.key] if item.key is not None else item
+                          for item in self._plan]
+            for layer in layers:
+                if layer.key in changed:
+                    for r in (layer.rect, self._rects.get(layer.key)):
+                        if r is not None:
+                            r = _intersect(r, canvas_rect)
+                            if r is not None:
+                                dirty.append(r)
+            for key in self._rects.keys() - signatures.keys():
+                r = _intersect(self._rects[key], canvas_rect)
+                if r is not None:
+                    dirty.append(r)
+
+        self._signatures = signatures
+        self._rects = {layer.key: layer.rect for layer in layers}
+
+        self.frame_number += 1
+        self._history.append((self.frame_number, dirty))
+        buf = self.pool.acquire()
+        held = buf.tag
+        if held is None or not self._history or held < self._history[0][0] - 1:
+            # Буфер новый или слишком старый — история не покрывает его, рисуем всё
+            dirty = [canvas_rect]
+        else:
+            dirty = [r for number, rects in self._history if number > held for r in rects]
+        dirty = self._merge_rects(dirty)
+        self.last_dirty_area = sum(_area(r) for r in dirty)
+        for rect in dirty:
+            self._redraw(buf.array, rect)
+        buf.tag = self.frame_number
+        return buf
+
+    def _surface(self, layer: Layer) -> _Surface:
+        """Blend-ready form of a layer; premultiplication is redone only when content or opacity change"""
+        alpha = _layer_alpha(layer)
+        content_key = (layer.frame, layer.version, alpha)
+        cached = self._contents.get(layer.key)
+        if cached is not None and cached[0][0] is layer.frame and cached[0][1:] == content_key[1:]:
+            _, rgb, inv = cached
+        else:
+            rgb, inv = self._premultiply(layer.frame, alpha, layer.key)
+            self._contents[layer.key] = (content_key, rgb, inv)
+        return _Surface(layer.rect, rgb, inv, key=layer.key)
+
+    def _premultiply(self, frame: np.ndarray, alpha: int, key: int) -> tuple:
+        """
+        Split a layer frame into premultiplied BGR and 255 - alpha.
+        Results go into buffers kept per layer, so a changing layer allocates nothing.
+        :param frame: BGR or premultiplied BGRA frame
+        :param alpha: Layer opacity, 1..255
+        :param key: Layer key owning the buffers
+        :return: Tuple of (rgb, inv) as stored in _Surface
+        """
+        h, w = frame.shape[:2]
+        scratch = self._scratch if w <= self.width else None
+        if frame.shape[2] == 3:
+            if alpha == 255:
+                # Непрозрачный кадр смешивать не нужно — используем его как есть
+                return frame, 0
+            rgb = self._layer_buffer(key, 'rgb', frame.shape)
+            _mul255(frame, alpha, rgb, scratch)
+            return rgb, 255 - alpha
+        inv = self._layer_buffer(key, 'inv', (h, w, 1))
+        cv2.extractChannel(frame, 3, dst=inv.reshape(h, w))
+        if alpha == 255 and inv.min() == 255:
+            # Альфа везде 255: кадр копируется как есть, без умножения и без копии цвета
+            return frame[..., :3], 0
+        # Цвет — в непрерывный буфер: смешивание из кадра с шагом 4 байта заметно медленнее
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR, dst=self._layer_buffer(key, 'rgb', (h, w, 3)))
+        if alpha < 255:
+            _mul255(rgb, alpha, rgb, scratch)
+            _mul255(inv, alpha, inv, scratch)
+        cv2.bitwise_not(inv, dst=inv)
+        return rgb, inv
+
+    def _layer_buffer(self, key: int, name: str, shape: tuple) -> np.ndarray:
+        """Buffer of a layer that survives between frames while the shape stays the same"""
+        buffers = self._buffers.setdefault(key, {})
+        buf = buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = buffers[name] = np.empty(shape, dtype=np.uint8)
+        return buf
+
+    def _merge_rects(self, rects: List[tuple]) -> List[tuple]:
+        """Merge overlapping dirty rects so no pixel is redrawn twice"""
+        merged = []
+        for r in rects:
+            while True:
+                for i, m in enumerate(merged):
+                    if _intersect(r, m) is not None:
+                        r = _union(r, merged.pop(i))
+                        break
+                else:
+                    break
+            merged.append(r)
+        if sum(_area(r) for r in merged) * 2 > self.width * self.height:
+            return [(0, 0, self.width, self.height)]
+        return merged
+
+    def _build_plan(self, surfaces: List[_Surface], dynamic: set):
+        """Flatten runs of static layers between dynamic ones"""
+        self._base[:] = 0
+        # Буферы прошлого плана больше не рисуются — сплющиваем в них заново
+        spare, self._flat_buffers = self._flat_buffers, {}
+        plan = []
+        run = []
+        is_base = True
+        for surface in surfaces + [None]:
+            if surface is not None and surface.key not in dynamic:
+                if is_base:
+                    self._draw(self._base, (0, 0), surface)
+                else:
+                    run.append(surface)
+                continue
+            if run:
+                plan.extend(self._flatten(run, spare))
+                run = []
+            if surface is not None:
+                plan.append(surface)
+                is_base = False
+        self._plan = plan
+
+    def _flatten(self, surfaces: List[_Surface], spare: dict) -> List[_Surface]:
+        """
+        Flatten a run of static layers.
+        Non-overlapping groups get separate buffers so gaps between them are not blended.
+        :param spare: (h, w) -> [(rgb, inv)] buffers of the previous plan to reuse
+        """
+        canvas_rect = (0, 0, self.width, self.height)
+        groups = []  # (rect, [индексы слоёв])
+        for i, surface in enumerate(surfaces):
+            r = _intersect(surface.rect, canvas_rect)
+            if r is None:
+                continue
+            members = [i]
+            # Объединённый прямоугольник может задеть другие группы, поэтому повторяем
+            while True:
+                for j, group in enumerate(groups):
+                    if _intersect(group[0], r) is not None:
+                        r = _union(r, group[0])
+                        members += groups.pop(j)[1]
+                        break
+                else:
+                    break
+            # Порядок внутри группы важен, поэтому сортируем по исходному z
+            groups.append((r, sorted(members)))
+        runs = []
+        for rect, members in groups:
+            h, w = rect[3] - rect[1], rect[2] - rect[0]
+            # Пустой буфер прозрачен: rgb = 0, альфа = 0
+            if spare.get((h, w)):
+                rgb, inv = spare[(h, w)].pop()
+                rgb.fill(0)
+                inv.fill(255)
+            else:
+                rgb = np.zeros((h, w, 3), dtype=np.uint8)
+                inv = np.full((h, w, 1), 255, dtype=np.uint8)
+            self._flat_buffers.setdefault((h, w), []).append((rgb, inv))
+            for i in members:
+                self._draw(rgb, rect[:2], surfaces[i], dst_inv=inv)
+            runs.append(_Surface(rect, rgb, 0 if not inv.any() else inv))
+        return runs
+
+    def _draw(self, dst: np.ndarray, origin: tuple, surface: _Surface, clip: tuple = None,
+              dst_inv: np.ndarray = None):
+        """
+        Blend the part of a surface that falls into dst (placed at origin on the canvas)
+        :param dst_inv: 255 - alpha of dst when dst is itself a premultiplied buffer, updated in place
+        """
+        dh, dw = dst.shape[:2]
+        area = (origin[0], origin[1], origin[0] + dw, origin[1] + dh)
+        if clip is not None:
+            area = _intersect(area, clip)
+            if area is None:
+                return
+        r = _intersect(surface.rect, area)
+        if r is None:
+            return
+        x0, y0, x1, y1 = r
+        sx, sy = surface.rect[:2]
+        d = (slice(y0 - origin[1], y1 - origin[1]), slice(x0 - origin[0], x1 - origin[0]))
+        s = (slice(y0 - sy, y1 - sy), slice(x0 - sx, x1 - sx))
+        if surface.opaque:
+            dst[d] = surface.rgb[s]
+            if dst_inv is not None:
+                dst_inv[d] = 0
+            return
+        inv = surface.inv if isinstance(surface.inv, int) else surface.inv[s]
+        # Предумноженное «over»: dst = src + dst * (255 - a) / 255
+        _mul255(dst[d], inv, dst[d], self._scratch, add=surface.rgb[s])
+        if dst_inv is not None:
+            _mul255(dst_inv[d], inv, dst_inv[d], self._scratch)
+
+    def _redraw(self, canvas: np.ndarray, rect: tuple):
+        """Re-blend one region of the canvas from the flattened plan"""
+        x0, y0, x1, y1 = rect
+        # Всё, что лежит под непрозрачным слоем, целиком закрывающим область, не рисуем
+        start = 0
+        for i in range(len(self._plan) - 1, -1, -1):
+            item = self._plan[i]
+            if not item.opaque:
+                continue
+            if _intersect(item.rect, rect) == rect:
+                start = i
+                break
+        else:
+            canvas[y0:y1, x0:x1] = self._base[y0:y1, x0:x1]
+        for item in self._plan[start:]:
+            self._draw(canvas, (0, 0), item, clip=rect)
@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+
+
+class FrameCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """
+        LRU cache of decoded frames with a memory budget
+        :param max_bytes: Maximum total size of cached frames in bytes
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a cached frame and mark it as recently used
+        :param key: Cache key
+        :return: Cached numpy array or None
+        """
+        with self._lock:
+            frame = self._entries.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, key, frame):
+        """
+        Store a frame, evicting least recently used entries over the budget
+        :param key: Cache key
+        :param frame: numpy array to cache (must not be modified afterwards)
+        """
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old.nbytes
+            if frame.nbytes > self.max_bytes:
+                return
+            self._entries[key] = frame
+            self.current_bytes += frame.nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+
+    def discard(self, predicate):
+        """
+        Remove all entries whose key matches the predicate
+        :param predicate: Callable taking a key and returning True to remove it
+        """
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self.current_bytes -= self._entries.pop(key).nbytes
+
+    def clear(self):
+        """Remove all cached frames"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,137 @@
+import threading
+from collections import deque
+import numpy as np
+
+
+class FrameBuffer:
+    """Pooled frame with a reference count; returns to its pool when the last reference is released"""
+
+    def __init__(self, pool, array):
+        self.pool = pool
+        self.array = array
+        # Представление только для чтения создаётся один раз и раздаётся потребителям
+        self.readonly = array.view()
+        self.readonly.flags.writeable = False
+        self.tag = None  # Метаданные владельца пула (например, номер кадра в буфере)
+        self._refs = 0
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def retain(self):
+        """
+        Take one more reference
+        :return: self, for chaining
+        """
+        with self.pool._lock:
+            if self._refs <= 0:
+                raise RuntimeError("retain() on a released frame buffer")
+            self._refs += 1
+        return self
+
+    def _try_retain(self):
+        """Take one more reference unless the buffer has already gone back to its pool"""
+        with self.pool._lock:
+            if self._refs <= 0:
+                return False
+            self._refs += 1
+        return True
+
+    def release(self):
+        """Drop one reference; the buffer goes back to the pool when none are left"""
+        with self.pool._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            if self._refs < 0:
+                raise RuntimeError("release() called more times than retain()")
+            self.pool._free.append(self)
+
+
+class FramePool:
+    def __init__(self, shape, dtype=np.uint8, max_free=8):
+        """
+        Pool of preallocated frame buffers of one shape
+        :param shape: Array shape, e.g. (1080, 1920, 3)
+        :param dtype: Array dtype
+        :param max_free: Free buffers kept for reuse; extra ones are dropped
+        """
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.max_free = max_free
+        self.allocations = 0
+        self._free = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Get a buffer with one reference held by the caller. Its contents are undefined.
+        :return: FrameBuffer
+        """
+        with self._lock:
+            # Берём самый давно освобождённый буфер
+            buf = self._free.popleft() if self._free else None
+            while len(self._free) > self.max_free:
+                self._free.popleft()
+        if buf is None:
+            buf = FrameBuffer(self, np.empty(self.shape, dtype=self.dtype))
+            self.allocations += 1
+        buf._refs = 1
+        return buf
+
+    def free_count(self):
+        return len(self._free)
+
+
+class FrameSlot:
+    """
+    Holds a reference to the newest published FrameBuffer.
+    Readers take their own reference, so the buffer cannot be recycled while they use it.
+    The (sequence, buffer) tuple is replaced with one reference assignment, so readers take no lock.
+    """
+
+    def __init__(self):
+        self._latest = (0, None)
+        # Только между публикующими потоками; читатели его не берут
+        self._publish_lock = threading.Lock()
+
+    def publish(self, buffer):
+        """
+        Publish a buffer; the slot takes over one reference from the caller
+        :param buffer: FrameBuffer
+        """
+        with self._publish_lock:
+            seq, old = self._latest
+            self._latest = (seq + 1, buffer)
+        if old is not None:
+            old.release()
+
+    def acquire(self):
+        """
+        Take a reference to the newest buffer. The caller must release() it.
+        :return: Tuple of (sequence number, FrameBuffer or None)
+        """
+        while True:
+            latest = self._latest
+            buffer = latest[1]
+            if buffer is None:
+                return latest
+            if buffer._try_retain():
+                # Кортеж тот же — ссылка слота ещё жива, буфер не мог уйти в пул и вернуться
+                if self._latest is latest:
+                    return latest
+                buffer.release()
+            # Между чтением и retain() опубликовали новый кадр — берём его
+
+    @property
+    def seq(self):
+        return self._latest[0]
+
+    def clear(self):
+        """Drop the held buffer"""
+        with self._publish_lock:
+            seq, old = self._latest
+            self._latest = (seq, None)
+        if old is not None:
+            old.release()
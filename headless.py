@@ -0,0 +1,176 @@
+import argparse
+import signal
+import sys
+import threading
+import time
+from audio_engine import AudioEngine, DeviceInput, find_loopback_device
+from master_clock import MasterClock
+from output_manager import OutputManager
+from recorder import Recorder
+from render_engine import RenderEngine
+from scene_manager import SceneManager
+from stats import get_stats, format_stats
+from stream_manager import StreamManager
+
+
+class HeadlessRunner:
+    def __init__(self, config_path='config.json', workers=0, audio=True):
+        """
+        The render and output pipeline of the main window without Qt: loads a saved
+        scene collection and records or streams its active scene.
+        :param config_path: Scene collection written by the main window
+        :param workers: SceneManager worker threads
+        :param audio: Mix the default devices into the output like the main window; without it
+                      the encoder gets silence
+        """
+        self.scene_manager = SceneManager(workers=workers, config_path=config_path)
+        # Конфиг только читаем: ничего не меняем, чтобы не затереть его при выходе
+        self.scene_manager.config_path = None
+        self.clock = MasterClock()
+        self.video_settings = self.scene_manager.video_settings
+        self.output_manager = OutputManager(self.video_settings, clock=self.clock)
+        self.stream_manager = StreamManager(output_manager=self.output_manager)
+        self.recorder = Recorder(output_manager=self.output_manager)
+        self.render_engine = RenderEngine(self.scene_manager, clock=self.clock)
+        self.render_engine.add_output(self.output_manager.add_frame)
+        self.audio_engine = None
+        if audio:
+            self.audio_engine = AudioEngine(sample_rate=self.output_manager.sample_rate,
+                                            channels=self.output_manager.channels,
+                                            clock=self.clock)
+            self.add_audio_devices()
+            self.audio_engine.add_output(self.output_manager.add_audio)
+        self.stop_event = threading.Event()
+
+    def add_audio_devices(self):
+        loopback = find_loopback_device()
+        devices = [("Desktop Audio", loopback)] if loopback is not None else []
+        devices.append(("Mic/Aux", None))
+        for name, device in devices:
+            try:
+                self.audio_engine.add_input(DeviceInput(name, device=device))
+            except Exception as e:
+                print(f"Audio device error ({name}): {str(e)}")
+
+    def set_scene(self, name):
+        """
+        Make a scene active instead of the one saved as current
+        :param name: Scene name or id
+        """
+        for scene in self.scene_manager.scenes:
+            if name in (scene.id, scene.name):
+                self.scene_manager.set_active_scene(scene.id)
+                return
+        raise ValueError(f"Scene not found: {name}")
+
+    def start(self, record_file=None, stream_url=None, stream_key=None):
+        """
+        Start rendering and the requested outputs
+        :param record_file: File to record to, None to not record
+        :param stream_url: RTMP server URL, None to not stream
+        :param stream_key: Stream key
+        """
+        if self.scene_manager.current_scene is None:
+            raise ValueError("The scene collection has no active scene")
+        if self.audio_engine is not None:
+            self.audio_engine.start()
+        self.render_engine.start()
+        if record_file:
+            self.recorder.start_recording(record_file)
+        if stream_url:
+            self.stream_manager.start_stream(stream_url, stream_key or '')
+
+    def run(self, duration=None, stats_interval=0):
+        """
+        Block until duration has passed, stop() is called or an output fails
+        :param duration: Seconds to run, None until stopped
+        :param stats_interval: Seconds between stats printouts, 0 for none
+        :return: Error message of a failed output, None if it ran to the end
+        """
+        deadline = None if duration is None else time.monotonic() + duration
+        next_stats = time.monotonic() + stats_interval
+        while True:
+            timeout = 0.5
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+            if self.stop_event.wait(max(timeout, 0)):
+                return None
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            error = self.get_error()
+            if error:
+                return error
+            if stats_interval and time.monotonic() >= next_stats:
+                next_stats += stats_interval
+                print('\n'.join(format_stats(get_stats())), flush=True)
+
+    def get_error(self):
+        """
+        :return: Error of the encoder or of a started output, None if all are fine
+        """
+        if self.recorder.is_recording:
+            error = self.recorder.get_record_status()['error']
+            if error:
+                return f"Recording: {error}"
+        if self.stream_manager.is_streaming:
+            error = self.stream_manager.get_stream_status()['error']
+            if error:
+                return f"Stream: {error}"
+        return None
+
+    def stop(self):
+        """Ask run() to return; safe to call from a signal handler"""
+        self.stop_event.set()
+
+    def shutdown(self):
+        """Stop rendering and close the outputs, finishing the recording"""
+        self.render_engine.stop()
+        if self.audio_engine is not None:
+            self.audio_engine.stop()
+        self.recorder.stop_recording()
+        self.stream_manager.stop_stream()
+        self.output_manager.stop()
+        self.scene_manager.set_workers(0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Record or stream a saved scene collection without the GUI')
+    parser.add_argument('--config', default='config.json', help='Scene collection file')
+    parser.add_argument('--scene', help='Scene name or id to show instead of the saved current scene')
+    parser.add_argument('--record', metavar='FILE', help='Record to this file (mp4, mkv, ts, ...)')
+    parser.add_argument('--stream', metavar='URL', help='Stream to this RTMP server URL')
+    parser.add_argument('--key', default='', help='Stream key')
+    parser.add_argument('--duration', type=float, help='Seconds to run, until SIGINT/SIGTERM if omitted')
+    parser.add_argument('--no-audio', action='store_true', help='Do not open audio devices, encode silence')
+    parser.add_argument('--workers', type=int, default=0, help='SceneManager worker threads')
+    parser.add_argument('--stats', type=float, default=0, metavar='SECONDS',
+                        help='Print pipeline stats every SECONDS, 0 to disable')
+    args = parser.parse_args(argv)
+    if not args.record and not args.stream:
+        parser.error('nothing to do: give --record and/or --stream')
+
+    runner = HeadlessRunner(args.config, workers=args.workers, audio=not args.no_audio)
+    if args.scene:
+        try:
+            runner.set_scene(args.scene)
+        except ValueError as e:
+            parser.error(str(e))
+    # Остановка по сигналу: обработчик только выставляет флаг, закрытие — в основном потоке
+    for name in ('SIGINT', 'SIGTERM', 'SIGHUP'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), lambda signum, frame: runner.stop())
+    try:
+        runner.start(args.record, args.stream, args.key)
+        error = runner.run(args.duration, args.stats)
+    except Exception as e:
+        error = str(e)
+    finally:
+        runner.shutdown()
+    if error:
+        print(f"Error: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
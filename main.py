@@ -1,24 +1,28 @@
 import sys
+import time
 import cv2
 import numpy as np
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                             QHBoxLayout, QPushButton, QLabel, QListWidget, QGroupBox, QDialog,
-                            QLineEdit, QFormLayout, QMessageBox, QSlider, QInputDialog, QFileDialog)
+                            QLineEdit, QFormLayout, QMessageBox, QSlider, QInputDialog, QFileDialog,
+                            QComboBox, QSpinBox, QCheckBox, QProgressBar)
 from PyQt6.QtCore import Qt, QTimer, QRect, QPoint
-from PyQt6.QtGui import QImage, QPixmap, QPainter, QPen, QColor, QMouseEvent, QIcon
-import sounddevice as sd
-import soundfile as sf
+from PyQt6.QtGui import QImage, QPixmap, QPainter, QPen, QColor, QMouseEvent, QIcon, QFont
 import shutil
-import ffmpeg
-from PIL import Image
 
-from screen_capture import ScreenCapture
-from audio_capture import AudioCapture
+from audio_engine import AudioEngine, DeviceInput, find_loopback_device
+from audio_meter import to_db
 from stream_manager import StreamManager
+from recorder import Recorder
+from output_manager import OutputManager
+from render_engine import RenderEngine
+from master_clock import MasterClock
 from scene_manager import SceneManager, Scene, Source
+from video_settings import VideoSettings, SCALE_FILTERS
+from stats import stage_timer, get_stats, format_stats
 
 class SettingsDialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, video_settings=None):
         super().__init__(parent)
         self.setWindowTitle("Stream Settings")
         self.setModal(True)
@@ -27,6 +31,27 @@ class SettingsDialog(QDialog):
         self.stream_key = QLineEdit()
         layout.addRow("Stream URL:", self.stream_url)
         layout.addRow("Stream Key:", self.stream_key)
+        video_settings = video_settings or VideoSettings()
+        self.base_width = self._size_box(video_settings.base_width)
+        self.base_height = self._size_box(video_settings.base_height)
+        self.output_width = self._size_box(video_settings.output_width)
+        self.output_height = self._size_box(video_settings.output_height)
+        self.fps = QSpinBox()
+        self.fps.setRange(1, 240)
+        self.fps.setValue(video_settings.fps)
+        self.scale_filter = QComboBox()
+        self.scale_filter.addItems(list(SCALE_FILTERS))
+        self.scale_filter.setCurrentText(video_settings.scale_filter)
+        base = QHBoxLayout()
+        base.addWidget(self.base_width)
+        base.addWidget(self.base_height)
+        output = QHBoxLayout()
+        output.addWidget(self.output_width)
+        output.addWidget(self.output_height)
+        layout.addRow("Canvas:", base)
+        layout.addRow("Output:", output)
+        layout.addRow("FPS:", self.fps)
+        layout.addRow("Scale filter:", self.scale_filter)
         buttons = QHBoxLayout()
         ok_button = QPushButton("OK")
         cancel_button = QPushButton("Cancel")
@@ -36,49 +61,105 @@ class SettingsDialog(QDialog):
         buttons.addWidget(cancel_button)
         layout.addRow(buttons)
 
+    @staticmethod
+    def _size_box(value):
+        box = QSpinBox()
+        # Кодеку нужны чётные размеры
+        box.setRange(16, 7680)
+        box.setSingleStep(2)
+        box.setValue(value)
+        return box
+
+    def video_values(self):
+        """Video settings entered in the dialog, as keyword arguments for VideoSettings.update"""
+        return {
+            'base_width': self.base_width.value() // 2 * 2,
+            'base_height': self.base_height.value() // 2 * 2,
+            'output_width': self.output_width.value() // 2 * 2,
+            'output_height': self.output_height.value() // 2 * 2,
+            'fps': self.fps.value(),
+            'scale_filter': self.scale_filter.currentText(),
+        }
+
 class MixerWidget(QWidget):
-    def __init__(self):
+    METER_FLOOR_DB = -60
+
+    def __init__(self, audio_engine):
+        """
+        Gain slider, mute switch and per-channel level meters for every input of the audio engine,
+        plus meters of the master bus
+        :param audio_engine: AudioEngine whose inputs are shown
+        """
         super().__init__()
-        layout = QVBoxLayout(self)
-        self.desktop_label = QLabel("Desktop Audio")
-        self.desktop_slider = QSlider(Qt.Orientation.Horizontal)
-        self.desktop_slider.setRange(0, 100)
-        self.desktop_slider.setValue(0)
-        self.mic_label = QLabel("Mic/Aux")
-        self.mic_slider = QSlider(Qt.Orientation.Horizontal)
-        self.mic_slider.setRange(0, 100)
-        self.mic_slider.setValue(0)
-        layout.addWidget(self.desktop_label)
-        layout.addWidget(self.desktop_slider)
-        layout.addWidget(self.mic_label)
-        layout.addWidget(self.mic_slider)
-        layout.addStretch()
-        # Таймер для обновления VU-метра
+        self.audio_engine = audio_engine
+        self.rows = {}
+        self.rows_layout = QVBoxLayout(self)
+        for audio_input in audio_engine.inputs:
+            self.add_row(audio_input)
+        self.add_row(None)
+        self.rows_layout.addStretch()
+        # Таймер для обновления VU-метров
         self.timer = QTimer()
-        self.timer.timeout.connect(self.update_mic_level)
-        self.timer.start(100)
-        self.stream = None
-        self.start_mic_stream()
-
-    def start_mic_stream(self):
-        try:
-            self.stream = sd.InputStream(callback=self.audio_callback, channels=1, samplerate=44100)
-            self.stream.start()
-        except Exception:
-            self.stream = None
+        self.timer.timeout.connect(self.update_levels)
+        self.timer.start(50)
 
-    def audio_callback(self, indata, frames, time, status):
-        self.level = int(np.linalg.norm(indata) * 100)
+    def add_row(self, audio_input):
+        """
+        Add the controls of one input
+        :param audio_input: AudioInput, None for the master bus
+        """
+        name = audio_input.name if audio_input is not None else 'master'
+        channels = audio_input.channels if audio_input is not None else self.audio_engine.channels
+        row = QHBoxLayout()
+        label = QLabel(name if audio_input is not None else "Master")
+        label.setMinimumWidth(90)
+        row.addWidget(label)
+        if audio_input is not None:
+            slider = QSlider(Qt.Orientation.Horizontal)
+            slider.setRange(0, 100)
+            slider.setValue(int(audio_input.gain * 100))
+            slider.valueChanged.connect(lambda value: self.audio_engine.set_gain(name, value / 100))
+            mute = QCheckBox("Mute")
+            mute.setChecked(audio_input.muted)
+            mute.toggled.connect(lambda checked: self.audio_engine.set_muted(name, checked))
+            row.addWidget(slider, stretch=1)
+            row.addWidget(mute)
+        else:
+            row.addStretch()
+        loudness = QLabel()
+        loudness.setMinimumWidth(70)
+        row.addWidget(loudness)
+        column = QVBoxLayout()
+        column.addLayout(row)
+        meters = []
+        for _ in range(channels):
+            meter = QProgressBar()
+            meter.setRange(self.METER_FLOOR_DB, 0)
+            meter.setMaximumHeight(12)
+            column.addWidget(meter)
+            meters.append(meter)
+        self.rows_layout.insertLayout(len(self.rows), column)
+        self.rows[name] = (meters, loudness)
+
+    def update_levels(self):
+        # Измерения идут в потоке микшера, здесь только читаем готовые снимки
+        for name, snapshot in self.audio_engine.get_levels().items():
+            row = self.rows.get(name)
+            if row is None:
+                continue
+            meters, loudness = row
+            for meter, peak, hold in zip(meters, snapshot.peak, snapshot.peak_hold):
+                meter.setValue(int(max(to_db(peak), self.METER_FLOOR_DB)))
+                # Удержанный пик показываем текстом на полосе
+                meter.setFormat(f"{to_db(hold):.0f} dB" if hold > 0 else "")
+            loudness.setText(f"{snapshot.loudness:.1f} LUFS" if snapshot.loudness > -70 else "-∞ LUFS")
+
+_upload_timer = stage_timer('preview_upload')
+_paint_timer = stage_timer('preview_paint')
 
-    def update_mic_level(self):
-        # Обновляем VU-метр микрофона
-        level = getattr(self, 'level', 0)
-        self.mic_slider.setValue(min(level, 100))
-        # Desktop Audio — пока заглушка
-        self.desktop_slider.setValue(0)
 
 class PreviewWidget(QLabel):
-    def __init__(self, parent=None):
+    def __init__(self, video_settings=None, parent=None):
         super().__init__(parent)
         self.setMouseTracking(True)
         self.selected_source = None
@@ -87,32 +168,56 @@ class PreviewWidget(QLabel):
         self.drag_offset = QPoint(0, 0)
         self.resize_dir = None
         self.sources = []
-        self.preview_image = None
+        self.frame_pixmap = None
+        self.preview_pixmap = None
+        # Размер холста до первого кадра
+        self.canvas_size = (video_settings or VideoSettings()).base_size
         self.scale_x = 1.0
         self.scale_y = 1.0
         self.offset_x = 0
         self.offset_y = 0
+        self.stats_lines = None  # Строки оверлея статистики, None — не показывать
 
-    def set_preview(self, image, sources):
-        self.preview_image = image
+    def set_preview(self, image, sources, canvas_size=None):
+        """
+        Show a new frame. The image is copied into a pixmap and not kept.
+        :param image: Frame already sized for the widget (or a full canvas frame)
+        :param sources: Sources of the scene, for outlines
+        :param canvas_size: (w, h) of the scene canvas, defaults to the image size
+        """
         self.sources = sources
+        h, w, ch = image.shape
+        self.canvas_size = canvas_size or (w, h)
+        qt_image = QImage(image.data, w, h, ch * w, QImage.Format.Format_BGR888)
+        self.frame_pixmap = QPixmap.fromImage(qt_image)
+        self.preview_pixmap = self._fit_pixmap()
         self.update()
 
+    def _fit_pixmap(self):
+        pixmap = self.frame_pixmap
+        label_size = self.size()
+        if pixmap.width() > label_size.width() or pixmap.height() > label_size.height():
+            # Кадр ещё не под новый размер виджета — масштабируем один раз, а не на каждой отрисовке
+            pixmap = pixmap.scaled(label_size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.FastTransformation)
+        return pixmap
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.frame_pixmap is not None:
+            self.preview_pixmap = self._fit_pixmap()
+
     def paintEvent(self, event):
+        started = time.perf_counter()
         super().paintEvent(event)
-        if self.preview_image is not None:
-            h, w, ch = self.preview_image.shape
-            bytes_per_line = ch * w
-            qt_image = QImage(self.preview_image.data, w, h, bytes_per_line, QImage.Format.Format_RGB888)
-            pixmap = QPixmap.fromImage(qt_image)
+        if self.preview_pixmap is not None:
+            scaled_pixmap = self.preview_pixmap
             label_size = self.size()
-            scaled_pixmap = pixmap.scaled(label_size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
             painter = QPainter(self)
             # Центрирование
             x = (label_size.width() - scaled_pixmap.width()) // 2
             y = (label_size.height() - scaled_pixmap.height()) // 2
-            self.scale_x = scaled_pixmap.width() / w
-            self.scale_y = scaled_pixmap.height() / h
+            self.scale_x = scaled_pixmap.width() / self.canvas_size[0]
+            self.scale_y = scaled_pixmap.height() / self.canvas_size[1]
             self.offset_x = x
             self.offset_y = y
             painter.drawPixmap(x, y, scaled_pixmap)
@@ -134,7 +239,27 @@ class PreviewWidget(QLabel):
                     painter.setBrush(QColor(255,255,0))
                     for cx, cy in [(rx, ry), (rx+rw, ry), (rx, ry+rh), (rx+rw, ry+rh)]:
                         painter.drawRect(cx-3, cy-3, 6, 6)
+            if self.stats_lines:
+                self._draw_stats(painter, x + 8, y + 8)
             painter.end()
+        _paint_timer.record(time.perf_counter() - started)
+
+    def _draw_stats(self, painter, x, y):
+        """Semi-transparent box with the stats lines in the top left corner of the frame"""
+        font = QFont("monospace")
+        font.setStyleHint(QFont.StyleHint.Monospace)
+        font.setPointSize(9)
+        painter.setFont(font)
+        metrics = painter.fontMetrics()
+        line_h = metrics.height()
+        width = max(metrics.horizontalAdvance(line) for line in self.stats_lines) + 12
+        height = line_h * len(self.stats_lines) + 8
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QColor(0, 0, 0, 160))
+        painter.drawRect(x, y, width, height)
+        painter.setPen(QColor(220, 255, 220))
+        for i, line in enumerate(self.stats_lines):
+            painter.drawText(x + 6, y + 4 + metrics.ascent() + i * line_h, line)
 
     def mousePressEvent(self, event):
         if not self.sources:
@@ -221,16 +346,36 @@ class RPYMainWindow(QMainWindow):
         self.setWindowTitle("RTP - Record Tool Python")
         self.setGeometry(100, 100, 1280, 800)
         self.setStyleSheet(self.dark_style())
-        self.screen_capture = ScreenCapture()
-        self.audio_capture = AudioCapture()
-        self.stream_manager = StreamManager()
+        # Захват экрана нужен окну только для списка окон — создаётся при первом запросе
+        self.screen_capture = None
+        # Захват звука в файл тянет sounddevice и soundfile — создаётся при первом обращении
+        self._audio_capture = None
         self.scene_manager = SceneManager()
+        # Общие часы: метки времени кадров и звука в одной шкале
+        self.clock = MasterClock()
+        # Один объект настроек видео на всех: холст, выходной размер, fps
+        self.video_settings = self.scene_manager.video_settings
+        # Запись и трансляция используют один кодировщик
+        self.output_manager = OutputManager(self.video_settings, clock=self.clock)
+        self.stream_manager = StreamManager(output_manager=self.output_manager)
+        self.recorder = Recorder(output_manager=self.output_manager)
+        # Рендер идёт в своём потоке, GUI только показывает последний кадр
+        self.render_engine = RenderEngine(self.scene_manager, clock=self.clock)
+        self.render_engine.add_output(self.output_manager.add_frame)
+        # Микшер звука: смешанные блоки идут в тот же кодировщик
+        self.audio_engine = AudioEngine(sample_rate=self.output_manager.sample_rate,
+                                        channels=self.output_manager.channels,
+                                        clock=self.clock)
+        self.add_audio_devices()
+        self.audio_engine.add_output(self.output_manager.add_audio)
+        self.audio_engine.start()
+        self.preview_seq = 0
         # --- Основной layout ---
         central = QWidget()
         self.setCentralWidget(central)
         main_v = QVBoxLayout(central)
         # --- Верх: предпросмотр ---
-        self.preview_label = PreviewWidget()
+        self.preview_label = PreviewWidget(self.video_settings)
         self.preview_label.setMinimumSize(900, 500)
         self.preview_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         preview_box = QGroupBox()
@@ -242,8 +387,8 @@ class RPYMainWindow(QMainWindow):
         # Сцены
         scenes_box = QGroupBox("Scenes")
         scenes_layout = QVBoxLayout(scenes_box)
+        # Щелчок по сцене только выбирает её; в эфир она идёт кнопками перехода
         self.scenes_list = QListWidget()
-        self.scenes_list.itemClicked.connect(self.scene_selected)
         scenes_layout.addWidget(self.scenes_list)
         scenes_btns = QHBoxLayout()
         self.add_scene_btn = QPushButton("+")
@@ -282,7 +427,7 @@ class RPYMainWindow(QMainWindow):
         # Микшер
         mixer_box = QGroupBox("Микшер")
         mixer_layout = QVBoxLayout(mixer_box)
-        self.mixer = MixerWidget()
+        self.mixer = MixerWidget(self.audio_engine)
         mixer_layout.addWidget(self.mixer)
         bottom_h.addWidget(mixer_box, stretch=2)
         main_v.addLayout(bottom_h, stretch=1)
@@ -297,8 +442,20 @@ class RPYMainWindow(QMainWindow):
         self.screenshot_btn = QPushButton("Скриншот")
         self.export_btn = QPushButton("Экспорт профиля")
         self.import_btn = QPushButton("Импорт профиля")
-        self.fade_btn = QPushButton("Fade переход")
+        self.transition_combo = QComboBox()
+        self.transition_combo.addItem("Fade", 'fade')
+        self.transition_combo.addItem("Slide", 'slide')
+        self.transition_combo.addItem("Wipe", 'wipe')
+        self.transition_duration = QSpinBox()
+        self.transition_duration.setRange(50, 10000)
+        self.transition_duration.setSingleStep(50)
+        self.transition_duration.setSuffix(" мс")
+        self.transition_duration.setValue(500)
+        self.transition_btn = QPushButton("Переход")
         self.cut_btn = QPushButton("Cut переход")
+        self.stats_check = QCheckBox("Статистика")
+        self.stats_check.toggled.connect(lambda checked: self.preview_label.update())
+        self.stats_updated = 0.0
         self.start_stream_btn.clicked.connect(self.start_streaming)
         self.stop_stream_btn.clicked.connect(self.stop_streaming)
         self.stream_settings_btn.clicked.connect(self.show_stream_settings)
@@ -307,7 +464,7 @@ class RPYMainWindow(QMainWindow):
         self.screenshot_btn.clicked.connect(self.save_screenshot)
         self.export_btn.clicked.connect(self.export_profile)
         self.import_btn.clicked.connect(self.import_profile)
-        self.fade_btn.clicked.connect(lambda: self.switch_scene('fade'))
+        self.transition_btn.clicked.connect(lambda: self.switch_scene(self.transition_combo.currentData()))
         self.cut_btn.clicked.connect(lambda: self.switch_scene('cut'))
         controls_h.addWidget(self.start_stream_btn)
         controls_h.addWidget(self.stop_stream_btn)
@@ -316,9 +473,12 @@ class RPYMainWindow(QMainWindow):
         controls_h.addWidget(self.screenshot_btn)
         controls_h.addWidget(self.export_btn)
         controls_h.addWidget(self.import_btn)
-        controls_h.addWidget(self.fade_btn)
+        controls_h.addWidget(self.transition_combo)
+        controls_h.addWidget(self.transition_duration)
+        controls_h.addWidget(self.transition_btn)
         controls_h.addWidget(self.cut_btn)
         controls_h.addWidget(self.stream_settings_btn)
+        controls_h.addWidget(self.stats_check)
         main_v.addLayout(controls_h)
         # --- Таймер предпросмотра ---
         self.preview_timer = QTimer()
@@ -327,7 +487,7 @@ class RPYMainWindow(QMainWindow):
         # Если сцен нет после загрузки — создать первую сцену
         if not self.scene_manager.scenes:
             self.create_initial_scene()
-        self.screen_capture.start_capture()
+        self.render_engine.start()
 
     def dark_style(self):
         return """
@@ -386,8 +546,10 @@ class RPYMainWindow(QMainWindow):
 
     def update_scenes_list(self):
         self.scenes_list.clear()
-        for scene in self.scene_manager.scenes:
+        for row, scene in enumerate(self.scene_manager.scenes):
             self.scenes_list.addItem(scene.name)
+            if scene is self.scene_manager.current_scene:
+                self.scenes_list.setCurrentRow(row)
 
     def update_sources_list(self):
         self.sources_list.clear()
@@ -398,14 +560,6 @@ class RPYMainWindow(QMainWindow):
                     name = "[скрыт] " + name
                 self.sources_list.addItem(name)
 
-    def scene_selected(self, item):
-        scene_name = item.text()
-        for scene in self.scene_manager.scenes:
-            if scene.name == scene_name:
-                self.scene_manager.set_active_scene(scene.id)
-                self.update_sources_list()
-                break
-
     def source_selected(self, item):
         pass
 
@@ -440,6 +594,9 @@ class RPYMainWindow(QMainWindow):
                 {'display': 0}
             )
         elif source_type == "Захват окна":
+            if self.screen_capture is None:
+                from screen_capture import ScreenCapture
+                self.screen_capture = ScreenCapture()
             windows = self.screen_capture.get_available_windows()
             if not windows:
                 QMessageBox.warning(self, "Нет окон", "Нет доступных окон для захвата.")
@@ -501,16 +658,26 @@ class RPYMainWindow(QMainWindow):
                     break
 
     def show_stream_settings(self):
-        dialog = SettingsDialog(self)
+        dialog = SettingsDialog(self, self.video_settings)
         if dialog.exec() == QDialog.DialogCode.Accepted:
             self.stream_url = dialog.stream_url.text()
             self.stream_key = dialog.stream_key.text()
+            values = dialog.video_values()
+            if values != self.video_settings.to_dict():
+                if self.output_manager.is_encoding:
+                    QMessageBox.warning(self, "Error", "Stop recording and streaming to change video settings")
+                    return
+                self.scene_manager.update_video_settings(**values)
 
     def start_streaming(self):
         if not hasattr(self, 'stream_url') or not hasattr(self, 'stream_key'):
             QMessageBox.warning(self, "Error", "Please configure stream settings first")
             return
-        self.stream_manager.start_stream(self.stream_url, self.stream_key)
+        try:
+            self.stream_manager.start_stream(self.stream_url, self.stream_key)
+        except Exception as e:
+            QMessageBox.warning(self, "Error", f"Failed to start stream: {e}")
+            return
         self.start_stream_btn.setEnabled(False)
         self.stop_stream_btn.setEnabled(True)
 
@@ -520,55 +687,61 @@ class RPYMainWindow(QMainWindow):
         self.stop_stream_btn.setEnabled(False)
 
     def start_recording(self):
-        file, ok = QFileDialog.getSaveFileName(self, "Сохранить запись", "record.mp4", "MP4 (*.mp4)")
+        file, ok = QFileDialog.getSaveFileName(self, "Сохранить запись", "record.mp4",
+                                              "MP4 (*.mp4);;Matroska (*.mkv);;MPEG-TS (*.ts)")
         if not ok or not file:
             return
-        self.recording = True
-        self.record_file = file
-        self.record_frames = []
+        try:
+            self.recorder.start_recording(file)
+        except Exception as e:
+            QMessageBox.warning(self, "Error", f"Failed to start recording: {e}")
+            return
         self.start_record_btn.setEnabled(False)
         self.stop_record_btn.setEnabled(True)
 
     def stop_recording(self):
-        self.recording = False
+        self.recorder.stop_recording()
         self.start_record_btn.setEnabled(True)
         self.stop_record_btn.setEnabled(False)
-        if hasattr(self, 'record_frames') and self.record_frames:
-            # Сохраняем в mp4 через ffmpeg-python
-            h, w, _ = self.record_frames[0].shape
-            process = (
-                ffmpeg
-                .input('pipe:', format='rawvideo', pix_fmt='bgr24', s=f'{w}x{h}', framerate=30)
-                .output(self.record_file, pix_fmt='yuv420p', vcodec='libx264', r=30)
-                .overwrite_output()
-                .run_async(pipe_stdin=True)
-            )
-            for frame in self.record_frames:
-                process.stdin.write(frame.astype(np.uint8).tobytes())
-            process.stdin.close()
-            process.wait()
 
     def update_preview(self):
-        if self.scene_manager.current_scene:
-            preview = self.scene_manager.get_scene_preview(self.scene_manager.current_scene.id)
-            if preview is not None:
-                self.preview_label.set_preview(preview, self.scene_manager.current_scene.sources)
-                # Для записи
-                if getattr(self, 'recording', False):
-                    self.record_frames.append(preview.copy())
+        self.render_engine.set_preview_size(self.preview_label.width(), self.preview_label.height())
+        self.update_stats_overlay()
+        if self.render_engine.preview.seq == self.preview_seq or not self.scene_manager.current_scene:
+            return
+        seq, buf = self.render_engine.acquire_preview_frame()
+        if buf is not None:
+            self.preview_seq = seq
+            started = time.perf_counter()
+            self.preview_label.set_preview(buf.array, self.scene_manager.current_scene.sources,
+                                           self.render_engine.canvas_size)
+            _upload_timer.record(time.perf_counter() - started)
+            buf.release()
+
+    def update_stats_overlay(self):
+        if not self.stats_check.isChecked():
+            self.preview_label.stats_lines = None
+            return
+        # Сводку пересчитываем два раза в секунду, а не на каждом кадре
+        now = time.monotonic()
+        if now - self.stats_updated < 0.5:
+            return
+        self.stats_updated = now
+        self.preview_label.stats_lines = format_stats(get_stats())
+        self.preview_label.update()
 
     def move_source_up(self):
         scene = self.scene_manager.current_scene
         idx = self.sources_list.currentRow()
         if scene and 0 < idx < len(scene.sources):
-            scene.sources[idx-1], scene.sources[idx] = scene.sources[idx], scene.sources[idx-1]
+            self.scene_manager.move_source(scene.id, idx, -1)
             self.update_sources_list()
 
     def move_source_down(self):
         scene = self.scene_manager.current_scene
         idx = self.sources_list.currentRow()
         if scene and 0 <= idx < len(scene.sources)-1:
-            scene.sources[idx+1], scene.sources[idx] = scene.sources[idx], scene.sources[idx+1]
+            self.scene_manager.move_source(scene.id, idx, 1)
             self.update_sources_list()
 
     def toggle_source_visible(self):
@@ -594,38 +767,47 @@ class RPYMainWindow(QMainWindow):
     def save_screenshot(self):
         file, ok = QFileDialog.getSaveFileName(self, "Сохранить скриншот", "screenshot.png", "PNG (*.png)")
         if ok and file:
-            if self.scene_manager.current_scene:
-                preview = self.scene_manager.get_scene_preview(self.scene_manager.current_scene.id)
-                img = Image.fromarray(cv2.cvtColor(preview, cv2.COLOR_BGR2RGB))
+            _, buf = self.render_engine.acquire_program_frame()
+            if buf is not None:
+                from PIL import Image
+                img = Image.fromarray(cv2.cvtColor(buf.array, cv2.COLOR_BGR2RGB))
+                buf.release()
                 img.save(file)
 
     def switch_scene(self, mode):
-        # mode: 'fade' или 'cut'
+        # mode: 'cut', 'fade', 'slide' или 'wipe'; переход рисует поток рендера
         if not self.scene_manager.scenes:
             return
         idx = self.scenes_list.currentRow()
         if idx < 0 or idx >= len(self.scene_manager.scenes):
             return
         target_scene = self.scene_manager.scenes[idx]
-        if mode == 'cut':
-            self.scene_manager.set_active_scene(target_scene.id)
-            self.update_sources_list()
-        elif mode == 'fade':
-            # Плавный переход (fade)
-            if self.scene_manager.current_scene:
-                from_scene = self.scene_manager.current_scene
-                to_scene = target_scene
-                steps = 10
-                for alpha in np.linspace(0, 1, steps):
-                    from_img = self.scene_manager.get_scene_preview(from_scene.id).astype(np.float32)
-                    to_img = self.scene_manager.get_scene_preview(to_scene.id).astype(np.float32)
-                    blend = cv2.addWeighted(from_img, 1-alpha, to_img, alpha, 0).astype(np.uint8)
-                    self.preview_label.set_preview(blend, to_scene.sources)
-                    QApplication.processEvents()
-                self.scene_manager.set_active_scene(target_scene.id)
-                self.update_sources_list()
+        self.render_engine.transition_to(target_scene.id, mode, self.transition_duration.value())
+        self.update_sources_list()
+
+    @property
+    def audio_capture(self):
+        if self._audio_capture is None:
+            from audio_capture import AudioCapture
+            self._audio_capture = AudioCapture()
+        return self._audio_capture
+
+    def add_audio_devices(self):
+        loopback = find_loopback_device()
+        devices = [("Desktop Audio", loopback)] if loopback is not None else []
+        devices.append(("Mic/Aux", None))
+        for name, device in devices:
+            try:
+                self.audio_engine.add_input(DeviceInput(name, device=device))
+            except Exception as e:
+                print(f"Audio device error ({name}): {str(e)}")
 
     def closeEvent(self, event):
+        self.render_engine.stop()
+        self.audio_engine.stop()
+        self.recorder.stop_recording()
+        self.stream_manager.stop_stream()
+        self.output_manager.stop()
         self.scene_manager.save_config()
         event.accept()
 
@@ -0,0 +1,143 @@
+import time
+import numpy as np
+
+
+class MasterClock:
+    def __init__(self):
+        """
+        Monotonic clock shared by the render engine, the audio engine and the outputs.
+        Presentation timestamps are seconds on this clock.
+        """
+        self.epoch = time.monotonic()
+
+    def now(self):
+        """
+        :return: Seconds since the clock was created
+        """
+        return time.monotonic() - self.epoch
+
+    def wait_until(self, t, stop_event=None):
+        """
+        Sleep until the clock reaches t
+        :param t: Time on this clock
+        :param stop_event: threading.Event that ends the wait early
+        :return: True if stop_event was set
+        """
+        delay = t - self.now()
+        if delay <= 0:
+            return stop_event is not None and stop_event.is_set()
+        if stop_event is not None:
+            return stop_event.wait(delay)
+        time.sleep(delay)
+        return False
+
+
+class VideoPacer:
+    def __init__(self, fps, start_time):
+        """
+        Turns timestamped frames into a constant-frame-rate sequence.
+        Output frame n covers start_time + n / fps; a frame is repeated for slots
+        that got no frame of their own and dropped if its slot is already written.
+        :param fps: Output frame rate
+        :param start_time: Clock time of output frame 0
+        """
+        self.fps = fps
+        self.start_time = start_time
+        self.frames_written = 0
+        self.duplicated = 0
+        self.dropped = 0
+
+    def pace(self, array, pts):
+        """
+        :param array: Frame
+        :param pts: Presentation time of the frame, None to use the next slot
+        :return: List of frames to write (empty if the frame is dropped)
+        """
+        if pts is None:
+            slot = self.frames_written
+        else:
+            slot = int(round((pts - self.start_time) * self.fps))
+        if slot < self.frames_written:
+            self.dropped += 1
+            return []
+        copies = slot - self.frames_written + 1
+        self.duplicated += copies - 1
+        self.frames_written += copies
+        return [array] * copies
+
+    def idle(self):
+        return []
+
+    @property
+    def position(self):
+        """Time on the clock the written frames reach"""
+        return self.start_time + self.frames_written / self.fps
+
+
+class AudioPacer:
+    def __init__(self, sample_rate, channels, start_time, clock=None, tolerance=0.005, latency=0.25):
+        """
+        Keeps written audio aligned with the clock: gaps between blocks are filled with silence,
+        overlapping audio is trimmed. Sample n of the output covers start_time + n / sample_rate.
+        :param sample_rate: Output sample rate
+        :param channels: Output channels
+        :param start_time: Clock time of output sample 0
+        :param clock: MasterClock; while no audio arrives silence is written up to now - latency.
+                      None to write nothing while idle
+        :param tolerance: Timing error in seconds that is ignored
+        :param latency: Seconds audio may arrive behind the clock before it is replaced by silence
+        """
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.start_time = start_time
+        self.clock = clock
+        self.tolerance = int(tolerance * sample_rate)
+        self.latency = latency
+        self.samples_written = 0
+        self.silence_inserted = 0  # Кадры тишины, вставленные в паузы
+        self.samples_dropped = 0  # Кадры, отброшенные из-за перекрытия
+        self._silence = np.zeros((sample_rate // 10, channels), dtype=np.float32)
+
+    def _silence_chunks(self, frames):
+        chunks = []
+        while frames > 0:
+            n = min(frames, len(self._silence))
+            chunks.append(self._silence[:n])
+            frames -= n
+        self.silence_inserted += sum(len(c) for c in chunks)
+        self.samples_written += sum(len(c) for c in chunks)
+        return chunks
+
+    def pace(self, array, pts):
+        """
+        :param array: Block (frames, channels)
+        :param pts: Presentation time of the first frame, None to append without adjustment
+        :return: List of arrays to write
+        """
+        chunks = []
+        if pts is not None:
+            offset = int(round((pts - self.start_time) * self.sample_rate)) - self.samples_written
+            if offset > self.tolerance:
+                chunks = self._silence_chunks(offset)
+            elif offset < -self.tolerance:
+                skip = min(-offset, len(array))
+                self.samples_dropped += skip
+                array = array[skip:]
+        if len(array):
+            chunks.append(array)
+            self.samples_written += len(array)
+        return chunks
+
+    def idle(self):
+        """
+        :return: Silence to write while no audio arrives
+        """
+        if self.clock is None:
+            return []
+        behind = self.clock.now() - self.latency - self.start_time
+        return self._silence_chunks(int(behind * self.sample_rate) - self.samples_written)
+
+    @property
+    def position(self):
+        """Time on the clock the written audio reaches"""
+        return self.start_time + self.samples_written / self.sample_rate
@@ -0,0 +1,658 @@
+import os
+import queue
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import cv2
+import numpy as np
+from frame_pool import FrameBuffer
+from master_clock import MasterClock, VideoPacer, AudioPacer
+from stats import registry, stage_timer
+from video_settings import VideoSettings
+
+# MPEG-TS, который отдаёт кодировщик: PID-ы заданы явно в командной строке
+TS_PACKET_SIZE = 188
+_PAT_PID = 0x0000
+_PMT_PID = 0x1000
+_VIDEO_PID = 0x0100
+
+
+class FrameConverter:
+    # Форматы входа кодировщика и число байт на два пикселя (у YUV 4:2:0 — 1.5 байта на пиксель)
+    PIXEL_FORMATS = {'bgr24': 6, 'yuv420p': 3, 'nv12': 3}
+
+    def __init__(self, pixel_format, width, height):
+        """
+        Convert BGR frames to the pixel format piped to the encoder.
+        Output goes into one preallocated buffer that is reused for every frame,
+        so the result is only valid until the next call.
+        :param pixel_format: 'bgr24' (no conversion), 'yuv420p' (planar I420) or 'nv12'
+        :param width: Frame width, must be even for the YUV formats
+        :param height: Frame height, must be even for the YUV formats
+        """
+        if pixel_format not in self.PIXEL_FORMATS:
+            raise ValueError(f"Unsupported pixel format: {pixel_format}")
+        self.pixel_format = pixel_format
+        self.width = width
+        self.height = height
+        self._i420 = None
+        self._nv12 = None
+        if pixel_format != 'bgr24':
+            self._i420 = np.empty((height * 3 // 2, width), dtype=np.uint8)
+        if pixel_format == 'nv12':
+            self._nv12 = np.empty((height * 3 // 2, width), dtype=np.uint8)
+
+    @property
+    def frame_bytes(self):
+        return self.width * self.height * self.PIXEL_FORMATS[self.pixel_format] // 2
+
+    def __call__(self, frame):
+        """
+        :param frame: BGR array (h, w, 3)
+        :return: Array with the frame in the target pixel format
+        """
+        if self.pixel_format == 'bgr24':
+            return frame
+        cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420, dst=self._i420)
+        if self.pixel_format == 'yuv420p':
+            return self._i420
+        # NV12: та же плоскость Y, затем U и V вперемежку
+        h, w = self.height, self.width
+        quarter = (h // 2) * (w // 2)
+        chroma = self._i420[h:].reshape(-1)
+        uv = self._nv12[h:].reshape(-1, 2)
+        self._nv12[:h] = self._i420[:h]
+        uv[:, 0] = chroma[:quarter]
+        uv[:, 1] = chroma[quarter:]
+        return self._nv12
+
+
+class PipeWriter:
+    """Writer thread that feeds queued data into one pipe or file"""
+
+    def __init__(self, name, maxsize=30, idle_timeout=None, idle_data=None, convert=None, pacer=None):
+        """
+        :param name: Name of the thread
+        :param maxsize: Queue length; put() drops data when it is full
+        :param idle_timeout: Seconds without data after which idle_data is written, None to wait forever
+        :param idle_data: Data written on idle timeout (e.g. silence)
+        :param convert: Optional callable applied to each array on the writer thread before writing
+        :param pacer: Optional VideoPacer or AudioPacer that places data by its timestamp;
+                      on idle timeout its idle() output is written instead of idle_data
+        """
+        self.name = name
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.idle_timeout = idle_timeout
+        self.idle_data = idle_data
+        self.convert = convert
+        self.pacer = pacer
+        self.thread = None
+        self.pipe = None
+        self.error = None
+        self.written = 0
+        self.dropped = 0
+        self._write_timer = stage_timer(f'write_{name}')
+        self._convert_timer = stage_timer('convert') if convert is not None else None
+
+    def start(self, open_pipe):
+        """
+        Start the writer thread
+        :param open_pipe: Callable returning a writable binary file object.
+                          Called on the writer thread, so it may block (FIFO/socket accept).
+        """
+        self.thread = threading.Thread(target=self._run, args=(open_pipe,), daemon=True,
+                                       name=f"output-{self.name}")
+        self.thread.start()
+
+    def put(self, data, pts=None):
+        """
+        Queue data without blocking the caller.
+        A FrameBuffer is retained until it has been written.
+        :param pts: Presentation time on the master clock, used by the pacer
+        :return: False if the queue was full and data was dropped
+        """
+        if isinstance(data, FrameBuffer):
+            data.retain()
+        try:
+            self.queue.put_nowait((data, pts))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            self._release(data)
+            return False
+
+    @staticmethod
+    def _release(data):
+        if isinstance(data, FrameBuffer):
+            data.release()
+
+    def stop(self, timeout=5):
+        """Ask the writer to finish and wait for it"""
+        if self.thread is None:
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+        self.thread = None
+
+    def _run(self, open_pipe):
+        try:
+            self.pipe = open_pipe()
+            while True:
+                try:
+                    item = self.queue.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    # Нет данных вовремя — заполняем паузу, чтобы ffmpeg не ждал поток
+                    if self.pacer is not None:
+                        self._write_chunks(self.pacer.idle())
+                    elif self.idle_data is not None:
+                        self._write_chunks([self.idle_data])
+                    continue
+                if item is None:
+                    break
+                data, pts = item
+                try:
+                    array = data.readonly if isinstance(data, FrameBuffer) else data
+                    chunks = [array] if self.pacer is None else self.pacer.pace(array, pts)
+                    if self.convert is not None:
+                        # Пейсер кадров отдаёт только повторы одного кадра — конвертируем его один раз
+                        started = time.perf_counter()
+                        chunks = [self.convert(chunks[0])] * len(chunks) if chunks else []
+                        self._convert_timer.record(time.perf_counter() - started)
+                        if chunks and not np.shares_memory(chunks[0], array):
+                            # Кадр сконвертирован в свой буфер — исходный можно сразу вернуть в пул.
+                            # bgr24 пишется из самого кадра: его отпускаем только после записи
+                            self._release(data)
+                            data = None
+                    self._write_chunks(chunks)
+                finally:
+                    self._release(data)
+        except (BrokenPipeError, OSError, ValueError) as e:
+            self.error = e
+        finally:
+            while not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is not None:
+                    self._release(item[0])
+            if self.pipe is not None:
+                try:
+                    self.pipe.close()
+                except OSError:
+                    pass
+
+    def _write_chunks(self, chunks):
+        for chunk in chunks:
+            # Время записи включает ожидание, пока ffmpeg или приёмник освободит канал
+            started = time.perf_counter()
+            self.pipe.write(chunk.data if isinstance(chunk, np.ndarray) and chunk.flags['C_CONTIGUOUS']
+                            else bytes(chunk))
+            self._write_timer.record(time.perf_counter() - started)
+            self.written += 1
+
+
+class Sink:
+    """Destination of the encoded MPEG-TS stream"""
+
+    def open(self):
+        """
+        Open the destination. Called on the sink's writer thread.
+        :return: Writable binary file object
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Wait for the destination to finish after its file object was closed"""
+        pass
+
+    def describe(self):
+        return type(self).__name__
+
+
+class FFmpegSink(Sink):
+    def __init__(self, target, format=None):
+        """
+        Remux the stream with ffmpeg, without re-encoding
+        :param target: Output file or URL
+        :param format: ffmpeg muxer name, None to guess from the file name
+        """
+        self.target = target
+        self.format = format
+        self.process = None
+
+    def build_command(self):
+        command = ['ffmpeg', '-y', '-f', 'mpegts', '-i', 'pipe:0', '-map', '0', '-c', 'copy']
+        if self.format in ('flv', 'mp4', 'mov') or (self.format is None and
+                                                   self.target.lower().endswith(('.mp4', '.mov', '.flv'))):
+            # ADTS-заголовки AAC из MPEG-TS не подходят этим контейнерам
+            command += ['-bsf:a', 'aac_adtstoasc']
+        if self.format:
+            command += ['-f', self.format]
+        return command + [self.target]
+
+    def open(self):
+        self.process = subprocess.Popen(
+            self.build_command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        return self.process.stdin
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.terminate()
+        self.process = None
+
+    def describe(self):
+        return self.target
+
+
+class FileSink(FFmpegSink):
+    def __init__(self, path):
+        """
+        Write the stream to a file. .ts files are written as is, other containers are remuxed.
+        :param path: Output file
+        """
+        super().__init__(path)
+
+    def open(self):
+        if self.target.lower().endswith('.ts'):
+            return open(self.target, 'wb')
+        return super().open()
+
+
+class RTMPSink(FFmpegSink):
+    def __init__(self, url):
+        """
+        Publish the stream to an RTMP server
+        :param url: Full RTMP URL including the stream key
+        """
+        super().__init__(url, format='flv')
+
+
+class TestSink(Sink):
+    """Local sink that counts what it receives, optionally saving the raw stream"""
+
+    class _Counter:
+        def __init__(self, sink, file):
+            self.sink = sink
+            self.file = file
+
+        def write(self, data):
+            self.sink.bytes_received += len(data)
+            if self.file is not None:
+                self.file.write(data)
+
+        def close(self):
+            if self.file is not None:
+                self.file.close()
+
+    def __init__(self, path=None):
+        """
+        :param path: File to save the received MPEG-TS to, None to only count bytes
+        """
+        self.path = path
+        self.bytes_received = 0
+
+    def open(self):
+        return self._Counter(self, open(self.path, 'wb') if self.path else None)
+
+
+class _SinkHandle:
+    def __init__(self, name, sink):
+        self.name = name
+        self.sink = sink
+        self.writer = PipeWriter(f"sink-{name}", maxsize=256)
+        # Новый приёмник начинает с ключевого кадра, иначе начало файла не декодируется
+        self.waiting_keyframe = True
+
+
+class OutputManager:
+    def __init__(self, video_settings=None, video_bitrate=3000, audio_bitrate=128, pixel_format='yuv420p',
+                 sample_rate=48000, channels=2, clock=None):
+        """
+        One shared encoder whose MPEG-TS output is copied to any number of sinks.
+        The encoder runs while at least one sink is attached; sinks come and go without restarting it.
+        :param video_settings: Shared VideoSettings with the output size and frame rate
+        :param video_bitrate: x264 bitrate in kbit/s
+        :param audio_bitrate: AAC bitrate in kbit/s
+        :param pixel_format: Format frames are piped in: 'yuv420p' or 'nv12' are converted
+                             on the writer thread and take half the pipe bandwidth of 'bgr24'
+        :param sample_rate: Rate of the audio passed to add_audio
+        :param channels: Channels of the audio passed to add_audio
+        :param clock: Shared MasterClock the frame and audio timestamps are on
+        """
+        if pixel_format not in FrameConverter.PIXEL_FORMATS:
+            raise ValueError(f"Unsupported pixel format: {pixel_format}")
+        self.video_settings = video_settings or VideoSettings()
+        self.clock = clock or MasterClock()
+        self.pixel_format = pixel_format
+        self.video_bitrate = video_bitrate
+        self.audio_bitrate = audio_bitrate
+        self.is_encoding = False
+        # Формат кадра фиксируется при запуске кодировщика
+        self.width, self.height = self.video_settings.output_size
+        self.fps = self.video_settings.fps
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.audio_block = 1024
+        self.video_writer = PipeWriter('video', maxsize=30)
+        self.audio_writer = PipeWriter('audio', maxsize=100)
+        self.video_pacer = None
+        self.audio_pacer = None
+        self.ffmpeg_process = None
+        self.bytes_encoded = 0
+        self.size_mismatches = 0
+        self._sinks = {}
+        self._lock = threading.Lock()
+        self._reader = None
+        self._audio_pipe_dir = None
+        self._audio_socket = None
+        registry.register('output', self.get_status)
+
+    def add_sink(self, name, sink):
+        """
+        Attach a sink, starting the encoder if it is not running.
+        The sink receives the stream from the next keyframe on.
+        :param name: Unique sink name, e.g. 'record' or 'stream'
+        :param sink: Sink instance
+        """
+        with self._lock:
+            if name in self._sinks:
+                raise ValueError(f"Sink already exists: {name}")
+            handle = _SinkHandle(name, sink)
+            if not self.is_encoding:
+                self._start_encoder()
+            handle.writer.start(sink.open)
+            self._sinks[name] = handle
+
+    def remove_sink(self, name):
+        """
+        Detach a sink and wait for it to finish; the encoder stops with the last sink
+        :param name: Sink name passed to add_sink
+        """
+        with self._lock:
+            handle = self._sinks.pop(name, None)
+            last = not self._sinks
+        if handle is None:
+            return
+        handle.writer.stop()
+        handle.sink.close()
+        if last:
+            self._stop_encoder()
+
+    def has_sink(self, name):
+        return name in self._sinks
+
+    def stop(self):
+        """Detach all sinks and stop the encoder"""
+        for name in list(self._sinks):
+            self.remove_sink(name)
+        self._stop_encoder()
+
+    def add_frame(self, frame, pts=None):
+        """
+        Queue a video frame for encoding. The frame must not be modified afterwards.
+        Frames are repeated or dropped on the writer thread so the encoder gets exactly fps frames per second.
+        :param frame: FrameBuffer (a reference is held until it is written) or numpy array (h, w, 3) in BGR
+        :param pts: Presentation time on the master clock, None for now
+        """
+        if not self.is_encoding:
+            return
+        if frame.shape[:2] != (self.height, self.width):
+            # Выходной размер сменили на ходу — кодировщик ждёт прежний
+            self.size_mismatches += 1
+            return
+        self.video_writer.put(frame, self.clock.now() if pts is None else pts)
+
+    def add_audio(self, audio_data, pts=None):
+        """
+        Queue audio for encoding. A FrameBuffer must not be modified afterwards.
+        :param audio_data: FrameBuffer (a reference is held until it is written)
+                           or numpy array (samples, channels) of float32 samples
+        :param pts: Presentation time of the first sample on the master clock,
+                    None to append it right after the previous audio
+        """
+        if not self.is_encoding:
+            return
+        if isinstance(audio_data, FrameBuffer):
+            self.audio_writer.put(audio_data, pts)
+        else:
+            self.audio_writer.put(np.ascontiguousarray(audio_data, dtype=np.float32), pts)
+
+    def _build_command(self, audio_input):
+        """Build the encoder command: raw video from stdin, audio from its own pipe, MPEG-TS to stdout"""
+        return [
+            'ffmpeg',
+            # Метки времени — по номеру кадра и сэмпла: пейсеры держат оба потока на мастер-часах
+            '-thread_queue_size', '512',
+            '-f', 'rawvideo',
+            '-pix_fmt', self.pixel_format,
+            '-s', f'{self.width}x{self.height}',
+            '-r', str(self.fps),
+            '-i', 'pipe:0',
+            '-thread_queue_size', '512',
+            '-f', 'f32le',
+            '-ar', str(self.sample_rate),
+            '-ac', str(self.channels),
+            '-i', audio_input,
+            '-map', '0:v',
+            '-map', '1:a',
+            '-c:v', 'libx264',
+            '-preset', 'veryfast',
+            '-b:v', f'{self.video_bitrate}k',
+            '-maxrate', f'{self.video_bitrate}k',
+            '-bufsize', f'{self.video_bitrate * 2}k',
+            '-pix_fmt', 'yuv420p',
+            '-g', str(self.fps * 2),
+            '-c:a', 'aac',
+            '-b:a', f'{self.audio_bitrate}k',
+            '-ar', str(self.sample_rate),
+            '-f', 'mpegts',
+            '-mpegts_pmt_start_pid', str(_PMT_PID),
+            '-mpegts_start_pid', str(_VIDEO_PID),
+            '-flush_packets', '1',
+            'pipe:1'
+        ]
+
+    def _start_encoder(self):
+        self.width, self.height = self.video_settings.output_size
+        self.fps = self.video_settings.fps
+        self.bytes_encoded = 0
+        audio_input, open_audio = self._create_audio_pipe()
+        try:
+            self.ffmpeg_process = subprocess.Popen(
+                self._build_command(audio_input),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL
+            )
+        except OSError:
+            self._close_audio_pipe()
+            raise
+        # Кадр 0 и сэмпл 0 выхода — один и тот же момент на мастер-часах
+        start_time = self.clock.now()
+        self.video_pacer = VideoPacer(self.fps, start_time)
+        self.audio_pacer = AudioPacer(self.sample_rate, self.channels, start_time, clock=self.clock)
+        self.video_writer = PipeWriter('video', maxsize=30, pacer=self.video_pacer,
+                                       convert=FrameConverter(self.pixel_format, self.width, self.height))
+        self.audio_writer = PipeWriter('audio', maxsize=100, pacer=self.audio_pacer,
+                                       idle_timeout=self.audio_block / self.sample_rate)
+        self.is_encoding = True
+        self.video_writer.start(lambda: self.ffmpeg_process.stdin)
+        self.audio_writer.start(open_audio)
+        self._reader = threading.Thread(target=self._read_worker, args=(self.ffmpeg_process.stdout,),
+                                        daemon=True, name="output-reader")
+        self._reader.start()
+
+    def _stop_encoder(self):
+        if not self.is_encoding:
+            return
+        self.is_encoding = False
+        self.video_writer.stop()
+        if self.ffmpeg_process.poll() is not None:
+            # ffmpeg уже завершился — аудиописатель может висеть на открытии канала
+            self._release_audio_pipe()
+        self.audio_writer.stop()
+        try:
+            self.ffmpeg_process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.ffmpeg_process.terminate()
+        if self._reader:
+            self._reader.join(5)
+            self._reader = None
+        self.ffmpeg_process = None
+        self._close_audio_pipe()
+
+    def _read_worker(self, stdout):
+        """Internal method that copies encoded packets to every attached sink"""
+        pending = b''
+        pat = pmt = None
+        while True:
+            try:
+                chunk = stdout.read1(64 * 1024)
+            except (OSError, ValueError):
+                break
+            if not chunk:
+                break
+            self.bytes_encoded += len(chunk)
+            data = pending + chunk
+            # Раздаём только целые пакеты TS
+            end = len(data) - len(data) % TS_PACKET_SIZE
+            data, pending = data[:end], data[end:]
+            keyframe_at = None
+            for offset in range(0, len(data), TS_PACKET_SIZE):
+                pid = ((data[offset + 1] & 0x1f) << 8) | data[offset + 2]
+                if pid == _PAT_PID:
+                    pat = data[offset:offset + TS_PACKET_SIZE]
+                elif pid == _PMT_PID:
+                    pmt = data[offset:offset + TS_PACKET_SIZE]
+                elif pid == _VIDEO_PID and keyframe_at is None and data[offset + 3] & 0x20 \
+                        and data[offset + 4] > 0 and data[offset + 5] & 0x40:
+                    # random_access_indicator: с этого пакета начинается ключевой кадр
+                    keyframe_at = offset
+            with self._lock:
+                handles = list(self._sinks.values())
+            for handle in handles:
+                if handle.waiting_keyframe:
+                    if keyframe_at is None or pat is None or pmt is None:
+                        continue
+                    handle.waiting_keyframe = False
+                    sent = handle.writer.put(pat + pmt + data[keyframe_at:])
+                else:
+                    sent = handle.writer.put(data)
+                if not sent:
+                    # После потери куска поток не декодируется до следующего ключевого кадра:
+                    # приёмник заново ждёт его и получает PAT/PMT, как при позднем подключении
+                    handle.waiting_keyframe = True
+        stdout.close()
+
+    def _create_audio_pipe(self):
+        """
+        Create a dedicated pipe for the audio stream
+        :return: (ffmpeg input url, callable opening the writer end)
+        """
+        if hasattr(os, 'mkfifo'):
+            self._audio_pipe_dir = tempfile.mkdtemp(prefix='rtp_output_')
+            path = os.path.join(self._audio_pipe_dir, 'audio.f32le')
+            os.mkfifo(path)
+            return path, lambda: open(path, 'wb')
+        # Windows: FIFO нет, используем локальный TCP-сокет
+        self._audio_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._audio_socket.bind(('127.0.0.1', 0))
+        self._audio_socket.listen(1)
+        port = self._audio_socket.getsockname()[1]
+
+        def open_socket():
+            conn, _ = self._audio_socket.accept()
+            return conn.makefile('wb')
+        return f'tcp://127.0.0.1:{port}', open_socket
+
+    def _release_audio_pipe(self):
+        """Unblock an audio writer waiting for ffmpeg to open its end of the pipe"""
+        if self._audio_socket is not None:
+            self._audio_socket.close()
+            self._audio_socket = None
+        elif self._audio_pipe_dir is not None:
+            path = os.path.join(self._audio_pipe_dir, 'audio.f32le')
+            try:
+                os.close(os.open(path, os.O_RDONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+
+    def _close_audio_pipe(self):
+        if self._audio_socket is not None:
+            self._audio_socket.close()
+            self._audio_socket = None
+        if self._audio_pipe_dir is not None:
+            path = os.path.join(self._audio_pipe_dir, 'audio.f32le')
+            if os.path.exists(path):
+                os.unlink(path)
+            os.rmdir(self._audio_pipe_dir)
+            self._audio_pipe_dir = None
+
+    def get_sink_status(self, name):
+        """
+        Get the status of one sink
+        :return: Dictionary with sink information, None if there is no such sink
+        """
+        handle = self._sinks.get(name)
+        if handle is None:
+            return None
+        return {
+            'target': handle.sink.describe(),
+            'started': not handle.waiting_keyframe,
+            'queue_size': handle.writer.queue.qsize(),
+            'dropped_chunks': handle.writer.dropped,
+            'error': str(handle.writer.error) if handle.writer.error else None
+        }
+
+    def get_status(self):
+        """
+        Get the status of the encoder and all sinks
+        :return: Dictionary containing output status information
+        """
+        return {
+            'is_encoding': self.is_encoding,
+            'queue_size': self.video_writer.queue.qsize(),
+            'audio_queue_size': self.audio_writer.queue.qsize(),
+            'dropped_frames': self.video_writer.dropped + self.size_mismatches,
+            # Отдельно: кадры, не влезшие в очередь кодировщика, и кадры не того размера
+            'queue_dropped_frames': self.video_writer.dropped,
+            'queue_dropped_audio': self.audio_writer.dropped,
+            'size_mismatches': self.size_mismatches,
+            'bytes_encoded': self.bytes_encoded,
+            'error': str(self.video_writer.error or self.audio_writer.error or '') or None,
+            'sinks': {name: self.get_sink_status(name) for name in list(self._sinks)},
+            'clock': self.get_clock_status()
+        }
+
+    def get_clock_status(self):
+        """
+        Get the timing counters of the running encoder
+        :return: Dictionary with frames repeated and dropped to hold the frame rate,
+                 audio gaps filled and trimmed, and how far the streams are apart
+        """
+        video, audio = self.video_pacer, self.audio_pacer
+        if video is None or audio is None:
+            return None
+        now = self.clock.now()
+        return {
+            'frames_written': video.frames_written,
+            'frames_duplicated': video.duplicated,
+            'frames_dropped': video.dropped,
+            'audio_silence_ms': audio.silence_inserted * 1000.0 / audio.sample_rate,
+            'audio_dropped_ms': audio.samples_dropped * 1000.0 / audio.sample_rate,
+            # Положительное — видео записано дальше звука
+            'av_offset_ms': (video.position - audio.position) * 1000.0,
+            'video_latency_ms': (now - video.position) * 1000.0,
+            'audio_latency_ms': (now - audio.position) * 1000.0
+        }
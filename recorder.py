@@ -0,0 +1,58 @@
+from output_manager import OutputManager, FileSink
+
+
+class Recorder:
+    SINK_NAME = 'record'
+
+    def __init__(self, video_settings=None, output_manager=None):
+        """
+        :param video_settings: Shared VideoSettings, used when no output manager is given
+        :param output_manager: Shared OutputManager; recording reuses its encoder
+        """
+        self.output_manager = output_manager or OutputManager(video_settings)
+        self.is_recording = False
+        self.record_file = None
+
+    def start_recording(self, filename):
+        """
+        Start writing the encoded output to a file, from the next keyframe on
+        :param filename: Output file (mp4, mkv, ts, ...)
+        """
+        if self.is_recording:
+            return
+        self.record_file = filename
+        self.output_manager.add_sink(self.SINK_NAME, FileSink(filename))
+        self.is_recording = True
+
+    def stop_recording(self):
+        """Finish the file; the encoder keeps running for other outputs"""
+        if not self.is_recording:
+            return
+        self.is_recording = False
+        self.output_manager.remove_sink(self.SINK_NAME)
+
+    def add_frame(self, frame, pts=None):
+        """
+        Add a video frame to the shared encoder. The frame must not be modified afterwards.
+        With a shared output manager register only one of its feeders as a render output.
+        :param frame: FrameBuffer (a reference is held until it is written) or numpy array (h, w, 3) in BGR
+        :param pts: Presentation time on the master clock, None for now
+        """
+        self.output_manager.add_frame(frame, pts)
+
+    def get_record_status(self):
+        """
+        Get current recording status
+        :return: Dictionary containing recording status information
+        """
+        status = self.output_manager.get_status()
+        sink = status['sinks'].get(self.SINK_NAME) or {}
+        return {
+            'is_recording': self.is_recording,
+            'queue_size': status['queue_size'],
+            'dropped_frames': status['dropped_frames'],
+            'error': sink.get('error') or status['error'],
+            'record_file': self.record_file,
+            # Повторённые и опоздавшие кадры, смещение звука — общие для всех выходов
+            'clock': status['clock']
+        }
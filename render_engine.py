@@ -0,0 +1,269 @@
+import math
+import threading
+import time
+import cv2
+from frame_pool import FramePool, FrameSlot
+from master_clock import MasterClock
+from stats import registry, stage_timer
+from transitions import create_transition
+
+_render_timer = stage_timer('render')
+_transition_timer = stage_timer('transition')
+_scale_timer = stage_timer('scale_output')
+_preview_timer = stage_timer('preview_scale')
+
+
+class RenderEngine:
+    def __init__(self, scene_manager, video_settings=None, clock=None):
+        """
+        Render thread that composes the active scene at a fixed rate
+        and scales it once from the canvas to the output size
+        :param scene_manager: SceneManager with the scenes to render
+        :param video_settings: Shared VideoSettings, defaults to the scene manager's
+        :param clock: Shared MasterClock; frames are rendered for slots on its fps grid
+        """
+        self.scene_manager = scene_manager
+        self.video_settings = video_settings or scene_manager.video_settings
+        self.clock = clock or MasterClock()
+        self.is_running = False
+        self.frame_count = 0
+        self.late_frames = 0  # Кадры, на которые не хватило времени (их слоты пропущены)
+        self.program = FrameSlot()
+        self.preview = FrameSlot()
+        self.preview_size = None  # (w, h) области предпросмотра
+        self.canvas_size = None  # (w, h) холста последнего кадра
+        self._output_pool = None
+        self._preview_pool = None
+        self._transition = None  # (Transition, id сцены, с которой уходим, время начала)
+        # Смена сцены и начало перехода видны потоку рендера только вместе
+        self._switch_lock = threading.Lock()
+        self._transition_pool = None
+        self._outputs = []
+        self._thread = None
+        self._stop_event = threading.Event()
+        registry.register('render', self.get_stats)
+
+    @property
+    def fps(self):
+        return self.video_settings.fps
+
+    def add_output(self, callback):
+        """
+        Register a consumer of program frames. Called on the render thread, must not block.
+        :param callback: Callable taking (FrameBuffer, pts in seconds on the master clock); it must
+                         retain() the buffer to keep it past the call and release() it when done,
+                         and must not modify it
+        """
+        if callback not in self._outputs:
+            self._outputs = self._outputs + [callback]
+
+    def remove_output(self, callback):
+        """
+        Unregister a consumer of program frames
+        :param callback: Callable passed to add_output
+        """
+        self._outputs = [cb for cb in self._outputs if cb != callback]
+
+    def start(self):
+        """Start the render thread"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._render_loop, daemon=True, name="render-engine")
+        self._thread.start()
+
+    def stop(self):
+        """Stop the render thread"""
+        self.is_running = False
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def transition_to(self, scene_id, transition='fade', duration_ms=500):
+        """
+        Make a scene active, blending to it from the current one on the render thread.
+        Returns immediately; program frames keep flowing at self.fps during the transition.
+        :param scene_id: ID of the scene to switch to
+        :param transition: Transition name ('cut', 'fade', 'slide', 'wipe') or Transition instance
+        :param duration_ms: Transition length in milliseconds, ignored for an instance
+        """
+        if isinstance(transition, str):
+            transition = create_transition(transition, duration_ms)
+        with self._switch_lock:
+            current = self.scene_manager.current_scene
+            if current is None or current.id == scene_id or transition.name == 'cut':
+                self._transition = None
+            else:
+                self._transition = (transition, current.id, self.clock.now())
+            self.scene_manager.set_active_scene(scene_id)
+
+    @property
+    def in_transition(self):
+        return self._transition is not None
+
+    def get_stats(self):
+        """
+        Get the render counters
+        :return: Dictionary with frames rendered and frames skipped for being late
+        """
+        return {
+            'fps': self.fps,
+            'frames': self.frame_count,
+            'late_frames': self.late_frames,
+            'in_transition': self.in_transition
+        }
+
+    def set_preview_size(self, width, height):
+        """
+        Set the size of the preview output; frames are fitted into it keeping aspect ratio
+        :param width: Preview area width in pixels
+        :param height: Preview area height in pixels
+        """
+        self.preview_size = (width, height) if width > 0 and height > 0 else None
+
+    def acquire_preview_frame(self):
+        """
+        Take a reference to the newest preview frame, already sized for the preview area
+        :return: Tuple of (sequence number, FrameBuffer or None); the caller must release() it
+        """
+        return self.preview.acquire()
+
+    def acquire_program_frame(self):
+        """
+        Take a reference to the newest program frame, at the output size
+        :return: Tuple of (sequence number, FrameBuffer or None); the caller must release() it
+        """
+        return self.program.acquire()
+
+    def render_frame(self, pts=None):
+        """
+        Compose the active scene once and hand the frame to all outputs
+        :param pts: Presentation time of the frame on the master clock, None for now
+        :return: True if a frame was produced
+        """
+        if pts is None:
+            pts = self.clock.now()
+        started = time.perf_counter()
+        with self._switch_lock:
+            scene = self.scene_manager.current_scene
+            transition = self._transition
+        if scene is None:
+            return False
+        try:
+            buf = self.scene_manager.render_scene(scene.id)
+        except ValueError:
+            # Сцену удалили, пока мы рисовали
+            return False
+        if transition is not None:
+            buf = self._render_transition(buf, transition, pts)
+        self.canvas_size = (buf.shape[1], buf.shape[0])
+        out = self._scale_output(buf)
+        # Все потребители получают один и тот же буфер, без копий
+        self.program.publish(out.retain())
+        for output in self._outputs:
+            try:
+                output(out, pts)
+            except Exception as e:
+                print(f"Output error: {str(e)}")
+        # Предпросмотр уменьшаем из меньшего из двух кадров
+        self._render_preview(out if out.shape[0] <= buf.shape[0] else buf)
+        out.release()
+        buf.release()
+        self.frame_count += 1
+        _render_timer.record(time.perf_counter() - started)
+        return True
+
+    def _render_transition(self, to_buf, state, pts):
+        """
+        Blend the scene being left into the new one. Both scenes keep their own compositors,
+        so their cached layers are reused and only changed regions are redrawn.
+        :param to_buf: Frame of the active scene, released here if it is replaced
+        :param state: Value of self._transition this frame is rendered for
+        :param pts: Presentation time of the frame; progress follows it, not the render time
+        :return: Frame to output
+        """
+        transition, from_id, started = state
+        progress = (pts - started) * 1000.0 / transition.duration_ms
+        from_buf = None
+        if progress < 1.0:
+            try:
+                from_buf = self.scene_manager.render_scene(from_id)
+            except ValueError:
+                # Сцену, с которой уходим, удалили
+                pass
+        if from_buf is None or from_buf.shape != to_buf.shape:
+            if from_buf is not None:
+                from_buf.release()
+            # GUI мог уже начать следующий переход — не затираем его
+            with self._switch_lock:
+                if self._transition is state:
+                    self._transition = None
+            return to_buf
+        if self._transition_pool is None or self._transition_pool.shape != to_buf.shape:
+            self._transition_pool = FramePool(to_buf.shape, max_free=3)
+        out = self._transition_pool.acquire()
+        started = time.perf_counter()
+        transition.render(from_buf.array, to_buf.array, max(0.0, progress), out.array)
+        _transition_timer.record(time.perf_counter() - started)
+        from_buf.release()
+        to_buf.release()
+        return out
+
+    def _scale_output(self, buf):
+        """
+        Scale a canvas frame to the output size
+        :return: FrameBuffer with one reference owned by the caller (buf itself if no scaling is needed)
+        """
+        (w, h), interpolation = self.scene_manager.output_format()
+        if (buf.shape[1], buf.shape[0]) == (w, h):
+            return buf.retain()
+        shape = (h, w) + buf.shape[2:]
+        if self._output_pool is None or self._output_pool.shape != shape:
+            self._output_pool = FramePool(shape, max_free=6)
+        out = self._output_pool.acquire()
+        started = time.perf_counter()
+        cv2.resize(buf.array, (w, h), dst=out.array, interpolation=interpolation)
+        _scale_timer.record(time.perf_counter() - started)
+        return out
+
+    def _render_preview(self, buf):
+        """Downscale the program frame once for the preview widget"""
+        h, w = buf.shape[:2]
+        if self.preview_size is None:
+            self.preview.publish(buf.retain())
+            return
+        pw, ph = self.preview_size
+        scale = min(pw / w, ph / h, 1.0)
+        size = (max(1, int(w * scale)), max(1, int(h * scale)))
+        if size == (w, h):
+            self.preview.publish(buf.retain())
+            return
+        shape = (size[1], size[0]) + buf.shape[2:]
+        if self._preview_pool is None or self._preview_pool.shape != shape:
+            self._preview_pool = FramePool(shape, max_free=3)
+        preview = self._preview_pool.acquire()
+        started = time.perf_counter()
+        cv2.resize(buf.array, size, dst=preview.array, interpolation=cv2.INTER_AREA)
+        _preview_timer.record(time.perf_counter() - started)
+        self.preview.publish(preview)
+
+    def _render_loop(self):
+        """Internal method that renders one frame per slot of the fps grid on the master clock"""
+        next_time = self.clock.now()
+        while not self._stop_event.is_set():
+            try:
+                self.render_frame(next_time)
+            except Exception as e:
+                print(f"Render error: {str(e)}")
+            period = 1.0 / self.fps
+            next_time += period
+            lag = self.clock.now() - next_time
+            if lag > 0:
+                # Не успели — пропускаем слоты, а не сдвигаем сетку: выход повторит кадр
+                skipped = math.ceil(lag / period)
+                self.late_frames += skipped
+                next_time += skipped * period
+            if self.clock.wait_until(next_time, self._stop_event):
+                break
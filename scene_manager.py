@@ -2,11 +2,21 @@ from dataclasses import dataclass
 from typing import List, Dict, Any
 import cv2
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
-from screen_capture import ScreenCapture
+from frame_cache import FrameCache
+from compositor import Compositor, Layer, to_layer_frame
+from frame_pool import FrameBuffer
 import json
 import os
-import imageio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sources import SOURCE_PROVIDERS, load_provider
+from video_settings import VideoSettings
+from stats import stage_timer
+
+_resize_timer = stage_timer('source_resize')
+_sources_timer = stage_timer('sources')
+_compose_timer = stage_timer('compose')
 
 @dataclass
 class Source:
@@ -16,8 +26,13 @@ class Source:
     properties: Dict[str, Any]
     visible: bool = True
     position: tuple = (0, 0)
-    size: tuple = (1920, 1080)
-    capture: ScreenCapture = None  # Новый атрибут для захвата
+    size: tuple = None  # (w, h) на холсте; SceneManager задаёт размер холста из VideoSettings
+    opacity: float = 1.0  # Прозрачность источника, 0..1
+    capture: Any = None  # ScreenCapture источников screen/window
+    decoder: Any = None  # Фоновый VideoDecoder для видео
+    frame_seq: int = 0  # Номер последнего кадра захвата
+    resized_frame: tuple = None  # (номер кадра, буфер масштабированного кадра)
+    held_frame: FrameBuffer = None  # Ссылка на текущий кадр захвата из пула
     last_frame: np.ndarray = None  # Кэш последнего удачного кадра
 
 @dataclass
@@ -28,21 +43,62 @@ class Scene:
     active: bool = False
 
 class SceneManager:
-    def __init__(self):
+    def __init__(self, workers: int = 0, video_settings: VideoSettings = None,
+                 config_path: str = 'config.json'):
+        """
+        :param workers: Number of threads that prepare source frames in parallel, 0 for serial
+        :param video_settings: Shared video settings; loaded from the config if it has them
+        :param config_path: Scene collection file, None to start empty and never save
+        """
+        self.video_settings = video_settings or VideoSettings()
         self.scenes: List[Scene] = []
         self.current_scene: Scene = None
-        self.source_types = {
-            'image': self._create_image_source,
-            'video': self._create_video_source,
-            'browser': self._create_browser_source,
-            'camera': self._create_camera_source,
-            'screen': self._create_screen_source,
-            'window': self._create_window_source
-        }
-        self.config_path = 'config.json'
+        # Тип источника -> модуль-провайдер, загружается при первом источнике этого типа
+        self.source_types = dict(SOURCE_PROVIDERS)
+        # Декодированные и уже масштабированные кадры изображений, общий для всех сцен
+        self.image_cache = FrameCache(max_bytes=256 * 1024 * 1024)
+        self.compositors: Dict[str, Compositor] = {}
+        self.workers = 0
+        self._layer_pool = None
+        # Композиторы не потокобезопасны: рендер-поток и GUI рисуют по очереди.
+        # Под этой же блокировкой меняются сцены и источники — рендер не увидит их наполовину
+        self._render_lock = threading.RLock()
+        self.set_workers(workers)
+        self.config_path = config_path
         self.load_config()
 
+    def set_workers(self, workers: int):
+        """
+        Set the number of threads preparing source frames
+        :param workers: Thread count, 0 or 1 for the serial path
+        """
+        if self._layer_pool is not None:
+            self._layer_pool.shutdown(wait=True)
+            self._layer_pool = None
+        self.workers = workers
+        if workers > 1:
+            self._layer_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='compositor')
+
+    def update_video_settings(self, **values):
+        """
+        Change the shared video settings between two rendered frames
+        :param values: VideoSettings field values
+        """
+        # Рендер-поток не должен увидеть ширину от нового размера, а высоту от старого
+        with self._render_lock:
+            self.video_settings.update(**values)
+
+    def output_format(self) -> tuple:
+        """
+        Read the output size and scale filter as one consistent pair
+        :return: Tuple of ((width, height), OpenCV interpolation flag)
+        """
+        with self._render_lock:
+            return self.video_settings.output_size, self.video_settings.interpolation
+
     def save_config(self):
+        if not self.config_path:
+            return
         data = {
             'scenes': [
                 {
@@ -57,22 +113,31 @@ class SceneManager:
                             'properties': src.properties,
                             'visible': src.visible,
                             'position': src.position,
-                            'size': src.size
+                            'size': src.size,
+                            'opacity': src.opacity
                         } for src in s.sources
                     ]
                 } for s in self.scenes
             ],
-            'current_scene_id': self.current_scene.id if self.current_scene else None
+            'current_scene_id': self.current_scene.id if self.current_scene else None,
+            'video': self.video_settings.to_dict()
         }
         with open(self.config_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
 
     def load_config(self):
-        if not os.path.exists(self.config_path):
+        if not self.config_path or not os.path.exists(self.config_path):
             return
         with open(self.config_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
-        self.scenes = []
+        if 'video' in data:
+            try:
+                self.update_video_settings(**data['video'])
+            except (TypeError, ValueError) as e:
+                print(f"Invalid video settings in config: {str(e)}")
+        # Новые сцены собираем и запускаем в стороне, подменяем одним шагом под блокировкой
+        scenes = []
+        current_scene = None
         for s in data.get('scenes', []):
             scene = Scene(
                 id=s['id'],
@@ -81,28 +146,33 @@ class SceneManager:
                 active=s.get('active', False)
             )
             for src in s['sources']:
-                source = self.source_types[src['type']](src['name'], src['properties'])
+                source = self._create_source(src['type'], src['name'], src['properties'])
                 source.id = src['id']
                 source.visible = src.get('visible', True)
                 source.position = tuple(src.get('position', (0, 0)))
-                source.size = tuple(src.get('size', (1920, 1080)))
-                # Для screen/window сразу запускаем захват
-                if src['type'] == 'screen':
-                    source.capture = ScreenCapture()
-                    source.capture.start_capture(region=None)
-                elif src['type'] == 'window':
-                    source.capture = ScreenCapture()
-                    source.capture.start_capture(window_title=src['properties'].get('window_title'))
+                source.size = tuple(src.get('size', self.video_settings.base_size))
+                source.opacity = float(src.get('opacity', 1.0))
+                # Запускаем источник: для screen/window — сразу захват
+                self._start_source(source)
                 scene.sources.append(source)
-            self.scenes.append(scene)
+            scenes.append(scene)
         # Восстановить активную сцену
         cur_id = data.get('current_scene_id')
-        for s in self.scenes:
+        for s in scenes:
             if s.id == cur_id:
-                self.current_scene = s
+                current_scene = s
                 s.active = True
             else:
                 s.active = False
+        with self._render_lock:
+            old_scenes = self.scenes
+            self.scenes = scenes
+            self.compositors = {}
+            self.current_scene = current_scene
+        # Старые источники рендер уже не видит — останавливаем их захват и декодеры
+        for scene in old_scenes:
+            for source in scene.sources:
+                self._stop_source(source)
 
     def create_scene(self, name: str) -> Scene:
         """
@@ -110,12 +180,13 @@ class SceneManager:
         :param name: Scene name
         :return: Created scene
         """
-        scene = Scene(
-            id=f"scene_{len(self.scenes)}",
-            name=name,
-            sources=[]
-        )
-        self.scenes.append(scene)
+        with self._render_lock:
+            scene = Scene(
+                id=f"scene_{len(self.scenes)}",
+                name=name,
+                sources=[]
+            )
+            self.scenes = self.scenes + [scene]
         return scene
 
     def delete_scene(self, scene_id: str):
@@ -123,21 +194,28 @@ class SceneManager:
         Delete a scene
         :param scene_id: ID of the scene to delete
         """
-        self.scenes = [s for s in self.scenes if s.id != scene_id]
-        if self.current_scene and self.current_scene.id == scene_id:
-            self.current_scene = None
+        with self._render_lock:
+            removed = [s for s in self.scenes if s.id == scene_id]
+            self.scenes = [s for s in self.scenes if s.id != scene_id]
+            self.compositors.pop(scene_id, None)
+            if self.current_scene and self.current_scene.id == scene_id:
+                self.current_scene = None
+        for scene in removed:
+            for source in scene.sources:
+                self._stop_source(source)
 
     def set_active_scene(self, scene_id: str):
         """
         Set the active scene
         :param scene_id: ID of the scene to activate
         """
-        for scene in self.scenes:
-            if scene.id == scene_id:
-                scene.active = True
-                self.current_scene = scene
-            else:
-                scene.active = False
+        with self._render_lock:
+            for scene in self.scenes:
+                if scene.id == scene_id:
+                    scene.active = True
+                    self.current_scene = scene
+                else:
+                    scene.active = False
 
     def add_source(self, scene_id: str, source_type: str, name: str, properties: Dict[str, Any]) -> Source:
         """
@@ -151,91 +229,150 @@ class SceneManager:
         if source_type not in self.source_types:
             raise ValueError(f"Unknown source type: {source_type}")
 
-        source = self.source_types[source_type](name, properties)
+        source = self._create_source(source_type, name, properties)
         
-        # Для screen/window создаём и запускаем захват
-        if source_type == 'screen':
-            source.capture = ScreenCapture()
-            source.capture.start_capture(region=None)
-        elif source_type == 'window':
-            source.capture = ScreenCapture()
-            source.capture.start_capture(window_title=properties.get('window_title'))
-        
-        for scene in self.scenes:
-            if scene.id == scene_id:
-                scene.sources.append(source)
-                return source
+        # Запускаем источник: для screen/window создаём и запускаем захват
+        self._start_source(source)
         
+        with self._render_lock:
+            for scene in self.scenes:
+                if scene.id == scene_id:
+                    scene.sources = scene.sources + [source]
+                    return source
+        self._stop_source(source)
         raise ValueError(f"Scene not found: {scene_id}")
 
+    def _provider(self, source_type: str):
+        """Provider module of a source type, imported on first use"""
+        return load_provider(self.source_types[source_type])
+
+    def _start_source(self, source: Source):
+        """
+        Start what a source needs to produce frames, e.g. the capture of screen/window sources.
+        See sources.capture for the screen/window properties.
+        :param source: Source to start
+        """
+        self._provider(source.type).start(self, source)
+
+    def _stop_source(self, source: Source):
+        """
+        Stop the capture or decoder of a source and return its pooled frame.
+        Call only after the source was taken out of its scene under the render lock.
+        :param source: Source to stop
+        """
+        self._provider(source.type).stop(source)
+        if source.held_frame:
+            source.held_frame.release()
+            source.held_frame = None
+
     def remove_source(self, scene_id: str, source_id: str):
         """
         Remove a source from a scene
         :param scene_id: ID of the scene to remove the source from
         :param source_id: ID of the source to remove
         """
-        for scene in self.scenes:
-            if scene.id == scene_id:
-                # Остановить захват, если есть
-                for s in scene.sources:
-                    if s.id == source_id and s.capture:
-                        s.capture.stop_capture()
-                scene.sources = [s for s in scene.sources if s.id != source_id]
-                return
-        raise ValueError(f"Scene not found: {scene_id}")
+        with self._render_lock:
+            for scene in self.scenes:
+                if scene.id == scene_id:
+                    removed = [s for s in scene.sources if s.id == source_id]
+                    scene.sources = [s for s in scene.sources if s.id != source_id]
+                    break
+            else:
+                raise ValueError(f"Scene not found: {scene_id}")
+        # Остановить захват, если есть: рендер этот источник больше не увидит
+        for source in removed:
+            self._stop_source(source)
 
-    def _create_image_source(self, name: str, properties: Dict[str, Any]) -> Source:
-        """Create an image source"""
-        return Source(
-            id=f"image_{name}",
-            name=name,
-            type='image',
-            properties=properties
-        )
+    def move_source(self, scene_id: str, index: int, offset: int):
+        """
+        Move a source up or down the layer order
+        :param scene_id: ID of the scene
+        :param index: Current position of the source in scene.sources
+        :param offset: -1 to move it down a layer (drawn earlier), 1 to move it up
+        """
+        with self._render_lock:
+            for scene in self.scenes:
+                if scene.id == scene_id:
+                    target = index + offset
+                    if 0 <= index < len(scene.sources) and 0 <= target < len(scene.sources):
+                        sources = list(scene.sources)
+                        sources[index], sources[target] = sources[target], sources[index]
+                        scene.sources = sources
+                    return
+        raise ValueError(f"Scene not found: {scene_id}")
 
-    def _create_video_source(self, name: str, properties: Dict[str, Any]) -> Source:
-        """Create a video source"""
+    def _create_source(self, source_type: str, name: str, properties: Dict[str, Any]) -> Source:
+        """Create a source of any registered type; nothing is started yet"""
+        # По умолчанию источник занимает весь холст
         return Source(
-            id=f"video_{name}",
+            id=f"{source_type}_{name}",
             name=name,
-            type='video',
-            properties=properties
+            type=source_type,
+            properties=properties,
+            size=self.video_settings.base_size
         )
 
-    def _create_browser_source(self, name: str, properties: Dict[str, Any]) -> Source:
-        """Create a browser source"""
-        return Source(
-            id=f"browser_{name}",
-            name=name,
-            type='browser',
-            properties=properties
-        )
+    @staticmethod
+    def _fit_size(src_w: int, src_h: int, dst_w: int, dst_h: int) -> tuple:
+        """Size of a src_w x src_h frame scaled to fit into dst_w x dst_h keeping aspect ratio"""
+        scale = min(dst_w / src_w, dst_h / src_h)
+        return int(src_w * scale), int(src_h * scale)
 
-    def _create_camera_source(self, name: str, properties: Dict[str, Any]) -> Source:
-        """Create a camera source"""
-        return Source(
-            id=f"camera_{name}",
-            name=name,
-            type='camera',
-            properties=properties
-        )
+    def _get_source_frame(self, source: Source) -> np.ndarray:
+        """
+        Get the current frame of a source. source.frame_seq changes whenever the frame does.
+        :param source: Source to read
+        :return: numpy array or None if the source has no frame yet
+        """
+        return self._provider(source.type).get_frame(self, source)
 
-    def _create_screen_source(self, name: str, properties: Dict[str, Any]) -> Source:
-        """Create a screen capture source"""
-        return Source(
-            id=f"screen_{name}",
-            name=name,
-            type='screen',
-            properties=properties
-        )
+    def _get_stub_frame(self, key: tuple, size: tuple, color: tuple, text: str) -> np.ndarray:
+        """Draw (once) a solid frame with a caption"""
+        frame = self.image_cache.get(key)
+        if frame is None:
+            from PIL import Image, ImageDraw
+            w, h = size
+            img = Image.new('RGB', (w, h), color)
+            draw = ImageDraw.Draw(img)
+            draw.text((10, h//2-10), text, fill=(200,200,200))
+            frame = to_layer_frame(np.array(img))
+            self.image_cache.put(key, frame)
+        return frame
 
-    def _create_window_source(self, name: str, properties: Dict[str, Any]) -> Source:
-        return Source(
-            id=f"window_{name}",
-            name=name,
-            type='window',
-            properties=properties
-        )
+    def _get_source_layer(self, source: Source) -> Layer:
+        """
+        Build the compositor layer of a source: its frame fitted into source.size
+        :param source: Visible source
+        :return: Layer or None if there is nothing to draw
+        """
+        frame = self._get_source_frame(source)
+        dst_w, dst_h = int(source.size[0]), int(source.size[1])
+        x, y = int(source.position[0]), int(source.position[1])
+        if dst_w <= 0 or dst_h <= 0:
+            return None
+        if frame is None:
+            # Если нет ни одного кадра — рисуем заглушку
+            frame = self._get_stub_frame(('unavailable', dst_w, dst_h), (dst_w, dst_h),
+                                         (30, 30, 30), 'Источник недоступен')
+            return Layer(key=id(source), frame=frame, x=x, y=y, opacity=source.opacity)
+        version = source.frame_seq
+        src_h, src_w = frame.shape[:2]
+        new_w, new_h = self._fit_size(src_w, src_h, dst_w, dst_h)
+        if new_w <= 0 or new_h <= 0:
+            return None
+        if (new_w, new_h) != (src_w, src_h):
+            # Масштабируем в постоянный буфер источника и только если кадр сменился
+            cached = source.resized_frame
+            if cached is None or cached[1].shape != (new_h, new_w) + frame.shape[2:]:
+                cached = source.resized_frame = (None, np.empty((new_h, new_w) + frame.shape[2:], dtype=frame.dtype))
+            if cached[0] != version:
+                started = time.perf_counter()
+                cv2.resize(frame, (new_w, new_h), dst=cached[1], interpolation=cv2.INTER_AREA)
+                _resize_timer.record(time.perf_counter() - started)
+                source.resized_frame = (version, cached[1])
+            frame = cached[1]
+        return Layer(key=id(source), frame=frame, version=version, opacity=source.opacity,
+                     x=x + (dst_w - new_w) // 2, y=y + (dst_h - new_h) // 2)
 
     def get_scene_preview(self, scene_id: str) -> np.ndarray:
         """
@@ -243,87 +380,40 @@ class SceneManager:
         :param scene_id: ID of the scene to preview
         :return: numpy array containing the preview image
         """
+        buf = self.render_scene(scene_id)
+        preview = buf.array.copy()
+        buf.release()
+        return preview
+
+    def render_scene(self, scene_id: str) -> FrameBuffer:
+        """
+        Render a scene into a pooled frame without copying
+        :param scene_id: ID of the scene to render
+        :return: FrameBuffer with one reference owned by the caller (must be released)
+        """
+        with self._render_lock:
+            return self._render_scene(scene_id)
+
+    def _render_scene(self, scene_id: str) -> FrameBuffer:
         for scene in self.scenes:
             if scene.id == scene_id:
-                preview_w, preview_h = 1920, 1080
-                preview = np.zeros((preview_h, preview_w, 3), dtype=np.uint8)
-                if not scene.sources:
-                    return preview  # Нет источников — чёрный экран
-                for source in scene.sources:
-                    if not source.visible:
-                        continue
-                    frame = None
-                    if source.type in ('screen', 'window') and source.capture:
-                        frame = source.capture.get_frame()
-                        if frame is not None:
-                            source.last_frame = frame.copy()
-                        else:
-                            frame = source.last_frame
-                    elif source.type == 'image':
-                        try:
-                            img = Image.open(source.properties['file']).convert('RGB')
-                            frame = np.array(img)
-                            source.last_frame = frame.copy()
-                        except Exception:
-                            frame = source.last_frame
-                    elif source.type == 'video':
-                        try:
-                            if not hasattr(source, 'video_reader'):
-                                source.video_reader = imageio.get_reader(source.properties['file'])
-                                source.video_frame = 0
-                            # Читаем следующий кадр
-                            try:
-                                frame = source.video_reader.get_data(source.video_frame)
-                                source.last_frame = frame.copy()
-                                source.video_frame += 1
-                            except IndexError:
-                                source.video_frame = 0
-                                frame = source.video_reader.get_data(0)
-                                source.last_frame = frame.copy()
-                        except Exception:
-                            frame = source.last_frame
-                    elif source.type == 'browser':
-                        # Заглушка для браузера
-                        w, h = source.size
-                        img = Image.new('RGB', (w, h), (40, 40, 60))
-                        draw = ImageDraw.Draw(img)
-                        url = source.properties.get('url', 'browser')
-                        draw.text((10, h//2-10), f'Browser: {url}', fill=(200,200,200))
-                        frame = np.array(img)
-                        source.last_frame = frame.copy()
-                    # --- Вставка кадра ---
-                    if frame is not None:
-                        src_h, src_w = frame.shape[:2]
-                        dst_w, dst_h = source.size
-                        scale = min(dst_w / src_w, dst_h / src_h)
-                        new_w = int(src_w * scale)
-                        new_h = int(src_h * scale)
-                        frame_resized = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_AREA)
-                        x, y = source.position
-                        ph, pw = preview.shape[:2]
-                        offset_x = x + (dst_w - new_w) // 2
-                        offset_y = y + (dst_h - new_h) // 2
-                        if offset_y + new_h > ph:
-                            new_h = ph - offset_y
-                        if offset_x + new_w > pw:
-                            new_w = pw - offset_x
-                        if new_h > 0 and new_w > 0:
-                            preview[offset_y:offset_y+new_h, offset_x:offset_x+new_w] = frame_resized[:new_h, :new_w]
-                    else:
-                        # Если нет ни одного кадра — рисуем заглушку
-                        dst_w, dst_h = source.size
-                        x, y = source.position
-                        ph, pw = preview.shape[:2]
-                        if y + dst_h > ph:
-                            dst_h = ph - y
-                        if x + dst_w > pw:
-                            dst_w = pw - x
-                        if dst_h > 0 and dst_w > 0:
-                            img = Image.new('RGB', (dst_w, dst_h), (30, 30, 30))
-                            draw = ImageDraw.Draw(img)
-                            text = 'Источник недоступен'
-                            draw.text((10, dst_h//2-10), text, fill=(200,200,200))
-                            preview[y:y+dst_h, x:x+dst_w] = np.array(img)
-                return preview
-        
-        raise ValueError(f"Scene not found: {scene_id}") 
\ No newline at end of file
+                compositor = self.compositors.get(scene.id)
+                width, height = self.video_settings.base_size
+                if compositor is None or (compositor.width, compositor.height) != (width, height):
+                    # Размер холста поменяли в настройках — собираем сцену заново
+                    compositor = self.compositors[scene.id] = Compositor(self.video_settings)
+                sources = [source for source in scene.sources if source.visible]
+                started = time.perf_counter()
+                if self._layer_pool is not None and len(sources) > 1:
+                    # Декодирование и масштабирование идут параллельно (OpenCV отпускает GIL),
+                    # смешивание — по порядку слоёв, как и в последовательном режиме
+                    layers = list(self._layer_pool.map(self._get_source_layer, sources))
+                else:
+                    layers = [self._get_source_layer(source) for source in sources]
+                prepared = time.perf_counter()
+                _sources_timer.record(prepared - started)
+                buf = compositor.compose([layer for layer in layers if layer is not None])
+                _compose_timer.record(time.perf_counter() - prepared)
+                return buf
+
+        raise ValueError(f"Scene not found: {scene_id}")
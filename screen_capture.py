@@ -1,70 +1,182 @@
-import cv2
+import threading
+import time
 import numpy as np
-import pyautogui
-from PIL import ImageGrab
-import pygetwindow as gw
-import win32gui
-import win32con
+from capture_backends import create_backend
+from frame_pool import FramePool, FrameSlot
+from stats import stage_timer
+from window_tracker import WindowTracker
+
+
+_capture_timer = stage_timer('capture')
+
 
 class ScreenCapture:
-    def __init__(self):
+    def __init__(self, backend=None, threaded=True, **backend_options):
+        """
+        :param backend: Capture backend name or CaptureBackend instance, None to choose at runtime
+        :param threaded: Capture on a background thread at self.fps instead of in get_frame
+        :param backend_options: Options passed to the backend when it is created by name
+        """
         self.is_capturing = False
         self.capture_region = None
         self.fps = 30
         self.window_title = None
+        self.threaded = threaded
+        self.backend = backend if backend is not None and not isinstance(backend, str) else None
+        self._backend_name = backend if isinstance(backend, str) else None
+        self._backend_options = backend_options
+        # Буфер возвращается в пул только когда его отпустят все читатели
+        self._pool = None
+        self.slot = FrameSlot()
+        self.window_tracker = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._backend_failed = False
 
-    def start_capture(self, region=None, window_title=None):
+    def _get_backend(self):
+        """
+        :return: Capture backend, None if there is none to capture with
+        """
+        if self.backend is None and not self._backend_failed:
+            try:
+                self.backend = create_backend(self._backend_name, **self._backend_options)
+            except (RuntimeError, ValueError) as e:
+                # Сообщаем один раз; без кадров источник рисуется заглушкой
+                print(f"Capture error: {str(e)}")
+                self._backend_failed = True
+        return self.backend
+
+    def start_capture(self, region=None, window_title=None, fps=None):
         """
         Start capturing the screen or a window
-        :param region: Tuple of (x, y, width, height) for region capture, None for full screen
+        :param region: Tuple of (left, top, right, bottom) for region capture, None for full screen
         :param window_title: Title of the window to capture, None for screen
+        :param fps: Capture rate of the background thread, None to keep the current one
         """
+        if self.is_capturing:
+            self.stop_capture()
         self.is_capturing = True
         self.capture_region = region
         self.window_title = window_title
+        if window_title:
+            self.window_tracker = WindowTracker(window_title)
+            self.window_tracker.start()
+        if fps:
+            self.fps = fps
+        if self.threaded:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._capture_loop, daemon=True, name="screen-capture")
+            self._thread.start()
 
     def stop_capture(self):
         """Stop capturing the screen"""
         self.is_capturing = False
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self.window_tracker:
+            self.window_tracker.stop()
+            self.window_tracker = None
         self.window_title = None
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = None
+        self._backend_failed = False
+        self.slot.clear()
 
     def get_frame(self):
         """
-        Get a single frame from the screen or window
+        Get a copy of the newest frame from the screen or window
         :return: numpy array containing the frame
         """
-        if not self.is_capturing:
+        _, buf = self.acquire_latest()
+        if buf is None:
             return None
+        frame = buf.array.copy()
+        buf.release()
+        return frame
+
+    def acquire_latest(self):
+        """
+        Take a reference to the newest frame. Never waits for a grab when threaded.
+        The caller must release() the returned buffer.
+        :return: Tuple of (sequence number, FrameBuffer or None)
+        """
+        if not self.is_capturing:
+            return (0, None)
+        if not self.threaded:
+            buf = self.grab_frame()
+            if buf is not None:
+                self.slot.publish(buf)
+        return self.slot.acquire()
 
+    def grab_frame(self):
+        """
+        Grab one frame synchronously into a pooled buffer
+        :return: FrameBuffer owned by the caller, None if nothing could be grabbed
+        """
         if self.window_title:
-            win = None
-            for w in gw.getWindowsWithTitle(self.window_title):
-                win = w
-                break
-            if win:
-                if win.width == 0 or win.height == 0:
-                    return None
-                bbox = (win.left, win.top, win.right, win.bottom)
-                try:
-                    screenshot = ImageGrab.grab(bbox=bbox)
-                except Exception:
-                    return None
-            else:
+            bbox = self._find_window_bbox()
+            if bbox is None:
                 return None
-        elif self.capture_region:
-            screenshot = ImageGrab.grab(bbox=self.capture_region)
         else:
-            screenshot = ImageGrab.grab()
+            bbox = self.capture_region
 
-        frame = np.array(screenshot)
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        return frame
+        backend = self._get_backend()
+        if backend is None:
+            return None
+        buf = self._pool.acquire() if self._pool is not None else None
+        started = time.perf_counter()
+        frame = backend.grab(region=bbox, out=buf.array if buf is not None else None)
+        _capture_timer.record(time.perf_counter() - started)
+        if frame is None:
+            if buf is not None:
+                buf.release()
+            return None
+        if buf is None or frame is not buf.array:
+            # Размер области изменился — заводим пул под новый размер
+            if buf is not None:
+                buf.release()
+            self._pool = FramePool(frame.shape)
+            buf = self._pool.acquire()
+            np.copyto(buf.array, frame)
+        return buf
+
+    def _capture_loop(self):
+        """Internal method that grabs frames at self.fps and publishes them"""
+        next_time = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                buf = self.grab_frame()
+            except Exception as e:
+                print(f"Capture error: {str(e)}")
+                buf = None
+            if buf is not None:
+                self.slot.publish(buf)
+            next_time += 1.0 / self.fps
+            delay = next_time - time.monotonic()
+            if delay < 0:
+                # Не успели — не пытаемся догонять пропущенные кадры
+                next_time = time.monotonic()
+                delay = 0
+            self._stop_event.wait(delay)
+
+    def _find_window_bbox(self):
+        """Bounding box (left, top, right, bottom) of the captured window, None if not found"""
+        if self.window_tracker is None:
+            return None
+        return self.window_tracker.get_bbox()
 
     def get_available_windows(self):
         """
         Get list of available window titles
         :return: List of window titles
         """
+        try:
+            import pygetwindow as gw
+        except (ImportError, NotImplementedError):
+            return []
         return [w.title for w in gw.getAllWindows() if w.title]
 
     def get_available_displays(self):
@@ -72,6 +184,7 @@ class ScreenCapture:
         Get list of available displays
         :return: List of display information
         """
+        import pyautogui
         displays = []
         for i in range(pyautogui.getActiveWindow()._getDisplayCount()):
             displays.append({
@@ -79,4 +192,4 @@ class ScreenCapture:
                 'name': f'Display {i+1}',
                 'resolution': pyautogui.getActiveWindow()._getDisplayResolution(i)
             })
-        return displays 
\ No newline at end of file
+        return displays
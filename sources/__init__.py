@@ -0,0 +1,64 @@
+import importlib
+
+# Тип источника -> модуль, который его обслуживает.
+# Модуль (и библиотеки, которые ему нужны) импортируется только при первом источнике этого типа.
+SOURCE_PROVIDERS = {
+    'image': 'sources.image',
+    'video': 'sources.video',
+    'browser': 'sources.browser',
+    'camera': 'sources.camera',
+    'screen': 'sources.capture',
+    'window': 'sources.capture'
+}
+
+_loaded = {}
+
+
+def load_provider(module_name):
+    """
+    Import a source provider module once.
+    A provider defines start(manager, source), stop(source) and get_frame(manager, source);
+    get_frame returns the current frame or None and keeps source.frame_seq up to date.
+    :param module_name: Module path, a value of SOURCE_PROVIDERS
+    :return: Provider module
+    """
+    provider = _loaded.get(module_name)
+    if provider is None:
+        provider = _loaded[module_name] = importlib.import_module(module_name)
+    return provider
+
+
+def update_frame(source, frame):
+    """
+    Remember the frame a provider produced and count changes in source.frame_seq
+    :param source: Source the frame belongs to
+    :param frame: New frame or None if there is none right now
+    :return: Frame to draw, the last good one if frame is None
+    """
+    if frame is None:
+        return source.last_frame
+    if frame is not source.last_frame:
+        source.last_frame = frame
+        source.frame_seq += 1
+    return frame
+
+
+def hold_frame(source, seq, buf):
+    """
+    Keep the pooled frame a provider produced until a newer one replaces it
+    :param source: Source the frame belongs to
+    :param seq: Sequence number of buf from its producer, stored as source.frame_seq
+    :param buf: FrameBuffer with one reference owned by the caller, None if there is none right now
+    :return: Frame to draw, the last good one if buf is None
+    """
+    if buf is not None:
+        if source.held_frame is None or seq != source.frame_seq:
+            # Держим ссылку, пока кадр может понадобиться композитору
+            if source.held_frame is not None:
+                source.held_frame.release()
+            source.held_frame = buf
+            source.frame_seq = seq
+        else:
+            buf.release()
+        source.last_frame = source.held_frame.array
+    return source.last_frame
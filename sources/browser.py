@@ -0,0 +1,17 @@
+from sources import update_frame
+
+
+def start(manager, source):
+    pass
+
+
+def stop(source):
+    pass
+
+
+def get_frame(manager, source):
+    # Заглушка для браузера
+    w, h = int(source.size[0]), int(source.size[1])
+    url = source.properties.get('url', 'browser')
+    frame = manager._get_stub_frame(('browser', url, w, h), (w, h), (40, 40, 60), f'Browser: {url}')
+    return update_frame(source, frame)
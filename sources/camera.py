@@ -0,0 +1,14 @@
+from sources import update_frame
+
+
+def start(manager, source):
+    pass
+
+
+def stop(source):
+    pass
+
+
+def get_frame(manager, source):
+    # Захват камеры пока не реализован: рисуется заглушка «Источник недоступен»
+    return update_frame(source, None)
@@ -0,0 +1,29 @@
+from screen_capture import ScreenCapture
+from sources import hold_frame
+
+
+def start(manager, source):
+    """
+    Create and start the capture of a screen/window source.
+    properties['backend'] selects the capture backend ('pil', 'x11shm', 'synthetic'),
+    properties['backend_options'] are passed to it, properties['fps'] sets the capture rate.
+    """
+    source.capture = ScreenCapture(backend=source.properties.get('backend'),
+                                   **source.properties.get('backend_options', {}))
+    fps = source.properties.get('fps', 30)
+    if source.type == 'screen':
+        source.capture.start_capture(region=source.properties.get('region'), fps=fps)
+    else:
+        source.capture.start_capture(window_title=source.properties.get('window_title'), fps=fps)
+
+
+def stop(source):
+    if source.capture:
+        source.capture.stop_capture()
+
+
+def get_frame(manager, source):
+    if source.capture is None:
+        return source.last_frame
+    # Берём последний готовый кадр из потока захвата, не дожидаясь нового
+    return hold_frame(source, *source.capture.acquire_latest())
@@ -0,0 +1,53 @@
+import os
+import cv2
+import numpy as np
+from PIL import Image
+from compositor import to_layer_frame
+from sources import update_frame
+
+
+def start(manager, source):
+    pass
+
+
+def stop(source):
+    pass
+
+
+def _load(manager, source):
+    """
+    Get the decoded image of a source, already resized to the source size
+    :param manager: SceneManager owning the image cache
+    :param source: Image source
+    :return: BGR or premultiplied BGRA array with the resized image
+    """
+    path = source.properties['file']
+    mtime = os.stat(path).st_mtime_ns
+    dst_w, dst_h = int(source.size[0]), int(source.size[1])
+    key = (path, mtime, dst_w, dst_h)
+    frame = manager.image_cache.get(key)
+    if frame is not None:
+        return frame
+    # Файл изменился — старые версии больше не нужны
+    manager.image_cache.discard(lambda k: k[0] == path and k[1] != mtime)
+    img = Image.open(path)
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+    else:
+        img = img.convert('RGB')
+    # Масштабируем уже предумноженный кадр, иначе на краях прозрачности появится ореол
+    frame = to_layer_frame(np.array(img))
+    src_h, src_w = frame.shape[:2]
+    new_w, new_h = manager._fit_size(src_w, src_h, dst_w, dst_h)
+    if new_w > 0 and new_h > 0 and (new_w, new_h) != (src_w, src_h):
+        frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    manager.image_cache.put(key, frame)
+    return frame
+
+
+def get_frame(manager, source):
+    try:
+        frame = _load(manager, source)
+    except Exception:
+        frame = None
+    return update_frame(source, frame)
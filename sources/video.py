@@ -0,0 +1,19 @@
+from video_decoder import VideoDecoder
+from sources import hold_frame
+
+
+def start(manager, source):
+    pass
+
+
+def stop(source):
+    if source.decoder:
+        source.decoder.stop()
+
+
+def get_frame(manager, source):
+    # Декодер запускается при первом кадре, а не при загрузке сцены
+    if source.decoder is None:
+        source.decoder = VideoDecoder(source.properties['file'])
+        source.decoder.start()
+    return hold_frame(source, *source.decoder.acquire_frame())
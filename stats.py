@@ -0,0 +1,172 @@
+import threading
+import numpy as np
+
+# Границы корзин гистограммы в миллисекундах (последняя — всё, что дольше)
+HISTOGRAM_EDGES_MS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 33, 66, 133, 266)
+
+
+class StageTimer:
+    def __init__(self, name, window=1024):
+        """
+        Rolling record of how long one pipeline stage takes.
+        record() only stores a number, everything else is computed when stats are read.
+        Concurrent writers (e.g. several capture threads) may occasionally overwrite each other's sample.
+        :param name: Stage name
+        :param window: Number of most recent samples kept for percentiles and the histogram
+        """
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self._samples = np.zeros(window, dtype=np.float64)
+
+    def record(self, seconds):
+        """
+        Add one measurement
+        :param seconds: Duration, e.g. the difference of two time.perf_counter() calls
+        """
+        self._samples[self.count % len(self._samples)] = seconds
+        self.count += 1
+        self.total += seconds
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+
+    def get_stats(self):
+        """
+        :return: Dictionary with the sample count, mean/p50/p95/p99/max in ms over the window
+                 and histogram counts per HISTOGRAM_EDGES_MS bucket
+        """
+        count = self.count
+        n = min(count, len(self._samples))
+        if n == 0:
+            return {'count': 0}
+        ms = self._samples[:n] * 1000.0
+        p50, p95, p99 = np.percentile(ms, (50, 95, 99))
+        bins = np.searchsorted(HISTOGRAM_EDGES_MS, ms, side='right')
+        return {
+            'count': count,
+            'mean_ms': float(ms.mean()),
+            'p50_ms': float(p50),
+            'p95_ms': float(p95),
+            'p99_ms': float(p99),
+            'max_ms': float(ms.max()),
+            'total_s': self.total,
+            'histogram': np.bincount(bins, minlength=len(HISTOGRAM_EDGES_MS) + 1).tolist()
+        }
+
+
+class StatsRegistry:
+    def __init__(self):
+        """
+        Stage timers of the whole pipeline plus counters published by its components.
+        Components create their timers once with timer() and register a provider
+        returning their counters (dropped, duplicated, late frames...).
+        """
+        self._timers = {}
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    def timer(self, name):
+        """
+        Get the timer of a stage, creating it on first use
+        :param name: Stage name, e.g. 'compose' or 'write_video'
+        :return: StageTimer
+        """
+        timer = self._timers.get(name)
+        if timer is None:
+            with self._lock:
+                timer = self._timers.get(name)
+                if timer is None:
+                    timer = StageTimer(name)
+                    # Копия при записи: читатели обходят словарь без блокировки
+                    timers = dict(self._timers)
+                    timers[name] = timer
+                    self._timers = timers
+        return timer
+
+    def register(self, name, provider):
+        """
+        Publish the counters of a component
+        :param name: Component name, e.g. 'render' or 'output'; replaces an earlier provider
+        :param provider: Callable returning a dictionary
+        """
+        with self._lock:
+            providers = dict(self._providers)
+            providers[name] = provider
+            self._providers = providers
+
+    def unregister(self, name, provider=None):
+        """
+        Remove a provider
+        :param provider: Only remove if it is still this callable
+        """
+        with self._lock:
+            if name in self._providers and (provider is None or self._providers[name] == provider):
+                providers = dict(self._providers)
+                del providers[name]
+                self._providers = providers
+
+    def reset(self):
+        """Clear all stage timers"""
+        for timer in self._timers.values():
+            timer.reset()
+
+    def get_stats(self):
+        """
+        :return: Dictionary with 'stages' (timer stats by name), 'components'
+                 (counters of each provider) and 'histogram_edges_ms'
+        """
+        components = {}
+        for name, provider in self._providers.items():
+            try:
+                components[name] = provider()
+            except Exception as e:
+                components[name] = {'error': str(e)}
+        return {
+            'stages': {name: timer.get_stats() for name, timer in self._timers.items()},
+            'components': components,
+            'histogram_edges_ms': list(HISTOGRAM_EDGES_MS)
+        }
+
+
+# Общий реестр: этапы разных модулей попадают в одну сводку
+registry = StatsRegistry()
+
+
+def stage_timer(name):
+    """Timer of a stage in the shared registry"""
+    return registry.timer(name)
+
+
+def get_stats():
+    """Stats of the whole pipeline from the shared registry"""
+    return registry.get_stats()
+
+
+def format_stats(stats, stages=None):
+    """
+    Short text summary for an overlay or a log
+    :param stats: Result of get_stats()
+    :param stages: Stage names to include, None for all that have samples
+    :return: List of lines
+    """
+    lines = []
+    render = stats['components'].get('render')
+    if render:
+        lines.append(f"render {render['fps']} fps  frames {render['frames']}  late {render['late_frames']}")
+    output = stats['components'].get('output')
+    if output and output.get('is_encoding'):
+        clock = output.get('clock') or {}
+        lines.append(f"encoder dropped {output['queue_dropped_frames']}  "
+                     f"dup {clock.get('frames_duplicated', 0)}  late {clock.get('frames_dropped', 0)}  "
+                     f"A/V {clock.get('av_offset_ms', 0.0):+.0f} ms")
+        for name, sink in output['sinks'].items():
+            if sink and sink['dropped_chunks']:
+                lines.append(f"sink {name} dropped {sink['dropped_chunks']}")
+    for name, stage in stats['stages'].items():
+        if (stages is not None and name not in stages) or not stage.get('count'):
+            continue
+        lines.append(f"{name:<17} p50 {stage['p50_ms']:6.2f}  p95 {stage['p95_ms']:6.2f}  "
+                     f"max {stage['max_ms']:6.1f} ms")
+    return lines
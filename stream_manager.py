@@ -1,18 +1,16 @@
-import cv2
-import numpy as np
-import threading
-import queue
-import time
-import subprocess
-import ffmpeg
+from output_manager import OutputManager, RTMPSink
+
 
 class StreamManager:
-    def __init__(self):
+    SINK_NAME = 'stream'
+
+    def __init__(self, video_settings=None, output_manager=None):
+        """
+        :param video_settings: Shared VideoSettings, used when no output manager is given
+        :param output_manager: Shared OutputManager; streaming reuses its encoder
+        """
+        self.output_manager = output_manager or OutputManager(video_settings)
         self.is_streaming = False
-        self.stream_thread = None
-        self.frame_queue = queue.Queue(maxsize=30)
-        self.audio_queue = queue.Queue(maxsize=30)
-        self.ffmpeg_process = None
         self.stream_url = None
         self.stream_key = None
 
@@ -22,99 +20,52 @@ class StreamManager:
         :param stream_url: RTMP server URL
         :param stream_key: Stream key for authentication
         """
-        if not self.is_streaming:
-            self.stream_url = stream_url
-            self.stream_key = stream_key
-            self.is_streaming = True
-            self.stream_thread = threading.Thread(target=self._stream_worker)
-            self.stream_thread.start()
+        if self.is_streaming:
+            return
+        self.stream_url = stream_url
+        self.stream_key = stream_key
+        self.output_manager.add_sink(self.SINK_NAME, RTMPSink(f'{stream_url}/{stream_key}'))
+        self.is_streaming = True
 
     def stop_stream(self):
-        """Stop the current stream"""
+        """Stop the current stream; the encoder keeps running for other outputs"""
+        if not self.is_streaming:
+            return
         self.is_streaming = False
-        if self.stream_thread:
-            self.stream_thread.join()
-        if self.ffmpeg_process:
-            self.ffmpeg_process.terminate()
-            self.ffmpeg_process = None
+        self.output_manager.remove_sink(self.SINK_NAME)
 
-    def add_frame(self, frame):
+    def add_frame(self, frame, pts=None):
         """
-        Add a video frame to the stream queue
-        :param frame: numpy array containing the frame
+        Add a video frame to the shared encoder. The frame must not be modified afterwards.
+        With a shared output manager register only one of its feeders as a render output.
+        :param frame: FrameBuffer or numpy array containing the frame
+        :param pts: Presentation time on the master clock, None for now
         """
-        if self.is_streaming and not self.frame_queue.full():
-            self.frame_queue.put(frame)
+        self.output_manager.add_frame(frame, pts)
 
-    def add_audio(self, audio_data):
+    def add_audio(self, audio_data, pts=None):
         """
-        Add audio data to the stream queue
-        :param audio_data: numpy array containing audio samples
+        Add audio data to the shared encoder
+        :param audio_data: FrameBuffer or numpy array (samples, channels) of float32 samples
+        :param pts: Presentation time of the first sample on the master clock
         """
-        if self.is_streaming and not self.audio_queue.full():
-            self.audio_queue.put(audio_data)
-
-    def _stream_worker(self):
-        """Internal method to handle streaming"""
-        try:
-            # Configure FFmpeg command
-            command = [
-                'ffmpeg',
-                '-f', 'rawvideo',
-                '-pix_fmt', 'bgr24',
-                '-s', '1920x1080',  # Adjust based on your capture resolution
-                '-r', '30',
-                '-i', 'pipe:0',
-                '-f', 'f32le',
-                '-ar', '44100',
-                '-ac', '2',
-                '-i', 'pipe:1',
-                '-c:v', 'libx264',
-                '-preset', 'veryfast',
-                '-b:v', '3000k',
-                '-maxrate', '3000k',
-                '-bufsize', '6000k',
-                '-pix_fmt', 'yuv420p',
-                '-g', '50',
-                '-c:a', 'aac',
-                '-b:a', '128k',
-                '-ar', '44100',
-                '-f', 'flv',
-                f'{self.stream_url}/{self.stream_key}'
-            ]
-
-            # Start FFmpeg process
-            self.ffmpeg_process = subprocess.Popen(
-                command,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-
-            while self.is_streaming:
-                # Get frame from queue
-                if not self.frame_queue.empty():
-                    frame = self.frame_queue.get()
-                    self.ffmpeg_process.stdin.write(frame.tobytes())
-
-                # Get audio from queue
-                if not self.audio_queue.empty():
-                    audio_data = self.audio_queue.get()
-                    self.ffmpeg_process.stdin.write(audio_data.tobytes())
-
-                time.sleep(1/30)  # Maintain 30 FPS
-
-        except Exception as e:
-            print(f"Streaming error: {str(e)}")
-            self.stop_stream()
+        self.output_manager.add_audio(audio_data, pts)
 
     def get_stream_status(self):
         """
         Get current streaming status
         :return: Dictionary containing streaming status information
         """
+        status = self.output_manager.get_status()
+        sink = status['sinks'].get(self.SINK_NAME) or {}
         return {
             'is_streaming': self.is_streaming,
-            'queue_size': self.frame_queue.qsize(),
-            'stream_url': self.stream_url
-        } 
\ No newline at end of file
+            'queue_size': status['queue_size'],
+            'audio_queue_size': status['audio_queue_size'],
+            'dropped_frames': status['dropped_frames'],
+            'dropped_chunks': sink.get('dropped_chunks', 0),
+            'error': sink.get('error') or status['error'],
+            'stream_url': self.stream_url,
+            # Повторённые и опоздавшие кадры, смещение звука — общие для всех выходов
+            'clock': status['clock']
+        }
@@ -0,0 +1,99 @@
+import cv2
+import numpy as np
+
+
+class Transition:
+    """Blend between two program frames; progress goes from 0 (old scene) to 1 (new scene)"""
+    name = None
+
+    def __init__(self, duration_ms=500):
+        """
+        :param duration_ms: Transition length in milliseconds
+        """
+        self.duration_ms = max(1, int(duration_ms))
+
+    def render(self, from_frame, to_frame, progress, out):
+        """
+        Draw one transition frame
+        :param from_frame: Frame of the scene being left
+        :param to_frame: Frame of the scene being switched to, same shape
+        :param progress: Position in the transition, 0..1
+        :param out: Array to draw into, same shape
+        """
+        raise NotImplementedError
+
+
+class FadeTransition(Transition):
+    name = 'fade'
+
+    def render(self, from_frame, to_frame, progress, out):
+        # Смешивание прямо в uint8, без перевода кадров во float
+        cv2.addWeighted(from_frame, 1.0 - progress, to_frame, progress, 0, dst=out)
+
+
+class SlideTransition(Transition):
+    """The new scene pushes the old one out to the left"""
+    name = 'slide'
+
+    def render(self, from_frame, to_frame, progress, out):
+        w = out.shape[1]
+        # Плавный старт и остановка
+        offset = int(round(w * progress * progress * (3 - 2 * progress)))
+        out[:, :w - offset] = from_frame[:, offset:]
+        out[:, w - offset:] = to_frame[:, :offset]
+
+
+class WipeTransition(Transition):
+    """The new scene is revealed from left to right behind a soft edge"""
+    name = 'wipe'
+
+    def __init__(self, duration_ms=500, edge=64):
+        """
+        :param duration_ms: Transition length in milliseconds
+        :param edge: Width of the soft edge in pixels
+        """
+        super().__init__(duration_ms)
+        self.edge = edge
+        self._ramp = None
+
+    def render(self, from_frame, to_frame, progress, out):
+        w = out.shape[1]
+        edge = min(self.edge, w)
+        # Край проходит весь кадр целиком: от -edge до w
+        x0 = int(round((w + edge) * progress)) - edge
+        x1 = x0 + edge
+        left, right = max(0, x0), min(w, x1)
+        out[:, :left] = to_frame[:, :left]
+        out[:, max(left, x1):] = from_frame[:, max(left, x1):]
+        if left < right:
+            if self._ramp is None or len(self._ramp) != edge:
+                # Вес нового кадра на краю: 255 слева, 0 справа
+                self._ramp = np.linspace(255, 0, edge).astype(np.uint16)[None, :, None]
+            weight = self._ramp[:, left - x0:right - x0]
+            band = to_frame[:, left:right] * weight + from_frame[:, left:right] * (255 - weight)
+            out[:, left:right] = (band + 127) // 255
+
+
+class CutTransition(Transition):
+    name = 'cut'
+
+    def __init__(self, duration_ms=0):
+        super().__init__(1)
+
+    def render(self, from_frame, to_frame, progress, out):
+        out[:] = to_frame
+
+
+TRANSITIONS = {cls.name: cls for cls in (CutTransition, FadeTransition, SlideTransition, WipeTransition)}
+
+
+def create_transition(name='fade', duration_ms=500):
+    """
+    Create a transition by name
+    :param name: One of TRANSITIONS
+    :param duration_ms: Transition length in milliseconds
+    :return: Transition
+    """
+    if name not in TRANSITIONS:
+        raise ValueError(f"Unknown transition: {name}")
+    return TRANSITIONS[name](duration_ms)
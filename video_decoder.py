@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import deque
+import imageio
+from compositor import to_layer_frame, layer_frame_shape
+from frame_pool import FramePool
+from stats import stage_timer
+
+_decode_timer = stage_timer('decode')
+
+
+class VideoDecoder:
+    def __init__(self, path, buffer_size=8, pause_gap=0.25):
+        """
+        Background decoder for a looping video file
+        :param path: Path to the video file
+        :param buffer_size: Number of decoded frames kept ready ahead of playback
+        :param pause_gap: Seconds without get_frame() calls after which playback counts as paused
+                          (e.g. its scene was not shown) and resumes where it stopped
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self.pause_gap = pause_gap
+        self.fps = 30.0
+        self.is_running = False
+        self.error = None
+        self._frames = deque()  # (pts в секундах, FrameBuffer)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._clock_start = None
+        self._last_call = None
+        self._current = None  # FrameBuffer показываемого кадра, ссылка принадлежит декодеру
+        self._pool = None
+        self.seq = 0  # Номер показываемого кадра, растёт с каждой сменой кадра
+
+    def start(self):
+        """Start the decoder thread"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self._thread = threading.Thread(target=self._decode_worker, daemon=True,
+                                        name=f"video-{self.path}")
+        self._thread.start()
+
+    def stop(self):
+        """Stop the decoder thread and drop buffered frames"""
+        self.is_running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        while self._frames:
+            self._frames.popleft()[1].release()
+        if self._current is not None:
+            self._current.release()
+            self._current = None
+        self._clock_start = None
+
+    def acquire_frame(self):
+        """
+        Take a reference to the frame matching the playback clock. Never blocks on decoding.
+        The caller must release() the returned buffer.
+        :return: Tuple of (sequence number, FrameBuffer or None if nothing has been decoded yet)
+        """
+        now = time.monotonic()
+        with self._cond:
+            if self._clock_start is None:
+                if not self._frames:
+                    return (self.seq, None)
+                # Часы воспроизведения стартуют с первым показанным кадром
+                self._clock_start = now - self._frames[0][0]
+            elif now - self._last_call > max(self.pause_gap, 2.0 / self.fps):
+                # Видео не показывали — продолжаем с того же места, а не проматываем пропущенное
+                self._clock_start += now - self._last_call
+            self._last_call = now
+            clock = now - self._clock_start
+            popped = False
+            while self._frames and (self._current is None or self._frames[0][0] <= clock):
+                if self._current is not None:
+                    self._current.release()
+                self._current = self._frames.popleft()[1]
+                self.seq += 1
+                popped = True
+            if popped:
+                self._cond.notify()
+            return (self.seq, self._current.retain())
+
+    def _decode_worker(self):
+        """Internal method that reads the file sequentially, looping at the end"""
+        offset = 0.0
+        while self.is_running:
+            try:
+                reader = imageio.get_reader(self.path)
+            except Exception as e:
+                self.error = e
+                self.is_running = False
+                return
+            try:
+                meta = reader.get_meta_data()
+                fps = meta.get('fps')
+                if not fps and meta.get('duration'):
+                    # У GIF вместо fps длительность кадра в мс
+                    fps = 1000.0 / meta['duration']
+                self.fps = float(fps or 30.0)
+                count = 0
+                frames = iter(reader)
+                while True:
+                    started = time.perf_counter()
+                    frame = next(frames, None)
+                    if frame is None:
+                        break
+                    shape = layer_frame_shape(frame)
+                    if self._pool is None or self._pool.shape != shape:
+                        # Очередь, показываемый кадр и кадр у источника
+                        self._pool = FramePool(shape, max_free=self.buffer_size + 2)
+                    buf = self._pool.acquire()
+                    to_layer_frame(frame, out=buf.array)
+                    # Кадр imageio больше не нужен — не держим его, пока ждём места в очереди
+                    frame = None
+                    _decode_timer.record(time.perf_counter() - started)
+                    with self._cond:
+                        while self.is_running and len(self._frames) >= self.buffer_size:
+                            self._cond.wait()
+                        if not self.is_running:
+                            buf.release()
+                            return
+                        self._frames.append((offset + count / self.fps, buf))
+                    count += 1
+                if count == 0:
+                    self.error = ValueError(f"No frames in {self.path}")
+                    self.is_running = False
+                    return
+                # Бесшовная петля: следующий проход продолжает временную шкалу
+                offset += count / self.fps
+            except Exception as e:
+                self.error = e
+                self.is_running = False
+                return
+            finally:
+                reader.close()
@@ -0,0 +1,78 @@
+from dataclasses import dataclass, asdict, replace
+import cv2
+
+# Фильтры масштабирования холста до выходного размера
+SCALE_FILTERS = {
+    'nearest': cv2.INTER_NEAREST,
+    'bilinear': cv2.INTER_LINEAR,
+    'bicubic': cv2.INTER_CUBIC,
+    'area': cv2.INTER_AREA,
+    'lanczos': cv2.INTER_LANCZOS4,
+}
+
+
+@dataclass
+class VideoSettings:
+    """
+    Video format shared by every stage: scenes are composed on the base canvas,
+    scaled once to the output size and sent to the recorder and the stream at fps.
+    One instance is shared; update() changes it in place so all holders see the change.
+    """
+    base_width: int = 1920  # Холст, на котором собираются сцены
+    base_height: int = 1080
+    output_width: int = 1920  # Кадр, который уходит в запись и трансляцию
+    output_height: int = 1080
+    fps: int = 30
+    scale_filter: str = 'area'
+
+    def __post_init__(self):
+        self.validate()
+
+    def validate(self):
+        """Raise ValueError if the settings cannot be used"""
+        for name in ('base_width', 'base_height', 'output_width', 'output_height'):
+            value = getattr(self, name)
+            # yuv420p требует чётных размеров
+            if value <= 0 or value % 2:
+                raise ValueError(f"{name} must be a positive even number, got {value}")
+        if self.fps <= 0:
+            raise ValueError(f"fps must be positive, got {self.fps}")
+        if self.scale_filter not in SCALE_FILTERS:
+            raise ValueError(f"Unknown scale filter: {self.scale_filter}")
+
+    @property
+    def base_size(self):
+        return (self.base_width, self.base_height)
+
+    @property
+    def output_size(self):
+        return (self.output_width, self.output_height)
+
+    @property
+    def needs_scaling(self):
+        return self.base_size != self.output_size
+
+    @property
+    def interpolation(self):
+        """OpenCV interpolation flag of the scale filter"""
+        return SCALE_FILTERS[self.scale_filter]
+
+    def update(self, **values):
+        """
+        Change settings in place; nothing is changed if the new values are invalid
+        :param values: Field values, e.g. output_width=1280, output_height=720
+        """
+        values = {k: v for k, v in values.items() if k in asdict(self)}
+        # replace() проверяет новые значения до того, как мы их применим
+        checked = replace(self, **values)
+        for name, value in asdict(checked).items():
+            setattr(self, name, value)
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        settings = cls()
+        settings.update(**(data or {}))
+        return settings
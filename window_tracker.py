@@ -0,0 +1,136 @@
+import sys
+import threading
+
+
+class _Win32Windows:
+    """Window lookup through win32gui: one EnumWindows pass, then cheap GetWindowRect calls"""
+
+    def __init__(self):
+        import win32gui
+        self._win32gui = win32gui
+
+    def resolve(self, title):
+        """
+        Find a visible top-level window whose title contains the given one, like pygetwindow.
+        An exact title match wins over a partial one.
+        :return: hwnd, None if there is no such window
+        """
+        matches = []
+
+        def check(hwnd, _):
+            if self._win32gui.IsWindowVisible(hwnd):
+                text = self._win32gui.GetWindowText(hwnd)
+                if title in text:
+                    matches.append((text != title, hwnd))
+            return True
+
+        self._win32gui.EnumWindows(check, None)
+        # Окна перечисляются сверху вниз: при равенстве берём верхнее
+        return min(matches, key=lambda match: match[0])[1] if matches else None
+
+    def geometry(self, handle):
+        if not self._win32gui.IsWindow(handle):
+            return None
+        if self._win32gui.IsIconic(handle):
+            # Свёрнуто: окно на месте, но захватывать нечего
+            return (0, 0, 0, 0)
+        return tuple(self._win32gui.GetWindowRect(handle))
+
+
+class _PyGetWindowWindows:
+    """Window lookup through pygetwindow (macOS and Windows without pywin32)"""
+
+    def __init__(self):
+        import pygetwindow
+        self._gw = pygetwindow
+
+    def resolve(self, title):
+        for w in self._gw.getWindowsWithTitle(title):
+            return w
+        return None
+
+    def geometry(self, handle):
+        try:
+            return (handle.left, handle.top, handle.right, handle.bottom)
+        except Exception:
+            # Окно закрыто
+            return None
+
+
+def _create_window_api():
+    if sys.platform == 'win32':
+        try:
+            return _Win32Windows()
+        except ImportError:
+            pass
+    try:
+        return _PyGetWindowWindows()
+    except (ImportError, NotImplementedError):
+        # pygetwindow не поддерживает Linux
+        return None
+
+
+class WindowTracker:
+    def __init__(self, title, poll_interval=0.25):
+        """
+        Track the geometry of a window by title without enumerating windows on every frame.
+        The resolved handle is cached and looked up again only when the window is gone.
+        :param title: Window title or a part of it
+        :param poll_interval: Seconds between geometry refreshes on the background thread
+        """
+        self.title = title
+        self.poll_interval = poll_interval
+        self.handle = None
+        self.resolve_count = 0
+        self._bbox = None
+        self._api = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """Resolve the window and start refreshing its geometry"""
+        if self._thread:
+            return
+        self._api = _create_window_api()
+        self.refresh()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._poll_worker, daemon=True, name="window-tracker")
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background refresh"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.handle = None
+        self._bbox = None
+
+    def get_bbox(self):
+        """
+        Get the cached window geometry
+        :return: Tuple of (left, top, right, bottom), None if the window is missing or minimized
+        """
+        return self._bbox
+
+    def refresh(self):
+        """Update the cached geometry, re-resolving the title only if the window disappeared"""
+        if self._api is None:
+            self._bbox = None
+            return
+        try:
+            bbox = self._api.geometry(self.handle) if self.handle is not None else None
+            if bbox is None:
+                self.handle = self._api.resolve(self.title)
+                self.resolve_count += 1
+                bbox = self._api.geometry(self.handle) if self.handle is not None else None
+        except Exception:
+            self.handle = None
+            bbox = None
+        if bbox is not None and (bbox[2] - bbox[0] <= 0 or bbox[3] - bbox[1] <= 0):
+            bbox = None
+        self._bbox = bbox
+
+    def _poll_worker(self):
+        while not self._stop_event.wait(self.poll_interval):
+            self.refresh()